@@ -18,21 +18,47 @@
 import json
 import logging
 import sys
-from typing import Optional
+from typing import Dict, Optional, Iterable, Iterator, Tuple
 from urllib import parse as urllib_parse
 
 import xbmcgui
 import xbmcplugin
+import xbmcvfs
 
-from . import tvmaze_api, data_service
-from .utils import get_episode_order, ADDON
+from . import (tvmaze_api, data_service, cache_manager, cache_schema, cache_snapshot, deadline,
+               library_planner, metrics, nfo_parser, profiling, request_scheduler)
+from .cache_service import CACHE_DIR, STATS_FILE
+from .utils import get_episode_order, run_in_background, wait_for_background_tasks, ADDON
 
-HANDLE = int(sys.argv[1])
+# The scraper service imports this module without a plugin handle
+HANDLE = int(sys.argv[1]) if len(sys.argv) > 1 else -1
+# The number of directory items passed to Kodi in one addDirectoryItems call
+DIRECTORY_BATCH_SIZE = 500
 
 
-def find_show(title: str, year: Optional[str] = None) -> None:
-    """Find a show by title"""
-    search_results = data_service.search_show(title, year)
+def _add_directory_items(items: Iterable[Tuple[str, xbmcgui.ListItem]],
+                         total_items: int = 0) -> None:
+    """
+    Pass directory items to Kodi in batches
+
+    This is much faster than calling addDirectoryItem for each item
+    for long lists because each call crosses the Python/C++ boundary.
+
+    :param items: an iterable of (url, list_item) tuples
+    :param total_items: the total number of items
+    """
+    batch = []
+    for url, list_item in items:
+        batch.append((url, list_item, True))
+        if len(batch) >= DIRECTORY_BATCH_SIZE:
+            xbmcplugin.addDirectoryItems(HANDLE, batch, total_items)
+            batch = []
+    if batch:
+        xbmcplugin.addDirectoryItems(HANDLE, batch, total_items)
+
+
+def _iter_search_result_items(
+        search_results: Iterable[data_service.InfoType]) -> Iterator[Tuple[str, xbmcgui.ListItem]]:
     for search_result in search_results:
         show_name = search_result['name']
         if search_result.get('premiered'):
@@ -41,12 +67,13 @@ def find_show(title: str, year: Optional[str] = None) -> None:
         list_item = data_service.add_main_show_info(list_item, search_result, False)
         # Below "url" is some unique ID string (may be an actual URL to a show page)
         # that is used to get information about a specific TV show.
-        xbmcplugin.addDirectoryItem(
-            HANDLE,
-            url=str(search_result['id']),
-            listitem=list_item,
-            isFolder=True
-        )
+        yield str(search_result['id']), list_item
+
+
+def find_show(title: str, year: Optional[str] = None) -> None:
+    """Find a show by title"""
+    search_results = data_service.search_show(title, year)
+    _add_directory_items(_iter_search_result_items(search_results), len(search_results))
 
 
 def parse_nfo_file(nfo: str, full_nfo: bool):
@@ -63,20 +90,23 @@ def parse_nfo_file(nfo: str, full_nfo: bool):
     is_tvshow_nfo = True
     logging.debug('Trying to parse NFO file:\n%s', nfo)
     info = None
-    if '<episodedetails>' in nfo:
+    scan_result = nfo_parser.scan_nfo(nfo)
+    if scan_result.kind == nfo_parser.EPISODE_NFO:
         if full_nfo:
             return
         is_tvshow_nfo = False
-        info = data_service.parse_episode_xml_nfo(nfo)
+        # We cannot resolve an episode by alternative IDs or by title/year from TVmaze API,
+        # so the NFO is not parsed if it has no TVmaze ID
+        if scan_result.may_have_tvmaze_id:
+            info = data_service.parse_episode_xml_nfo(nfo)
         if info is None:
-            # We cannot resolve an episode by alternative IDs or by title/year from TVmaze API
             return
-    if info is None and '<tvshow>' in nfo:
+    if info is None and scan_result.kind == nfo_parser.TVSHOW_NFO:
         if full_nfo:
             return
         info = data_service.parse_tvshow_xml_nfo(nfo)
     if info is None:
-        info = data_service.parse_url_nfo(nfo)
+        info = data_service.get_show_info_by_url_id(scan_result.url_id)
     if info is not None:
         list_item = xbmcgui.ListItem(offscreen=True)
         id_string = str(info['id'])
@@ -95,7 +125,10 @@ def parse_nfo_file(nfo: str, full_nfo: bool):
         )
 
 
-def get_details(show_id: Optional[str], default_rating: str, unique_ids: Optional[str] = None) -> None:
+def get_details(show_id: Optional[str],
+                default_rating: str,
+                episode_order: str,
+                unique_ids: Optional[str] = None) -> None:
     """Get details about a specific show"""
     logging.debug('Getting details for show id %s', show_id)
     if not show_id and unique_ids is not None:
@@ -109,6 +142,10 @@ def get_details(show_id: Optional[str], default_rating: str, unique_ids: Optiona
         list_item = data_service.add_main_show_info(list_item, show_info,
                                                     default_rating=default_rating)
         xbmcplugin.setResolvedUrl(HANDLE, True, list_item)
+        if ADDON.getSettingBool('prefetch_episodes'):
+            # Kodi almost always requests the episode list right after show details
+            run_in_background(data_service.get_episodes_map, str(show_info['id']),
+                              episode_order)
         return
     xbmcplugin.setResolvedUrl(HANDLE, False, xbmcgui.ListItem(offscreen=True))
 
@@ -132,24 +169,17 @@ def get_episode_list(episodeguide: str, episode_order: str) -> None:  # pylint:
         show_id = episodeguide
     if show_id is not None:
         episodes_map = data_service.get_episodes_map(show_id, episode_order)
-        for episode in episodes_map.values():
-            list_item = xbmcgui.ListItem(episode['name'], offscreen=True)
-            data_service.add_episode_info(list_item, episode, full_info=False)
-            encoded_ids = urllib_parse.urlencode({
-                'show_id': show_id,
-                'episode_id': str(episode['id']),
-                'season': str(episode['season']),
-                'episode': str(episode['number']),
-            })
-            # Below "url" is some unique ID string (it may be an actual URL to an episode page)
-            # that allows to retrieve information about a specific episode.
-            url = urllib_parse.quote(encoded_ids)
-            xbmcplugin.addDirectoryItem(
-                HANDLE,
-                url=url,
-                listitem=list_item,
-                isFolder=True
-            )
+        _add_directory_items(_iter_episode_items(show_id, episodes_map), len(episodes_map))
+
+
+def _iter_episode_items(
+        show_id: str,
+        episodes: Iterable[data_service.InfoType]) -> Iterator[Tuple[str, xbmcgui.ListItem]]:
+    url_template = data_service.get_episode_url_template(show_id)
+    for episode in episodes:
+        list_item = xbmcgui.ListItem(episode['name'], offscreen=True)
+        data_service.add_episode_info(list_item, episode, full_info=False)
+        yield url_template.format_map(episode), list_item
 
 
 def get_episode_details(encoded_ids: str, episode_order: str) -> None:  # pylint: disable=missing-docstring
@@ -186,6 +216,49 @@ def get_artwork(show_id: str) -> None:
             xbmcplugin.setResolvedUrl(HANDLE, False, xbmcgui.ListItem(offscreen=True))
 
 
+def dump_stats() -> None:
+    """Write scraper stats collected by all scraper processes to the Kodi log"""
+    metrics.flush(STATS_FILE)
+    logging.info('TVmaze scraper stats:\n%s', metrics.format_stats(metrics.load_stats(STATS_FILE)))
+
+
+def export_cache(path: str) -> None:
+    """Export the disk cache to a snapshot file (see :mod:`cache_snapshot`)"""
+    cache_snapshot.export_snapshot(CACHE_DIR, xbmcvfs.translatePath(path))
+
+
+def import_cache(path: str) -> None:
+    """Import a cache snapshot, e.g. on a newly provisioned box"""
+    cache_snapshot.import_snapshot(xbmcvfs.translatePath(path), CACHE_DIR)
+
+
+def upgrade_cache() -> None:
+    """Upgrade all disk cache entries to the current schema versions at once"""
+    counts = cache_schema.upgrade_directory(CACHE_DIR)
+    logging.info('Upgraded cache entries: %s', counts)
+
+
+def _run_maintenance_action(params: Dict[str, str]) -> bool:
+    """
+    Run an action that is not called by Kodi library scanner
+
+    :return: False if the action is unknown
+    """
+    if params['action'] == 'stats':
+        dump_stats()
+    elif params['action'] == 'exportcache':
+        export_cache(params['path'])
+    elif params['action'] == 'importcache':
+        import_cache(params['path'])
+    elif params['action'] == 'upgradecache':
+        upgrade_cache()
+    elif params['action'] == 'warmup':
+        library_planner.warm_up_library()
+    else:
+        return False
+    return True
+
+
 def router(paramstring: str) -> None:
     """
     Route addon calls
@@ -193,8 +266,40 @@ def router(paramstring: str) -> None:
     :param paramstring: url-encoded query string
     :raises RuntimeError: on unknown call action
     """
+    try:
+        handle_call(paramstring)
+    finally:
+        finish_call()
+
+
+def handle_call(paramstring: str) -> None:
+    """
+    Handle an addon call and pass the result to Kodi
+
+    :param paramstring: url-encoded query string
+    :raises RuntimeError: on unknown call action
+    """
+    try:
+        with profiling.profile_call(paramstring):
+            _route(paramstring)
+    finally:
+        deadline.clear()
+        request_scheduler.set_lane(None)
+
+
+def finish_call() -> None:
+    """Do housekeeping after the result of an addon call has been passed to Kodi"""
+    # The result has already been passed to Kodi, so background tasks do not block it
+    wait_for_background_tasks()
+    cache_manager.maybe_collect_garbage()
+    metrics.flush(STATS_FILE)
+
+
+def _route(paramstring: str) -> None:
     params = dict(urllib_parse.parse_qsl(paramstring))
     logging.debug('Called addon with params: %s', str(sys.argv))
+    deadline.start(params['action'])
+    request_scheduler.set_lane_for_action(params['action'])
     path_settings = json.loads(params.get('pathSettings') or '{}')
     logging.debug('Path settings: %s', path_settings)
     episode_order = get_episode_order(path_settings)
@@ -211,13 +316,13 @@ def router(paramstring: str) -> None:
     elif params['action'] == 'getdetails':
         url = params.get('url')
         unique_ids = params.get('uniqueIDs')
-        get_details(url, default_rating, unique_ids)
+        get_details(url, default_rating, episode_order, unique_ids)
     elif params['action'] == 'getepisodelist':
         get_episode_list(params['url'], episode_order)
     elif params['action'] == 'getepisodedetails':
         get_episode_details(params['url'], episode_order)
     elif params['action'] == 'getartwork':
         get_artwork(params.get('id'))
-    else:
+    elif not _run_maintenance_action(params):
         raise RuntimeError(f'Invalid addon call: {sys.argv}')
     xbmcplugin.endOfDirectory(HANDLE)
@@ -0,0 +1,197 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Storage backends for cache tiers
+
+A backend stores text entries by key together with the time when
+an entry was fetched from upstream, so the freshness of an entry
+does not depend on the tier it has been loaded from.
+
+* :class:`DirectoryBackend` - files in a directory. It is used for the local
+  cache and for a shared cache in a network folder mounted on all Kodi instances.
+* :class:`HttpKeyValueBackend` - a simple HTTP key-value store that handles
+  ``GET`` and ``PUT`` requests to ``{base_url}/{key}``.
+
+Backend errors are logged and handled as cache misses.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, NamedTuple, Optional
+from urllib import error as urllib_error
+from urllib import parse as urllib_parse
+from urllib import request as urllib_request
+
+from .file_utils import FileLock, write_file_atomic
+
+HTTP_TIMEOUT = 2.0  # seconds
+# An unavailable HTTP store is not queried for this period
+HTTP_RETRY_PERIOD = 60.0  # seconds
+
+
+class CacheEntry(NamedTuple):
+    data: str
+    fetched_at: float
+
+
+class CacheBackend:
+    """Base class for cache backends"""
+    name = ''
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get a cache entry
+
+        :param key: entry key
+        :return: cache entry or None if the entry is not found or unavailable
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, data: str, fetched_at: float) -> None:
+        """
+        Save a cache entry
+
+        :param key: entry key
+        :param data: entry contents
+        :param fetched_at: the time when the entry was fetched from upstream
+        """
+        raise NotImplementedError
+
+
+class DirectoryBackend(CacheBackend):
+    """
+    Cache entries as ``{key}.json`` files
+
+    The modification time of a file is the time when the entry was fetched,
+    and the access time is updated on reads for LRU eviction.
+    """
+    name = 'directory'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        path = self._get_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as fo:
+                data = fo.read()
+            fetched_at = os.path.getmtime(path)
+        except OSError as exc:
+            logging.debug('Cache entry %s is not available in %s: %s', key, self.directory, exc)
+            return None
+        try:
+            os.utime(path, (time.time(), fetched_at))
+        except OSError:
+            pass
+        return CacheEntry(data, fetched_at)
+
+    def set(self, key: str, data: str, fetched_at: float) -> None:
+        path = self._get_path(key)
+        try:
+            write_file_atomic(path, data)
+            os.utime(path, (time.time(), fetched_at))
+        except OSError as exc:
+            logging.warning('Unable to save cache entry %s to %s: %s', key, self.directory, exc)
+
+
+class HttpKeyValueBackend(CacheBackend):
+    """
+    Cache entries in an HTTP key-value store
+
+    An entry is stored as a JSON object ``{"fetched_at": ..., "data": ...}``.
+    The store must return 404 for missing keys.
+
+    An unavailable store is not queried for :data:`HTTP_RETRY_PERIOD`.
+    The retry time is saved to the state file, so short-lived scraper
+    processes do not wait for the timeout of an unavailable store again.
+
+    :param base_url: store URL
+    :param timeout: request timeout in seconds
+    :param state_file: path to a JSON file with retry times by store URL
+    """
+    name = 'http'
+
+    def __init__(self, base_url: str, timeout: float = HTTP_TIMEOUT,
+                 state_file: Optional[str] = None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._state_file = state_file
+        self._retry_at = 0.0
+
+    def _get_url(self, key: str) -> str:
+        return f'{self.base_url}/{urllib_parse.quote(key)}'
+
+    def _load_state(self) -> Dict[str, float]:
+        try:
+            with open(self._state_file, 'r', encoding='utf-8') as fo:
+                state = json.loads(fo.read())
+        except (IOError, ValueError):
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def _is_available(self) -> bool:
+        if time.time() < self._retry_at:
+            return False
+        if self._state_file is not None:
+            # Another process may have found the store unavailable
+            self._retry_at = self._load_state().get(self.base_url, 0.0)
+        return time.time() >= self._retry_at
+
+    def _mark_unavailable(self, exc: Exception) -> None:
+        logging.warning('Shared cache %s is unavailable: %s', self.base_url, exc)
+        self._retry_at = time.time() + HTTP_RETRY_PERIOD
+        if self._state_file is None:
+            return
+        try:
+            with FileLock(self._state_file + '.lock', timeout=1.0):
+                state = self._load_state()
+                state[self.base_url] = self._retry_at
+                write_file_atomic(self._state_file, json.dumps(state))
+        except (OSError, TimeoutError) as state_exc:
+            logging.debug('Unable to save shared cache state: %s', state_exc)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        if not self._is_available():
+            return None
+        try:
+            with urllib_request.urlopen(self._get_url(key), timeout=self.timeout) as response:
+                record = json.loads(response.read().decode('utf-8'))
+            return CacheEntry(record['data'], float(record['fetched_at']))
+        except urllib_error.HTTPError as exc:
+            if exc.code != 404:
+                self._mark_unavailable(exc)
+        except OSError as exc:
+            self._mark_unavailable(exc)
+        except (ValueError, KeyError, TypeError) as exc:
+            logging.debug('Invalid shared cache entry %s: %s', key, exc)
+        return None
+
+    def set(self, key: str, data: str, fetched_at: float) -> None:
+        if not self._is_available():
+            return
+        body = json.dumps({'fetched_at': fetched_at, 'data': data}).encode('utf-8')
+        request = urllib_request.Request(self._get_url(key), data=body, method='PUT',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib_request.urlopen(request, timeout=self.timeout):
+                pass
+        except OSError as exc:
+            self._mark_unavailable(exc)
@@ -0,0 +1,169 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Size-bounded garbage collection for the disk cache
+
+Cache entries are evicted in LRU order when the total size or the number
+of entries exceeds the limits set in addon settings. The last access time
+of an entry is its file access time that is updated explicitly
+on each cache read, so it does not depend on filesystem mount options.
+
+Garbage collection is incremental: it runs at most once
+per :data:`GC_INTERVAL` and evicts at most :data:`MAX_EVICTIONS_PER_RUN`
+entries per run, so it is cheap enough to be called at the end
+of each addon call after the result has been passed to Kodi.
+"""
+
+import logging
+import os
+import time
+from typing import List, NamedTuple
+
+from . import metrics
+from .cache_service import CACHE_DIR
+from .utils import ADDON
+
+GC_INTERVAL = 60 * 60  # 1 hour
+MAX_EVICTIONS_PER_RUN = 500
+# Leftovers of crashed processes are removed after this period
+ORPHAN_FILE_AGE = 60 * 60  # 1 hour
+ORPHAN_FILE_EXTENSIONS = ('.tmp', '.lock', '.revalidating')
+GC_MARKER_FILE = os.path.join(CACHE_DIR, 'gc.marker')
+GC_LOCK_FILE = os.path.join(CACHE_DIR, 'gc.lock')
+# Files with shared scraper state that are never evicted
+STATE_FILES = frozenset((
+    metrics.STATS_FILE_NAME,
+    'circuit_breakers.json',
+    'revalidation_queue.json',
+    'external_ids.json',
+    'rate_limits.json',
+    'shared_cache_state.json',
+))
+DEFAULT_MAX_SIZE_MB = 50
+DEFAULT_MAX_ENTRIES = 5000
+
+
+class CacheEntry(NamedTuple):
+    path: str
+    size: int
+    last_access: float
+
+
+def _is_gc_due() -> bool:
+    try:
+        return time.time() - os.path.getmtime(GC_MARKER_FILE) > GC_INTERVAL
+    except OSError:
+        return True
+
+
+def _claim_gc_run() -> bool:
+    """Make sure that only one scraper process runs garbage collection at a time"""
+    try:
+        if time.time() - os.path.getmtime(GC_LOCK_FILE) < ORPHAN_FILE_AGE:
+            return False
+        os.remove(GC_LOCK_FILE)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(GC_LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError:
+        return False
+
+
+def _scan_cache_dir() -> List[CacheEntry]:
+    """
+    Collect cache entries and remove orphaned and empty files
+
+    :return: the list of cache entries
+    """
+    entries = []
+    now = time.time()
+    with os.scandir(CACHE_DIR) as dir_entries:
+        for dir_entry in dir_entries:
+            if not dir_entry.is_file() or dir_entry.name in STATE_FILES:
+                continue
+            stat = dir_entry.stat()
+            if dir_entry.name.endswith(ORPHAN_FILE_EXTENSIONS):
+                if now - stat.st_mtime > ORPHAN_FILE_AGE and dir_entry.path != GC_LOCK_FILE:
+                    _remove_file(dir_entry.path)
+                continue
+            if not dir_entry.name.endswith('.json'):
+                continue
+            if not stat.st_size:
+                _remove_file(dir_entry.path)
+                continue
+            entries.append(CacheEntry(dir_entry.path, stat.st_size, stat.st_atime))
+    return entries
+
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError as exc:
+        logging.debug('Unable to remove cache file %s: %s', path, exc)
+        return False
+
+
+def collect_garbage(max_size: int, max_entries: int) -> int:
+    """
+    Evict least recently used cache entries until the cache fits the limits
+
+    :param max_size: max total size of cache entries in bytes
+    :param max_entries: max number of cache entries
+    :return: the number of evicted entries
+    """
+    entries = _scan_cache_dir()
+    total_size = sum(entry.size for entry in entries)
+    entries_count = len(entries)
+    if total_size <= max_size and entries_count <= max_entries:
+        return 0
+    entries.sort(key=lambda entry: entry.last_access)
+    evicted = 0
+    for entry in entries:
+        if ((total_size <= max_size and entries_count <= max_entries)
+                or evicted >= MAX_EVICTIONS_PER_RUN):
+            break
+        if _remove_file(entry.path):
+            total_size -= entry.size
+            entries_count -= 1
+            evicted += 1
+            metrics.record_cache('disk', 'eviction')
+    logging.debug('Evicted %s cache entries. Cache size: %s bytes in %s entries',
+                  evicted, total_size, entries_count)
+    return evicted
+
+
+def maybe_collect_garbage() -> None:
+    """
+    Run garbage collection for the disk cache if it is due
+
+    This function must be called only after the result of an addon call
+    has been passed to Kodi.
+    """
+    if not _is_gc_due() or not _claim_gc_run():
+        return
+    try:
+        max_size = (ADDON.getSettingInt('cache_max_size') or DEFAULT_MAX_SIZE_MB) * 1024 * 1024
+        max_entries = ADDON.getSettingInt('cache_max_entries') or DEFAULT_MAX_ENTRIES
+        collect_garbage(max_size, max_entries)
+        with open(GC_MARKER_FILE, 'w', encoding='utf-8'):
+            pass
+    except OSError as exc:
+        logging.warning('Cache garbage collection failed: %s', exc)
+    finally:
+        _remove_file(GC_LOCK_FILE)
@@ -0,0 +1,94 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Adaptive freshness policy for cached show data
+
+TTLs are picked per show and per data type depending on show status,
+the time of the last show update on TVmaze and the next episode air time:
+
+* Ended shows rarely change, so they are cached for a long time.
+* Running shows are revalidated shortly after their next episode airs.
+* Recently updated shows are likely to be updated again, so their TTLs are capped.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# (show info TTL, episode list TTL) by show status
+STATUS_TTLS = {
+    'Ended': (30 * DAY, 7 * DAY),
+    'Running': (DAY, 6 * HOUR),
+    'To Be Determined': (3 * DAY, DAY),
+    'In Development': (3 * DAY, DAY),
+}
+DEFAULT_TTLS = (DAY, 6 * HOUR)
+MIN_TTL = 10 * 60  # 10 minutes
+# Cap for shows updated on TVmaze within RECENT_UPDATE_PERIOD
+RECENTLY_UPDATED_TTL = DAY
+RECENT_UPDATE_PERIOD = 7 * DAY
+# Revalidate after a new episode airs and TVmaze editors add episode details
+AIRING_GRACE_PERIOD = 2 * HOUR
+
+
+def _get_next_airstamp(show_info: Dict[str, Any]) -> Optional[float]:
+    next_episode = (show_info.get('_embedded') or {}).get('nextepisode') or {}
+    airstamp = next_episode.get('airstamp')
+    if not airstamp:
+        return None
+    try:
+        return datetime.fromisoformat(airstamp).timestamp()
+    except ValueError:
+        return None
+
+
+def _get_ttl(show_info: Dict[str, Any], base_ttl: float, fetched_at: float) -> float:
+    ttl = base_ttl
+    updated = show_info.get('updated')
+    if updated and fetched_at - updated < RECENT_UPDATE_PERIOD:
+        ttl = min(ttl, RECENTLY_UPDATED_TTL)
+    next_airstamp = _get_next_airstamp(show_info)
+    if next_airstamp is not None and next_airstamp > fetched_at:
+        ttl = min(ttl, next_airstamp - fetched_at + AIRING_GRACE_PERIOD)
+    return max(ttl, MIN_TTL)
+
+
+def get_show_info_ttl(show_info: Dict[str, Any], fetched_at: float) -> float:
+    """
+    Get TTL for cached show info
+
+    :param show_info: show info from TVmaze
+    :param fetched_at: the timestamp when show info was fetched
+    :return: TTL in seconds
+    """
+    base_ttl = STATUS_TTLS.get(show_info.get('status'), DEFAULT_TTLS)[0]
+    return _get_ttl(show_info, base_ttl, fetched_at)
+
+
+def get_episodes_ttl(show_info: Optional[Dict[str, Any]], fetched_at: float) -> float:
+    """
+    Get TTL for a cached episode list of a show
+
+    :param show_info: show info from TVmaze or None if show info is not available
+    :param fetched_at: the timestamp when the episode list was fetched
+    :return: TTL in seconds
+    """
+    if show_info is None:
+        return MIN_TTL
+    base_ttl = STATUS_TTLS.get(show_info.get('status'), DEFAULT_TTLS)[1]
+    return _get_ttl(show_info, base_ttl, fetched_at)
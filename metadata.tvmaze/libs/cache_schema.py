@@ -0,0 +1,250 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Schema versions and migrations of cache records
+
+Cached values are saved in an envelope ``{"schema_version": N, "value": ...}``.
+Records saved before schema versioning have no envelope and have version 0.
+
+When a change in the addon changes the format of cached values, the version
+of the record type in :data:`SCHEMA_VERSIONS` is increased and a migration
+from the previous version is registered with :func:`migration` decorator.
+Old records are upgraded when they are read and saved back, or in bulk
+from the command line::
+
+    cd metadata.tvmaze
+    python -m libs.cache_schema /path/to/temp/scrapers/metadata.tvmaze
+
+A migration that cannot produce the new format without data from TVmaze
+is registered with ``needs_refresh=True``. Such records are upgraded
+as far as possible and returned as stale, so they are refreshed
+gradually with the stale-while-revalidate logic instead of all at once.
+The module depends only on the standard library.
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from .cache_backends import DirectoryBackend
+from .episode_store import EpisodeStore
+
+SHOW_INFO = 'show_info'
+IMDB_RATING = 'imdb_rating'
+EPISODES_MAP = 'episodes_map'
+# Current schema versions by record type
+SCHEMA_VERSIONS = {
+    SHOW_INFO: 1,
+    IMDB_RATING: 1,
+    EPISODES_MAP: 3,
+}
+SCHEMA_VERSION_KEY = 'schema_version'
+VALUE_KEY = 'value'
+# Record types of disk cache entries by key prefix. Show info keys are TVmaze show IDs.
+KEY_PREFIXES = (
+    ('imdb_', IMDB_RATING),
+    ('episodes_', EPISODES_MAP),
+)
+
+MigrationFunction = Callable[[Any], Any]
+
+
+class Migration(NamedTuple):
+    function: MigrationFunction
+    needs_refresh: bool
+
+
+class UnpackedRecord(NamedTuple):
+    value: Any
+    # The value has been upgraded and should be saved back
+    is_upgraded: bool
+    # The value is usable but must be refreshed from TVmaze
+    needs_refresh: bool
+
+
+# Migrations by (record type, source version)
+_migrations: Dict[Tuple[str, int], Migration] = {}
+
+
+def migration(record_type: str, from_version: int,
+              needs_refresh: bool = False) -> Callable[[MigrationFunction], MigrationFunction]:
+    """
+    Register a function that upgrades a value of ``from_version`` to the next version
+
+    :param record_type: record type
+    :param from_version: schema version of the source value
+    :param needs_refresh: the upgraded value must be refreshed from TVmaze
+    """
+    def decorator(function: MigrationFunction) -> MigrationFunction:
+        _migrations[(record_type, from_version)] = Migration(function, needs_refresh)
+        return function
+    return decorator
+
+
+def get_record_type(key: str) -> Optional[str]:
+    """
+    Get the record type of a disk cache entry by its key
+
+    :param key: entry key (file name without extension)
+    :return: record type or None if the file is not a cache entry
+    """
+    if key.isdigit():
+        return SHOW_INFO
+    for prefix, record_type in KEY_PREFIXES:
+        if key.startswith(prefix):
+            return record_type
+    return None
+
+
+def pack(record_type: str, value: Any) -> Dict[str, Any]:
+    """Put a value into a record envelope with the current schema version"""
+    return {SCHEMA_VERSION_KEY: SCHEMA_VERSIONS[record_type], VALUE_KEY: value}
+
+
+def upgrade(record_type: str, value: Any, version: int) -> Optional[UnpackedRecord]:
+    """
+    Upgrade a value to the current schema version
+
+    :param record_type: record type
+    :param value: cached value
+    :param version: schema version of the value
+    :return: upgraded value or None if the value cannot be upgraded
+    """
+    current_version = SCHEMA_VERSIONS[record_type]
+    if version > current_version:
+        logging.debug('%s record of schema version %s is newer than %s',
+                      record_type, version, current_version)
+        return None
+    needs_refresh = False
+    is_upgraded = version < current_version
+    while version < current_version:
+        migration_ = _migrations.get((record_type, version))
+        if migration_ is None:
+            logging.warning('No migration for %s records of schema version %s',
+                            record_type, version)
+            return None
+        try:
+            value = migration_.function(value)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as exc:
+            logging.debug('Unable to upgrade %s record of schema version %s: %s',
+                          record_type, version, exc)
+            return None
+        needs_refresh = needs_refresh or migration_.needs_refresh
+        version += 1
+    return UnpackedRecord(value, is_upgraded, needs_refresh)
+
+
+def unpack(record_type: str, record: Any) -> Optional[UnpackedRecord]:
+    """
+    Extract a value from a record envelope and upgrade it to the current schema version
+
+    :param record_type: record type
+    :param record: decoded record
+    :return: unpacked value or None if the record cannot be used
+    """
+    if isinstance(record, dict) and SCHEMA_VERSION_KEY in record and VALUE_KEY in record:
+        return upgrade(record_type, record[VALUE_KEY], record[SCHEMA_VERSION_KEY])
+    return upgrade(record_type, record, 0)
+
+
+@migration(SHOW_INFO, 0)
+def _sort_show_images(show_info: Dict[str, Any]) -> Dict[str, Any]:
+    # Old versions of the addon saved show images in TVmaze order
+    images = (show_info.get('_embedded') or {}).get('images')
+    if isinstance(images, list):
+        images.sort(key=lambda image: image['main'], reverse=True)
+    return show_info
+
+
+@migration(IMDB_RATING, 0)
+@migration(EPISODES_MAP, 0)
+def _add_envelope(value: Any) -> Any:
+    # Version 1 of these records differs from version 0 only in the envelope
+    return value
+
+
+@migration(EPISODES_MAP, 1)
+def _add_episode_indexes(episodes: Dict[str, Any]) -> Dict[str, Any]:
+    # Version 2 kept episodes together with secondary indexes
+    # that are not needed to upgrade to later versions
+    return {'episodes': episodes}
+
+
+@migration(EPISODES_MAP, 2)
+def _convert_to_episode_store(episodes_map: Dict[str, Any]) -> str:
+    # Version 3 is a serialized columnar episode store
+    return EpisodeStore.from_episodes(episodes_map['episodes'].values()).to_text()
+
+
+def upgrade_directory(cache_dir: str) -> Dict[str, int]:
+    """
+    Upgrade all cache entries in a directory to the current schema versions
+
+    Entries keep their fetch times. Entries that cannot be upgraded are removed,
+    and entries saved by newer versions of the addon (e.g. in a shared folder) are kept.
+
+    :param cache_dir: cache directory
+    :return: the number of upgraded entries by record type
+    """
+    backend = DirectoryBackend(cache_dir)
+    counts: Dict[str, int] = {}
+    with os.scandir(cache_dir) as dir_entries:
+        file_names = [dir_entry.name for dir_entry in dir_entries if dir_entry.is_file()]
+    for file_name in file_names:
+        key, extension = os.path.splitext(file_name)
+        record_type = get_record_type(key)
+        if extension != '.json' or record_type is None:
+            continue
+        entry = backend.get(key)
+        if entry is None:
+            continue
+        try:
+            record = json.loads(entry.data)
+        except ValueError:
+            record = None
+        if (isinstance(record, dict)
+                and record.get(SCHEMA_VERSION_KEY, 0) > SCHEMA_VERSIONS[record_type]):
+            continue
+        unpacked = unpack(record_type, record)
+        if unpacked is None:
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except OSError:
+                pass
+            continue
+        if unpacked.is_upgraded:
+            upgraded_record = pack(record_type, unpacked.value)
+            if record_type == EPISODES_MAP:
+                upgraded_record['ttl'] = record.get('ttl', 0)
+            backend.set(key, json.dumps(upgraded_record), entry.fetched_at)
+            counts[record_type] = counts.get(record_type, 0) + 1
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Upgrade TVmaze scraper cache entries to the current schema versions')
+    parser.add_argument('cache_dir', help='scraper cache directory or a shared cache folder')
+    args = parser.parse_args()
+    counts = upgrade_directory(args.cache_dir)
+    print('Upgraded: ' + (', '.join(f'{record_type}: {count}'
+                                    for record_type, count in sorted(counts.items())) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
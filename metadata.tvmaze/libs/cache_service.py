@@ -19,19 +19,36 @@ import json
 import logging
 import os
 import time
-from typing import Optional, Text, Dict, Any, Union
+from typing import (Optional, Dict, Any, Union, NamedTuple, List, Iterable, Tuple,
+                    Callable)
 
 import xbmcgui
 import xbmcvfs
 
-from .utils import ADDON_ID
+from . import cache_policy, cache_schema, metrics
+from .cache_backends import CacheBackend, CacheEntry, DirectoryBackend, HttpKeyValueBackend
+from .episode_store import EpisodeStore
+from .file_utils import FileLock, write_file_atomic
+from .utils import ADDON, ADDON_ID
 
-EPISODES_CACHE_TTL = 60 * 10  # 10 minutes
+EPISODES_CACHE_TTL = cache_policy.MIN_TTL  # Default TTL if show info is not available
+# Only one process refreshes a stale cache entry within this period
+REVALIDATION_CLAIM_TIMEOUT = 60  # seconds
+
+
+class CachedItem(NamedTuple):
+    value: Any
+    is_stale: bool
 
 
 class MemoryCache:
     _instance = None
     CACHE_KEY = f'__{ADDON_ID}_cache__'
+    CACHE_ID_KEY = f'__{ADDON_ID}_cache_id__'
+    CACHE_VERSION_KEY = f'__{ADDON_ID}_cache_version__'
+    RECORD_TYPE = cache_schema.EPISODES_MAP
+    # The last cached record kept decoded in a long-lived process (e.g. the scraper service)
+    _local_record: Dict[str, Any] = {}
 
     def __new__(cls):
         if cls._instance is None:
@@ -41,16 +58,61 @@ class MemoryCache:
     def __init__(self):
         self._window = xbmcgui.Window(10000)
 
-    def set(self, obj_id: Union[int, str], obj: Any) -> None:
+    def set(self, obj_id: Union[int, str], obj: Any, ttl: float = EPISODES_CACHE_TTL) -> None:
         cache = {
             'id': obj_id,
             'timestamp': time.time(),
+            'ttl': ttl,
             'object': obj,
+            cache_schema.SCHEMA_VERSION_KEY: cache_schema.SCHEMA_VERSIONS[self.RECORD_TYPE],
         }
         cache_json = json.dumps(cache)
+        # The ID is stored separately to detect evictions without decoding the cached object
+        cached_id = self._window.getProperty(self.CACHE_ID_KEY)
+        if cached_id and cached_id != str(obj_id):
+            metrics.record_cache('memory', 'eviction')
         self._window.setProperty(self.CACHE_KEY, cache_json)
+        self._window.setProperty(self.CACHE_ID_KEY, str(obj_id))
+        self._window.setProperty(self.CACHE_VERSION_KEY, str(cache['timestamp']))
+        MemoryCache._local_record = cache
 
     def get(self, obj_id: Union[int, str]) -> Optional[Any]:
+        cached_item = self.get_item(obj_id)
+        if cached_item is None or cached_item.is_stale:
+            return None
+        return cached_item.value
+
+    def get_item(self, obj_id: Union[int, str]) -> Optional[CachedItem]:
+        """Get a cached object including an expired one"""
+        cache = self._get_record()
+        if cache is None:
+            metrics.record_cache('memory', 'miss')
+            return None
+        if cache['id'] != obj_id:
+            logging.debug('Memory cache miss')
+            metrics.record_cache('memory', 'miss')
+            return None
+        if time.time() - cache['timestamp'] > cache.get('ttl', EPISODES_CACHE_TTL):
+            logging.debug('Memory cache expired')
+            metrics.record_cache('memory', 'expired')
+            return CachedItem(cache['object'], True)
+        logging.debug('Memory cache hit')
+        metrics.record_cache('memory', 'hit')
+        return CachedItem(cache['object'], False)
+
+    def _get_record(self) -> Optional[Dict[str, Any]]:
+        """
+        Get the cached record
+
+        The decoded record from the previous call is reused if no other process
+        has replaced it, so the JSON round-trip is skipped. A record saved
+        by an older version of the addon is upgraded to the current schema.
+        """
+        local_record = MemoryCache._local_record
+        if (local_record
+                and self._window.getProperty(self.CACHE_VERSION_KEY)
+                == str(local_record['timestamp'])):
+            return local_record
         cache_json = self._window.getProperty(self.CACHE_KEY)
         if not cache_json:
             logging.debug('Memory cache empty')
@@ -60,20 +122,179 @@ class MemoryCache:
         except ValueError as exc:
             logging.debug(f'Memory cache error: {exc}')
             return None
-        if cache['id'] != obj_id or time.time() - cache['timestamp'] > EPISODES_CACHE_TTL:
-            logging.debug('Memory cache miss')
+        unpacked = cache_schema.upgrade(self.RECORD_TYPE, cache.get('object'),
+                                        cache.get(cache_schema.SCHEMA_VERSION_KEY, 0))
+        if unpacked is None:
             return None
-        logging.debug('Memory cache hit')
-        return cache['object']
+        cache['object'] = unpacked.value
+        if unpacked.needs_refresh:
+            cache['ttl'] = 0
+        MemoryCache._local_record = cache
+        return cache
+
+
+# The last decoded episode store and its serialized text, so a long-lived process
+# does not decode the same store again on every call
+_decoded_episode_store: Tuple[Optional[str], Optional[EpisodeStore]] = (None, None)
+
+
+def _get_episodes_map_key(show_id: Union[int, str], episode_order: str) -> str:
+    return f'episodes_{show_id}_{episode_order}'
+
+
+def _decode_episode_store(text: str) -> Optional[EpisodeStore]:
+    global _decoded_episode_store  # pylint: disable=global-statement
+    decoded_text, episode_store = _decoded_episode_store
+    if text == decoded_text:
+        return episode_store
+    try:
+        episode_store = EpisodeStore.from_text(text)
+    except (TypeError, ValueError) as exc:
+        logging.debug('Invalid cached episode store: %s', exc)
+        return None
+    _decoded_episode_store = (text, episode_store)
+    return episode_store
+
+
+def cache_episodes_map(show_id: Union[int, str],
+                       episodes_map: EpisodeStore,
+                       episode_order: str = 'default') -> None:
+    """
+    Save processed episodes map to cache
+
+    The episode store is cached in its compact serialized form.
+
+    TTL depends on the status and the next episode air time of the show
+    if show info is cached. The map is written to the memory cache and
+    through the disk cache to the shared cache. The disk and shared records
+    keep the TTL with their fetch time, so the map survives Kodi restarts
+    and other Kodi instances do not re-download the episode list.
+    """
+    fetched_at = time.time()
+    cached_show_info = load_cached_show_info(show_id)
+    show_info = cached_show_info.value if cached_show_info is not None else None
+    ttl = cache_policy.get_episodes_ttl(show_info, fetched_at)
+    logging.debug('Caching episodes map for show %s for %s seconds', show_id, ttl)
+    global _decoded_episode_store  # pylint: disable=global-statement
+    value = episodes_map.to_text()
+    _decoded_episode_store = (value, episodes_map)
+    key = _get_episodes_map_key(show_id, episode_order)
+    MemoryCache().set(key, value, ttl)
+    data = json.dumps(dict(cache_schema.pack(cache_schema.EPISODES_MAP, value), ttl=ttl))
+    LOCAL_BACKEND.set(key, data, fetched_at)
+    shared_backend = get_shared_backend()
+    if shared_backend is not None:
+        shared_backend.set(key, data, fetched_at)
 
 
-def cache_episodes_map(show_id: Union[int, str], episodes_map: Dict[Text, Any]) -> None:
-    MemoryCache().set(int(show_id), episodes_map)
+def load_episodes_map_from_cache(show_id: Union[int, str],
+                                 episode_order: str = 'default') -> Optional[EpisodeStore]:
+    episodes_map = MemoryCache().get(_get_episodes_map_key(show_id, episode_order))
+    return _decode_episode_store(episodes_map) if episodes_map is not None else None
 
 
-def load_episodes_map_from_cache(show_id: Union[int, str]) -> Optional[Dict[str, Any]]:
-    episodes_map = MemoryCache().get(int(show_id))
-    return episodes_map
+def _get_time_left(stored_record: 'StoredRecord') -> float:
+    """
+    Get the rest of TTL of an episodes map record in the disk or the shared cache
+
+    The TTL is set by :func:`cache_policy.get_episodes_ttl` when the map
+    is fetched, so it counts from the fetch time in all tiers.
+    """
+    if stored_record.needs_refresh:
+        return 0.0
+    ttl = stored_record.ttl if stored_record.ttl is not None else EPISODES_CACHE_TTL
+    return ttl - (time.time() - stored_record.fetched_at)
+
+
+def _read_episodes_entry(
+        backend: CacheBackend, key: str
+) -> Tuple[Optional['StoredRecord'], Optional[EpisodeStore]]:
+    stored_record = _read_entry(backend, key, cache_schema.EPISODES_MAP)
+    if stored_record is None:
+        return None, None
+    episode_store = _decode_episode_store(stored_record.value)
+    return (stored_record, episode_store) if episode_store is not None else (None, None)
+
+
+def has_fresh_episodes_map(show_id: Union[int, str], episode_order: str = 'default') -> bool:
+    """
+    Check if a fresh episodes map is in the disk or the shared cache
+
+    Only record envelopes are read, so the check does not decode
+    the episode store. A fresh map from the shared cache is copied
+    to the disk cache.
+
+    :param show_id: TVmaze show ID
+    :param episode_order: episode order
+    """
+    key = _get_episodes_map_key(show_id, episode_order)
+    local_record = _read_entry(LOCAL_BACKEND, key, cache_schema.EPISODES_MAP)
+    if local_record is not None and _get_time_left(local_record) > 0:
+        return True
+    shared_backend = get_shared_backend()
+    if shared_backend is None:
+        return False
+    shared_record = _read_entry(shared_backend, key, cache_schema.EPISODES_MAP)
+    if shared_record is None or _get_time_left(shared_record) <= 0:
+        return False
+    LOCAL_BACKEND.set(key, shared_record.data, shared_record.fetched_at)
+    return True
+
+
+def load_cached_episodes_map(show_id: Union[int, str],
+                             episode_order: str = 'default') -> Optional[CachedItem]:
+    """
+    Load episodes map from cache including an expired one
+
+    The map is looked up in the memory cache, then in the disk cache
+    and then in the shared cache. Each tier checks the expiration time
+    of its own record. A fresh map found in a lower tier is promoted
+    to the upper tiers for the rest of its TTL, so the processed map is reused
+    after Kodi restarts and after other shows have replaced it
+    in the single-entry memory cache, but it does not outlive its TTL.
+
+    :param show_id: TVmaze show ID
+    :param episode_order: episode order
+    :return: cached item with :class:`episode_store.EpisodeStore` value or None
+    """
+    cached_item = None
+    key = _get_episodes_map_key(show_id, episode_order)
+    # Maps of the same show in different episode orders are different records
+    memory_item = MemoryCache().get_item(key)
+    if memory_item is not None:
+        episode_store = _decode_episode_store(memory_item.value)
+        if episode_store is not None:
+            cached_item = CachedItem(episode_store, memory_item.is_stale)
+            if not cached_item.is_stale:
+                return cached_item
+    local_record, local_store = _read_episodes_entry(LOCAL_BACKEND, key)
+    if local_record is not None:
+        time_left = _get_time_left(local_record)
+        if time_left > 0:
+            metrics.record_cache('episodes_disk', 'hit')
+            MemoryCache().set(key, local_record.value, time_left)
+            return CachedItem(local_store, False)
+        metrics.record_cache('episodes_disk', 'expired')
+        cached_item = cached_item or CachedItem(local_store, True)
+    else:
+        metrics.record_cache('episodes_disk', 'miss')
+    shared_backend = get_shared_backend()
+    if shared_backend is None:
+        return cached_item
+    shared_record, shared_store = _read_episodes_entry(shared_backend, key)
+    if shared_record is None or (local_record is not None
+                                 and shared_record.fetched_at <= local_record.fetched_at):
+        metrics.record_cache('shared', 'miss')
+        return cached_item
+    LOCAL_BACKEND.set(key, shared_record.data, shared_record.fetched_at)
+    time_left = _get_time_left(shared_record)
+    if time_left <= 0:
+        metrics.record_cache('shared', 'expired')
+        return CachedItem(shared_store, True)
+    logging.debug('Loaded %s from the shared cache', key)
+    metrics.record_cache('shared', 'hit')
+    MemoryCache().set(key, shared_record.value, time_left)
+    return CachedItem(shared_store, False)
 
 
 def _get_cache_directory() -> str:  # pylint: disable=missing-docstring
@@ -87,32 +308,403 @@ def _get_cache_directory() -> str:  # pylint: disable=missing-docstring
 
 
 CACHE_DIR = _get_cache_directory()
+STATS_FILE = os.path.join(CACHE_DIR, metrics.STATS_FILE_NAME)
+LOCAL_BACKEND = DirectoryBackend(CACHE_DIR)
+
+# "shared_cache" setting values
+SHARED_CACHE_DISABLED = 0
+SHARED_CACHE_DIRECTORY = 1
+SHARED_CACHE_HTTP = 2
+# Retry times of unavailable HTTP shared caches
+SHARED_CACHE_STATE_FILE = os.path.join(CACHE_DIR, 'shared_cache_state.json')
+# The shared backend with the settings it has been created for
+_shared_backend: Optional[Tuple[Tuple[int, str], Optional[CacheBackend]]] = None
+
+
+def _get_shared_backend_settings() -> Tuple[int, str]:
+    shared_cache = ADDON.getSettingInt('shared_cache')
+    if shared_cache == SHARED_CACHE_DIRECTORY:
+        path = xbmcvfs.translatePath(ADDON.getSetting('shared_cache_path'))
+        if isinstance(path, bytes):
+            path = path.decode('utf-8')
+        return shared_cache, path
+    if shared_cache == SHARED_CACHE_HTTP:
+        return shared_cache, ADDON.getSetting('shared_cache_url')
+    return SHARED_CACHE_DISABLED, ''
+
+
+def get_shared_backend() -> Optional[CacheBackend]:
+    """
+    Get the shared cache tier configured in addon settings
+
+    :return: shared cache backend or None if the shared cache is disabled
+    """
+    global _shared_backend  # pylint: disable=global-statement
+    settings = _get_shared_backend_settings()
+    if _shared_backend is not None and _shared_backend[0] == settings:
+        return _shared_backend[1]
+    shared_cache, location = settings
+    backend: Optional[CacheBackend] = None
+    if shared_cache == SHARED_CACHE_DIRECTORY and location:
+        try:
+            os.makedirs(location, exist_ok=True)
+        except OSError as exc:
+            logging.warning('Unable to create shared cache folder %s: %s', location, exc)
+        backend = DirectoryBackend(location)
+    elif shared_cache == SHARED_CACHE_HTTP and location:
+        backend = HttpKeyValueBackend(location, state_file=SHARED_CACHE_STATE_FILE)
+    _shared_backend = (settings, backend)
+    return backend
+
+
+class StoredRecord(NamedTuple):
+    value: Any
+    fetched_at: float
+    # The value must be refreshed from TVmaze after a schema upgrade
+    needs_refresh: bool
+    # Encoded record for copying to another tier
+    data: str
+    ttl: Optional[float]
+
+
+class ShowInfoState(NamedTuple):
+    is_stale: bool
+    # The time when cached show info expires or has expired
+    expires_at: float
+    status: Optional[str]
+
+
+def _read_entry(backend: CacheBackend, key: str, record_type: str) -> Optional[StoredRecord]:
+    """
+    Read a cache entry and upgrade it to the current schema version
+
+    An upgraded entry is saved back to the backend with the same fetch time.
+    """
+    entry = backend.get(key)
+    if entry is None:
+        return None
+    try:
+        record = json.loads(entry.data)
+    except ValueError as exc:
+        logging.debug('Invalid %s cache entry %s: %s', backend.name, key, exc)
+        return None
+    unpacked = cache_schema.unpack(record_type, record)
+    if unpacked is None:
+        return None
+    if unpacked.is_upgraded:
+        logging.debug('Upgraded %s cache entry %s to the current schema', backend.name, key)
+        upgraded_record = cache_schema.pack(record_type, unpacked.value)
+        if 'ttl' in record:
+            upgraded_record['ttl'] = record['ttl']
+        entry = CacheEntry(json.dumps(upgraded_record), entry.fetched_at)
+        backend.set(key, entry.data, entry.fetched_at)
+    ttl = record.get('ttl') if isinstance(record, dict) else None
+    return StoredRecord(unpacked.value, entry.fetched_at, unpacked.needs_refresh, entry.data, ttl)
+
+
+def _load_from_tiers(key: str,
+                     record_type: str,
+                     get_ttl: Callable[[Any, float], float],
+                     cache_name: str) -> Optional[CachedItem]:
+    """
+    Load a cache entry from the local tier and then from the shared tier
+
+    The shared tier is checked if the local entry is missing or expired
+    because another Kodi instance may have refreshed it. An entry loaded
+    from the shared tier is copied to the local tier.
+
+    :param key: entry key
+    :param record_type: record type (see :mod:`cache_schema`)
+    :param get_ttl: function that returns TTL by an entry value and its fetch time
+    :param cache_name: cache name for metrics
+    :return: cached item including an expired one or None
+    """
+    def is_fresh(stored_record: StoredRecord) -> bool:
+        age = time.time() - stored_record.fetched_at
+        return (not stored_record.needs_refresh
+                and age <= get_ttl(stored_record.value, stored_record.fetched_at))
+
+    local_record = _read_entry(LOCAL_BACKEND, key, record_type)
+    if local_record is not None:
+        if is_fresh(local_record):
+            metrics.record_cache(cache_name, 'hit')
+            return CachedItem(local_record.value, False)
+        metrics.record_cache(cache_name, 'expired')
+    else:
+        metrics.record_cache(cache_name, 'miss')
+    shared_backend = get_shared_backend()
+    shared_record = None
+    if shared_backend is not None:
+        shared_record = _read_entry(shared_backend, key, record_type)
+    if shared_record is None or (local_record is not None
+                                 and shared_record.fetched_at <= local_record.fetched_at):
+        if shared_backend is not None:
+            metrics.record_cache('shared', 'miss')
+        return CachedItem(local_record.value, True) if local_record is not None else None
+    LOCAL_BACKEND.set(key, shared_record.data, shared_record.fetched_at)
+    if not is_fresh(shared_record):
+        metrics.record_cache('shared', 'expired')
+        return CachedItem(shared_record.value, True)
+    logging.debug('Loaded %s from the shared cache', key)
+    metrics.record_cache('shared', 'hit')
+    return CachedItem(shared_record.value, False)
+
+
+def _save_to_tiers(key: str, record_type: str, value: Any,
+                   get_ttl: Optional[Callable[[Any, float], float]] = None) -> None:
+    """
+    Write a cache entry through the local tier to the shared tier
+
+    If ``get_ttl`` is set, the record keeps the TTL of the entry,
+    so its freshness can be checked without the cache policy.
+    """
+    record = cache_schema.pack(record_type, value)
+    fetched_at = time.time()
+    if get_ttl is not None:
+        record['ttl'] = get_ttl(value, fetched_at)
+    data = json.dumps(record)
+    LOCAL_BACKEND.set(key, data, fetched_at)
+    shared_backend = get_shared_backend()
+    if shared_backend is not None:
+        shared_backend.set(key, data, fetched_at)
 
 
 def cache_show_info(show_info: Dict[str, Any]) -> None:
     """
     Save show_info dict to cache
     """
-    file_name = str(show_info['id']) + '.json'
-    cache_json = json.dumps(show_info)
-    with open(os.path.join(CACHE_DIR, file_name), 'w', encoding='utf-8') as fo:
-        fo.write(cache_json)
+    _save_to_tiers(str(show_info['id']), cache_schema.SHOW_INFO, show_info,
+                   cache_policy.get_show_info_ttl)
 
 
 def load_show_info_from_cache(show_id: Union[int, str]) -> Optional[Dict[str, Any]]:
     """
     Load show info from a local cache
 
+    The freshness of cached show info is defined by :mod:`cache_policy`.
+
     :param show_id: show ID on TVmaze
-    :return: show_info dict or None
+    :return: show_info dict or None if show info is not cached or expired
     """
-    file_name = str(show_id) + '.json'
-    try:
-        with open(os.path.join(CACHE_DIR, file_name), 'r', encoding='utf-8') as fo:
-            cache_json = fo.read()
-        show_info = json.loads(cache_json)
-        logging.debug('Show info cache hit')
-        return show_info
-    except (IOError, EOFError, ValueError) as exc:
-        logging.debug('Cache error: %s %s', type(exc), exc)
+    cached_item = load_cached_show_info(show_id)
+    if cached_item is None or cached_item.is_stale:
+        return None
+    return cached_item.value
+
+
+def load_cached_show_info(show_id: Union[int, str]) -> Optional[CachedItem]:
+    """
+    Load show info from the local or the shared cache including expired show info
+
+    :param show_id: show ID on TVmaze
+    :return: cached show info or None if show info is not cached
+    """
+    cached_item = _load_from_tiers(str(show_id), cache_schema.SHOW_INFO,
+                                   cache_policy.get_show_info_ttl, 'disk')
+    if cached_item is not None:
+        logging.debug('Show info cache %s', 'expired' if cached_item.is_stale else 'hit')
+    return cached_item
+
+
+def _get_show_info_expiry(stored_record: StoredRecord) -> float:
+    if stored_record.needs_refresh:
+        return stored_record.fetched_at
+    ttl = stored_record.ttl
+    if ttl is None:
+        ttl = cache_policy.get_show_info_ttl(stored_record.value, stored_record.fetched_at)
+    return stored_record.fetched_at + ttl
+
+
+def get_show_info_state(show_id: Union[int, str]) -> Optional[ShowInfoState]:
+    """
+    Check the state of cached show info in the disk or the shared cache
+
+    Freshness is checked by the fetch time and the TTL kept in the record,
+    and the check is not counted in cache metrics, so it can be used
+    for planning cache refreshes. Newer show info from the shared cache
+    is copied to the disk cache.
+
+    :param show_id: show ID on TVmaze
+    :return: the state of cached show info or None if show info is not cached
+    """
+    key = str(show_id)
+    stored_record = _read_entry(LOCAL_BACKEND, key, cache_schema.SHOW_INFO)
+    expires_at = _get_show_info_expiry(stored_record) if stored_record is not None else 0.0
+    now = time.time()
+    shared_backend = get_shared_backend()
+    if expires_at <= now and shared_backend is not None:
+        shared_record = _read_entry(shared_backend, key, cache_schema.SHOW_INFO)
+        if shared_record is not None and (stored_record is None
+                                          or shared_record.fetched_at > stored_record.fetched_at):
+            LOCAL_BACKEND.set(key, shared_record.data, shared_record.fetched_at)
+            stored_record = shared_record
+            expires_at = _get_show_info_expiry(shared_record)
+    if stored_record is None:
         return None
+    return ShowInfoState(expires_at <= now, expires_at, stored_record.value.get('status'))
+
+
+def cache_imdb_rating(imdb_id: str, imdb_rating: Dict[str, Union[int, float]]) -> None:
+    """
+    Save IMDB rating to cache
+
+    Cached ratings are used as a stale fallback when there is no time
+    to fetch a fresh rating.
+    """
+    _save_to_tiers(f'imdb_{imdb_id}', cache_schema.IMDB_RATING, imdb_rating)
+
+
+def load_imdb_rating_from_cache(imdb_id: str) -> Optional[Dict[str, Union[int, float]]]:
+    # Cached ratings are only used as a fallback, so they never expire
+    cached_item = _load_from_tiers(f'imdb_{imdb_id}', cache_schema.IMDB_RATING,
+                                   lambda *_: float('inf'), 'imdb')
+    return cached_item.value if cached_item is not None else None
+
+
+def claim_revalidation(cache_key: str) -> bool:
+    """
+    Claim the right to refresh a stale cache entry
+
+    It prevents several scraper processes from refreshing the same entry
+    at the same time. A claim expires after :data:`REVALIDATION_CLAIM_TIMEOUT`.
+
+    :param cache_key: cache entry key, e.g. ``show_info_42``
+    :return: True if the claim is granted to the current process
+    """
+    claim_path = os.path.join(CACHE_DIR, f'{cache_key}.revalidating')
+    try:
+        if time.time() - os.path.getmtime(claim_path) < REVALIDATION_CLAIM_TIMEOUT:
+            return False
+        os.remove(claim_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError:
+        return False
+
+
+def release_revalidation(cache_key: str) -> None:
+    try:
+        os.remove(os.path.join(CACHE_DIR, f'{cache_key}.revalidating'))
+    except OSError:
+        pass
+
+
+REVALIDATION_QUEUE_FILE = os.path.join(CACHE_DIR, 'revalidation_queue.json')
+
+
+def add_to_revalidation_queue(cache_type: str, show_id: Union[int, str]) -> None:
+    """
+    Record a stale cache entry that could not be refreshed
+
+    The queue is processed by the cache-warming path.
+
+    :param cache_type: ``show_info`` or ``episodes_map``
+    :param show_id: TVmaze show ID
+    """
+    try:
+        with FileLock(REVALIDATION_QUEUE_FILE + '.lock', timeout=1.0):
+            queue = _load_revalidation_queue()
+            entry = [cache_type, str(show_id)]
+            if entry not in queue:
+                queue.append(entry)
+                write_file_atomic(REVALIDATION_QUEUE_FILE, json.dumps(queue))
+    except (OSError, TimeoutError) as exc:
+        logging.debug('Unable to update revalidation queue: %s', exc)
+
+
+def _load_revalidation_queue() -> List[List[str]]:
+    try:
+        with open(REVALIDATION_QUEUE_FILE, 'r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except (IOError, ValueError):
+        return []
+
+
+def pop_revalidation_queue() -> List[List[str]]:
+    """
+    Get and clear the queue of stale cache entries that could not be refreshed
+
+    :return: the list of ``[cache_type, show_id]`` pairs
+    """
+    try:
+        with FileLock(REVALIDATION_QUEUE_FILE + '.lock', timeout=1.0):
+            queue = _load_revalidation_queue()
+            if queue:
+                os.remove(REVALIDATION_QUEUE_FILE)
+            return queue
+    except (OSError, TimeoutError) as exc:
+        logging.debug('Unable to read revalidation queue: %s', exc)
+        return []
+
+
+EXTERNAL_IDS_FILE = os.path.join(CACHE_DIR, 'external_ids.json')
+# External ID providers that are recorded in the crosswalk
+CROSSWALK_PROVIDERS = ('imdb', 'thetvdb')
+# (file mtime, crosswalk) pair that is replaced atomically
+_external_ids_snapshot: Tuple[Optional[int], Dict[str, int]] = (None, {})
+
+
+def _load_external_ids() -> Dict[str, int]:
+    """Load the external ID crosswalk re-reading the file only if it has changed"""
+    global _external_ids_snapshot  # pylint: disable=global-statement
+    try:
+        mtime = os.stat(EXTERNAL_IDS_FILE).st_mtime_ns
+    except OSError:
+        return {}
+    snapshot_mtime, external_ids = _external_ids_snapshot
+    if mtime != snapshot_mtime:
+        try:
+            with open(EXTERNAL_IDS_FILE, 'r', encoding='utf-8') as fo:
+                external_ids = json.load(fo)
+        except (IOError, ValueError) as exc:
+            logging.debug('External ID crosswalk error: %s %s', type(exc), exc)
+            return {}
+        _external_ids_snapshot = (mtime, external_ids)
+    return external_ids
+
+
+def _get_crosswalk_key(provider: str, external_id: Union[int, str]) -> str:
+    if provider == 'tvdb':
+        provider = 'thetvdb'
+    return f'{provider}:{external_id}'
+
+
+def cache_external_ids(show_infos: Iterable[Dict[str, Any]]) -> None:
+    """
+    Record external IDs of TV shows in the persistent crosswalk
+
+    :param show_infos: show info payloads from TVmaze with "externals" field
+    """
+    new_ids = {}
+    for show_info in show_infos:
+        externals = show_info.get('externals') or {}
+        for provider in CROSSWALK_PROVIDERS:
+            external_id = externals.get(provider)
+            if external_id:
+                new_ids[_get_crosswalk_key(provider, external_id)] = show_info['id']
+    external_ids = _load_external_ids()
+    if all(external_ids.get(key) == show_id for key, show_id in new_ids.items()):
+        return
+    try:
+        with FileLock(EXTERNAL_IDS_FILE + '.lock', timeout=1.0):
+            external_ids = dict(_load_external_ids())
+            external_ids.update(new_ids)
+            write_file_atomic(EXTERNAL_IDS_FILE, json.dumps(external_ids))
+    except (OSError, TimeoutError) as exc:
+        logging.debug('Unable to update external ID crosswalk: %s', exc)
+
+
+def load_show_id_by_external_id(provider: str, external_id: str) -> Optional[int]:
+    """
+    Get TVmaze show ID from the external ID crosswalk
+
+    :param provider: 'imdb', 'thetvdb' or 'tvdb'
+    :param external_id: show ID in the respective provider
+    :return: TVmaze show ID or None if the external ID is not known
+    """
+    show_id = _load_external_ids().get(_get_crosswalk_key(provider, external_id))
+    metrics.record_cache('external_ids', 'miss' if show_id is None else 'hit')
+    return show_id
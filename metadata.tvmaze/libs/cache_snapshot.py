@@ -0,0 +1,192 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Portable snapshots of the disk cache
+
+A snapshot is a zip file with compressed cache entries and ``index.json``
+that lists the entries with their types and the times when they were fetched
+from TVmaze. Imported entries keep their fetch times, so they expire
+and are revalidated the same way as on the box where they were exported.
+
+Entries are copied as is without decoding, and entries that are fresher
+in the target cache are not overwritten. The external ID crosswalk
+is merged into the existing one.
+
+The module depends only on the standard library, so a snapshot
+can be exported or imported outside Kodi, e.g. when a box is provisioned::
+
+    cd metadata.tvmaze
+    python -m libs.cache_snapshot export /path/to/scrapers/metadata.tvmaze snapshot.zip
+    python -m libs.cache_snapshot import snapshot.zip /path/to/scrapers/metadata.tvmaze
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import zipfile
+from typing import Any, Dict, List
+
+from .cache_backends import DirectoryBackend
+from .cache_schema import SCHEMA_VERSIONS, get_record_type
+from .file_utils import FileLock, write_file_atomic
+
+SNAPSHOT_FORMAT = 'metadata.tvmaze-cache-snapshot'
+SNAPSHOT_VERSION = 1
+INDEX_FILE_NAME = 'index.json'
+ENTRIES_DIR = 'entries'
+EXTERNAL_IDS_FILE_NAME = 'external_ids.json'
+
+
+def _list_entries(cache_dir: str) -> List[Dict[str, Any]]:
+    entries = []
+    with os.scandir(cache_dir) as dir_entries:
+        for dir_entry in dir_entries:
+            key, extension = os.path.splitext(dir_entry.name)
+            entry_type = get_record_type(key)
+            if extension != '.json' or entry_type is None or not dir_entry.is_file():
+                continue
+            entries.append({
+                'key': key,
+                'type': entry_type,
+                'fetched_at': dir_entry.stat().st_mtime,
+            })
+    return entries
+
+
+def export_snapshot(cache_dir: str, snapshot_path: str) -> Dict[str, int]:
+    """
+    Export disk cache entries and the external ID crosswalk to a snapshot
+
+    :param cache_dir: scraper cache directory
+    :param snapshot_path: snapshot file path
+    :return: the number of exported entries by type
+    """
+    entries = _list_entries(cache_dir)
+    exported = []
+    counts: Dict[str, int] = {}
+    with zipfile.ZipFile(snapshot_path, 'w', zipfile.ZIP_DEFLATED) as snapshot:
+        for entry in entries:
+            try:
+                snapshot.write(os.path.join(cache_dir, entry['key'] + '.json'),
+                               f'{ENTRIES_DIR}/{entry["key"]}.json')
+            except OSError as exc:
+                # The entry has been evicted while exporting
+                logging.debug('Unable to export cache entry %s: %s', entry['key'], exc)
+                continue
+            exported.append(entry)
+            counts[entry['type']] = counts.get(entry['type'], 0) + 1
+        external_ids_path = os.path.join(cache_dir, EXTERNAL_IDS_FILE_NAME)
+        has_external_ids = os.path.exists(external_ids_path)
+        if has_external_ids:
+            snapshot.write(external_ids_path, EXTERNAL_IDS_FILE_NAME)
+        index = {
+            'format': SNAPSHOT_FORMAT,
+            'version': SNAPSHOT_VERSION,
+            'created_at': time.time(),
+            # Entries of older schema versions are upgraded when they are read
+            'schema_versions': SCHEMA_VERSIONS,
+            'entries': exported,
+            'external_ids': has_external_ids,
+        }
+        snapshot.writestr(INDEX_FILE_NAME, json.dumps(index))
+    logging.info('Exported cache snapshot %s: %s', snapshot_path, counts)
+    return counts
+
+
+def _load_index(snapshot: zipfile.ZipFile) -> Dict[str, Any]:
+    try:
+        index = json.loads(snapshot.read(INDEX_FILE_NAME))
+    except (KeyError, ValueError) as exc:
+        raise ValueError(f'Invalid cache snapshot: {exc}') from exc
+    if index.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError('The file is not a TVmaze scraper cache snapshot')
+    if index.get('version', 0) > SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported cache snapshot version: {index.get("version")}')
+    return index
+
+
+def _merge_external_ids(snapshot: zipfile.ZipFile, cache_dir: str) -> int:
+    imported_ids = json.loads(snapshot.read(EXTERNAL_IDS_FILE_NAME))
+    external_ids_path = os.path.join(cache_dir, EXTERNAL_IDS_FILE_NAME)
+    with FileLock(external_ids_path + '.lock', timeout=5.0):
+        try:
+            with open(external_ids_path, 'r', encoding='utf-8') as fo:
+                external_ids = json.load(fo)
+        except (IOError, ValueError):
+            external_ids = {}
+        # IDs recorded by this box take precedence
+        imported_ids.update(external_ids)
+        write_file_atomic(external_ids_path, json.dumps(imported_ids))
+    return len(imported_ids) - len(external_ids)
+
+
+def import_snapshot(snapshot_path: str, cache_dir: str) -> Dict[str, int]:
+    """
+    Import a cache snapshot
+
+    :param snapshot_path: snapshot file path
+    :param cache_dir: scraper cache directory
+    :return: the number of imported entries by type
+    :raises ValueError: if the file is not a valid snapshot
+    :raises OSError: if the snapshot cannot be read
+    """
+    backend = DirectoryBackend(cache_dir)
+    counts: Dict[str, int] = {}
+    with zipfile.ZipFile(snapshot_path, 'r') as snapshot:
+        index = _load_index(snapshot)
+        for entry in index['entries']:
+            key = entry['key']
+            if get_record_type(key) != entry['type'] or os.path.basename(key) != key:
+                logging.warning('Skipping invalid cache snapshot entry %s', key)
+                continue
+            try:
+                local_fetched_at = os.path.getmtime(os.path.join(cache_dir, key + '.json'))
+            except OSError:
+                local_fetched_at = 0.0
+            if local_fetched_at >= entry['fetched_at']:
+                continue
+            data = snapshot.read(f'{ENTRIES_DIR}/{key}.json').decode('utf-8')
+            backend.set(key, data, entry['fetched_at'])
+            counts[entry['type']] = counts.get(entry['type'], 0) + 1
+        if index.get('external_ids'):
+            counts['external_ids'] = _merge_external_ids(snapshot, cache_dir)
+    logging.info('Imported cache snapshot %s: %s', snapshot_path, counts)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Export or import TVmaze scraper cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='export cache to a snapshot')
+    export_parser.add_argument('cache_dir', help='scraper cache directory')
+    export_parser.add_argument('snapshot', help='snapshot file to create')
+    import_parser = subparsers.add_parser('import', help='import a snapshot to cache')
+    import_parser.add_argument('snapshot', help='snapshot file')
+    import_parser.add_argument('cache_dir', help='scraper cache directory')
+    args = parser.parse_args()
+    os.makedirs(args.cache_dir, exist_ok=True)
+    if args.command == 'export':
+        counts = export_snapshot(args.cache_dir, args.snapshot)
+    else:
+        counts = import_snapshot(args.snapshot, args.cache_dir)
+    print(f'{args.command.capitalize()}ed: ' + ', '.join(
+        f'{entry_type}: {count}' for entry_type, count in sorted(counts.items())))
+
+
+if __name__ == '__main__':
+    main()
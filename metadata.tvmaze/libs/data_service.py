@@ -18,28 +18,37 @@ import json
 import logging
 import re
 from collections import defaultdict
-from typing import Optional, Dict, List, Any, Sequence, NamedTuple
-try:
-    from xml.etree import cElementTree as Etree
-except ImportError:
-    from xml.etree import ElementTree as Etree
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, List, Any, Sequence, Union, Tuple, NamedTuple
+from urllib import parse as urllib_parse
 
 from xbmcgui import ListItem
 
-from . import tvmaze_api, cache_service as cache
+from . import tvmaze_api, cache_service as cache, deadline, nfo_parser, request_scheduler
+from .episode_store import EpisodeStore
+from .nfo_parser import UrlParseResult, XmlParseResult
+from .utils import ADDON, run_in_background
 
 InfoType = Dict[str, Any]  # pylint: disable=invalid-name
 
 TAG_RE = re.compile(r'<[^>]+>')
-SHOW_ID_REGEXPS = (
-    r'(tvmaze)\.com/shows/(\d+)/[\w\-]',
-    r'(thetvdb)\.com/.*?series/(\d+)',
-    r'(thetvdb)\.com[\w=&\?/]+id=(\d+)',
-    r'(imdb)\.com/[\w/\-]+/(tt\d+)',
+POSTER = 'poster'
+BANNER = 'banner'
+FANART = 'fanart'
+SEASON_POSTER = 'season'
+CAST_THUMB = 'cast'
+EPISODE_THUMB = 'episode'
+# Kodi artwork types by TVmaze image types
+SUPPORTED_ARTWORK_TYPES = {'poster': POSTER, 'banner': BANNER, 'background': FANART}
+# Image size preferences by "artwork_size_*" setting values
+IMAGE_SIZE_PREFERENCES = (
+    ('large', 'original', 'medium'),
+    ('original', 'large', 'medium'),
+    ('medium', 'large', 'original'),
 )
-SUPPORTED_ARTWORK_TYPES = ('poster', 'banner')
-IMAGE_SIZES = ('large', 'original', 'medium')
-MAX_ARTWORK_NUMBER = 10
+# Artwork types with configurable image size and the max number of images
+ARTWORK_SIZE_TYPES = (POSTER, BANNER, FANART, SEASON_POSTER, CAST_THUMB, EPISODE_THUMB)
+ARTWORK_LIMIT_TYPES = (POSTER, BANNER, FANART, CAST_THUMB)
 CLEAN_PLOT_REPLACEMENTS = (
     ('<b>', '[B]'),
     ('</b>', '[/B]'),
@@ -48,21 +57,32 @@ CLEAN_PLOT_REPLACEMENTS = (
     ('</p><p>', '[CR]'),
 )
 SUPPORTED_EXTERNAL_IDS = ('tvdb', 'thetvdb', 'imdb')
+# If more seasons have changed, the full episode list is re-downloaded
+INCREMENTAL_REFRESH_MAX_SEASONS = 2
 
 
-class UrlParseResult(NamedTuple):
-    provider: str
-    show_id: str
-
+def get_episode_url_template(show_id: Union[int, str]) -> str:
+    """
+    Get a template of "url" strings for episode directory items of a show
+
+    An episode "url" is some unique ID string that is passed
+    to getepisodedetails call to retrieve information about a specific episode.
+    The template has ``{id}``, ``{season}`` and ``{number}`` fields
+    for :meth:`str.format`, so URL encoding is done once per show
+    instead of once per episode. URL encoding does not change integer fields,
+    so a formatted URL is the same as the URL-encoded episode IDs.
+    """
+    return (urllib_parse.quote(urllib_parse.urlencode({'show_id': str(show_id)}))
+            + urllib_parse.quote('&episode_id={id}&season={season}&episode={number}',
+                                 safe='{}'))
 
-class XmlParseResult(NamedTuple):
-    title: str
-    year: str
-    uniqueids: Dict[str, str]
 
+def _process_episode_list(episode_list: List[InfoType]) -> EpisodeStore:
+    """
+    Convert embedded episode list to a columnar episode store
 
-def _process_episode_list(episode_list: List[InfoType]) -> Dict[str, InfoType]:
-    """Convert embedded episode list to a dict"""
+    Specials without numbers are moved to season 0.
+    """
     processed_episodes = {}
     specials_list = []
     for episode in episode_list:
@@ -77,21 +97,144 @@ def _process_episode_list(episode_list: List[InfoType]) -> Dict[str, InfoType]:
             specials_list.append(episode)
     specials_list.sort(key=lambda ep: ep['airdate'])
     for ep_number, special in enumerate(specials_list, 1):
+        # The original season is kept to restore the episode list for incremental refresh
+        special['original_season'] = special['season']
         special['season'] = 0
         special['number'] = ep_number
         key = f'{special["id"]}_{special["season"]}_{special["number"]}'
         processed_episodes[key] = special
-    return processed_episodes
+    return EpisodeStore.from_episodes(processed_episodes.values())
+
 
+def _restore_episode_list(episodes_map: EpisodeStore) -> Optional[List[InfoType]]:
+    """
+    Restore TVmaze episode list from a processed episodes map
+
+    :return: episode list or None if the map cannot be restored
+    """
+    episode_list = []
+    for episode in episodes_map.iter_episodes():
+        if 'original_season' in episode:
+            episode['season'] = episode.pop('original_season')
+            episode['number'] = None
+        elif episode['season'] == 0:
+            # Specials in episode maps cached by previous versions cannot be restored
+            return None
+        episode_list.append(episode)
+    return episode_list
+
+
+def _refresh_episode_list_incrementally(
+        show_id: str, stale_episodes_map: EpisodeStore) -> Optional[List[InfoType]]:
+    """
+    Refresh the episode list of a running show by re-downloading only the latest seasons
+
+    The seasons that are re-downloaded are the last season present
+    in the stale list and any seasons added after it.
+
+    :param show_id: TVmaze show ID
+    :param stale_episodes_map: stale processed episodes map
+    :return: updated episode list or None if the incremental refresh is not possible
+    """
+    show_info = tvmaze_api.load_show_info(show_id)
+    if show_info is None or show_info.get('status') != 'Running':
+        return None
+    seasons = sorted((show_info.get('_embedded') or {}).get('seasons') or [],
+                     key=lambda season: season['number'])
+    episode_list = _restore_episode_list(stale_episodes_map)
+    if not seasons or not episode_list:
+        return None
+    episodes_by_season = defaultdict(list)
+    for episode in episode_list:
+        episodes_by_season[episode['season']].append(episode)
+    last_cached_season = max(episodes_by_season)
+    seasons_to_refresh = [season for season in seasons
+                          if season['number'] >= last_cached_season
+                          or season['number'] not in episodes_by_season]
+    if len(seasons_to_refresh) > INCREMENTAL_REFRESH_MAX_SEASONS:
+        return None
+    for season in seasons_to_refresh:
+        season_episodes = tvmaze_api.load_season_episodes(season['id'])
+        if season_episodes is None:
+            return None
+        episodes_by_season[season['number']] = season_episodes
+    logging.debug('Refreshed seasons %s of show %s',
+                  [season['number'] for season in seasons_to_refresh], show_id)
+    return [episode for season_number in sorted(episodes_by_season)
+            for episode in episodes_by_season[season_number]]
+
+
+def _fetch_episodes_map(show_id: str,
+                        episode_order: str,
+                        stale_episodes_map: Optional[EpisodeStore] = None
+                        ) -> Optional[EpisodeStore]:
+    """
+    Load episode list from TVmaze and save the processed episodes map to cache
 
-def get_episodes_map(show_id: str, episode_order: str) -> Optional[Dict[str, InfoType]]:
-    processed_episodes = cache.load_episodes_map_from_cache(show_id)
-    if not processed_episodes:
+    If a stale episodes map in the default order is available for a running show,
+    only the latest seasons are re-downloaded and merged into it.
+    """
+    processed_episodes = None
+    episode_list = None
+    if stale_episodes_map is not None and episode_order == 'default':
+        episode_list = _refresh_episode_list_incrementally(show_id, stale_episodes_map)
+    if not episode_list:
         episode_list = tvmaze_api.load_episode_list(show_id, episode_order)
-        if episode_list:
-            processed_episodes = _process_episode_list(episode_list)
-            cache.cache_episodes_map(show_id, processed_episodes)
-    return processed_episodes or {}
+    if episode_list:
+        processed_episodes = _process_episode_list(episode_list)
+        cache.cache_episodes_map(show_id, processed_episodes, episode_order)
+    return processed_episodes
+
+
+def _revalidate_episodes_map(show_id: str,
+                             episode_order: str,
+                             stale_episodes_map: Optional[EpisodeStore]) -> bool:
+    try:
+        if _fetch_episodes_map(show_id, episode_order, stale_episodes_map) is None:
+            cache.add_to_revalidation_queue('episodes_map', show_id)
+            return False
+        return True
+    finally:
+        cache.release_revalidation(f'episodes_map_{show_id}')
+
+
+def refresh_episodes_map(show_id: str, episode_order: str) -> bool:
+    """
+    Refresh a cached episodes map from TVmaze unless another process is refreshing it
+
+    :param show_id: TVmaze show ID
+    :param episode_order: episode order
+    :return: True if the episodes map has been refreshed
+    """
+    if not cache.claim_revalidation(f'episodes_map_{show_id}'):
+        return False
+    cached_episodes = cache.load_cached_episodes_map(show_id, episode_order)
+    stale_episodes_map = cached_episodes.value if cached_episodes is not None else None
+    return _revalidate_episodes_map(show_id, episode_order, stale_episodes_map)
+
+
+def get_episodes_map(show_id: str, episode_order: str) -> EpisodeStore:
+    """
+    Get processed episodes map for a show
+
+    Expired episodes map is handled the same way as stale show info
+    in :func:`tvmaze_api.load_show_info`.
+    """
+    cached_episodes = cache.load_cached_episodes_map(show_id, episode_order)
+    if cached_episodes is not None and not cached_episodes.is_stale:
+        return cached_episodes.value
+    if cached_episodes is not None and ADDON.getSettingBool('stale_while_revalidate'):
+        if cache.claim_revalidation(f'episodes_map_{show_id}'):
+            run_in_background(_revalidate_episodes_map, show_id, episode_order,
+                              cached_episodes.value)
+        return cached_episodes.value
+    stale_episodes_map = cached_episodes.value if cached_episodes is not None else None
+    processed_episodes = _fetch_episodes_map(show_id, episode_order, stale_episodes_map)
+    if processed_episodes is None and cached_episodes is not None:
+        logging.warning('Unable to refresh episode list for show %s. Using stale list.',
+                        show_id)
+        return cached_episodes.value
+    return processed_episodes or EpisodeStore.from_episodes(())
 
 
 def get_episode_info(show_id: str,
@@ -102,6 +245,10 @@ def get_episode_info(show_id: str,
     """
     Load episode info
 
+    The episode is resolved from the episode store by its IDs (see
+    :meth:`episode_store.EpisodeStore.find_position`). It is loaded from TVmaze
+    only if it is not in the episode list of the show.
+
     :param show_id:
     :param episode_id:
     :param season:
@@ -109,19 +256,38 @@ def get_episode_info(show_id: str,
     :param episode_order:
     :return: episode info or None
     """
-    episode_info = None
     episodes_map = get_episodes_map(show_id, episode_order)
-    if episodes_map is not None:
-        try:
-            key = f'{episode_id}_{season}_{episode}'
-            episode_info = episodes_map[key]
-        except KeyError as exc:
-            logging.error('Unable to retrieve episode info: %s', exc)
+    episode_info = episodes_map.find_episode(episode_id, season, episode)
     if episode_info is None:
+        logging.warning('Episode %s_%s_%s is not in the episode list of show %s',
+                        episode_id, season, episode, show_id)
         episode_info = tvmaze_api.load_episode_info(episode_id)
     return episode_info
 
 
+class ArtworkPolicy(NamedTuple):
+    image_sizes: Dict[str, Tuple[str, ...]]
+    limits: Dict[str, int]
+
+
+def get_artwork_policy() -> ArtworkPolicy:
+    """
+    Get image size preferences and the max numbers of images by artwork type
+
+    Smaller images save bandwidth and Kodi texture cache space
+    on low-power devices and metered connections.
+    """
+    image_sizes = {}
+    for artwork_type in ARTWORK_SIZE_TYPES:
+        setting_value = ADDON.getSettingInt(f'artwork_size_{artwork_type}')
+        if not 0 <= setting_value < len(IMAGE_SIZE_PREFERENCES):
+            setting_value = 0
+        image_sizes[artwork_type] = IMAGE_SIZE_PREFERENCES[setting_value]
+    limits = {artwork_type: ADDON.getSettingInt(f'artwork_limit_{artwork_type}')
+              for artwork_type in ARTWORK_LIMIT_TYPES}
+    return ArtworkPolicy(image_sizes, limits)
+
+
 def _clean_plot(plot: str) -> str:
     """Replace HTML tags with Kodi skin tags"""
     for repl in CLEAN_PLOT_REPLACEMENTS:
@@ -130,9 +296,10 @@ def _clean_plot(plot: str) -> str:
     return plot
 
 
-def _set_cast(show_info: InfoType, list_item: ListItem) -> ListItem:
+def _set_cast(show_info: InfoType, list_item: ListItem, policy: ArtworkPolicy) -> ListItem:
     """Extract cast from show info dict"""
     cast = []
+    image_sizes = policy.image_sizes[CAST_THUMB]
     for index, item in enumerate(show_info['_embedded']['cast'], 1):
         data = {
             'name': item['person']['name'],
@@ -140,10 +307,12 @@ def _set_cast(show_info: InfoType, list_item: ListItem) -> ListItem:
             'order': index,
         }
         thumb = None
-        if item['character'].get('image') is not None:
-            thumb = _extract_artwork_url(item['character']['image'])
-        if not thumb and item['person'].get('image') is not None:
-            thumb = _extract_artwork_url(item['person']['image'])
+        if index <= policy.limits[CAST_THUMB]:
+            # A character image is preferred to a person image
+            for image in (item['character'].get('image'), item['person'].get('image')):
+                thumb = _extract_artwork_url(image or {}, image_sizes)
+                if thumb:
+                    break
         if thumb:
             data['thumbnail'] = thumb
         cast.append(data)
@@ -184,25 +353,32 @@ def _set_rating(show_info: InfoType, list_item: ListItem, default_rating: str) -
     return list_item
 
 
-def _extract_artwork_url(resolutions: Dict[str, str]) -> str:
-    """Extract image URL from the list of available resolutions"""
-    url = ''
-    for image_size in IMAGE_SIZES:
+def _extract_artwork_url(resolutions: Dict[str, Any],
+                         image_sizes: Sequence[str] = IMAGE_SIZE_PREFERENCES[0]) -> str:
+    """
+    Extract image URL from available resolutions
+
+    :param resolutions: image URLs or ``{"url": ...}`` dicts by image size
+    :param image_sizes: image sizes in the order of preference
+    :return: image URL or an empty string
+    """
+    for image_size in image_sizes:
         url = resolutions.get(image_size) or ''
         if not isinstance(url, str):
             url = url.get('url') or ''
-            if url:
-                break
-    return url
+        if url:
+            return url
+    return ''
 
 
-def _add_season_info(show_info: InfoType, list_item: ListItem) -> ListItem:
+def _add_season_info(show_info: InfoType, list_item: ListItem,
+                     policy: ArtworkPolicy) -> ListItem:
     """Add info for show seasons"""
     for season in show_info['_embedded']['seasons']:
         list_item.addSeason(season['number'], season.get('name') or '')
         image = season.get('image')
         if image is not None:
-            url = _extract_artwork_url(image)
+            url = _extract_artwork_url(image, policy.image_sizes[SEASON_POSTER])
             if url:
                 list_item.addAvailableArtwork(url, 'poster', season=season['number'])
     return list_item
@@ -215,19 +391,27 @@ def _extract_artwork(show_info: InfoType) -> Dict[str, List[Dict[str, Any]]]:
     return artwork
 
 
-def set_show_artwork(show_info: InfoType, list_item: ListItem) -> ListItem:
+def set_show_artwork(show_info: InfoType, list_item: ListItem,
+                     policy: Optional[ArtworkPolicy] = None) -> ListItem:
     """Set available images for a show"""
+    if policy is None:
+        policy = get_artwork_policy()
     fanart_list = []
     artwork = _extract_artwork(show_info)
-    for artwork_type, artwork_list in artwork.items():
+    for tvmaze_type, artwork_list in artwork.items():
+        artwork_type = SUPPORTED_ARTWORK_TYPES.get(tvmaze_type)
+        if artwork_type is None:
+            continue
         artwork_list.sort(key=lambda art: art.get('main'), reverse=True)
-        for item in artwork_list[:MAX_ARTWORK_NUMBER]:
+        for item in artwork_list[:policy.limits[artwork_type]]:
             resolutions = item.get('resolutions') or {}
-            url = _extract_artwork_url(resolutions)
-            if artwork_type in SUPPORTED_ARTWORK_TYPES and url:
-                list_item.addAvailableArtwork(url, artwork_type)
-            elif artwork_type == 'background' and url:
+            url = _extract_artwork_url(resolutions, policy.image_sizes[artwork_type])
+            if not url:
+                continue
+            if artwork_type == FANART:
                 fanart_list.append({'image': url})
+            else:
+                list_item.addAvailableArtwork(url, artwork_type)
     if fanart_list:
         list_item.setAvailableFanart(fanart_list)
     return list_item
@@ -264,14 +448,15 @@ def add_main_show_info(list_item: ListItem,
     if show_info['premiered'] is not None:
         video['year'] = int(show_info['premiered'][:4])
         video['premiered'] = show_info['premiered']
+    policy = get_artwork_policy()
     if full_info:
         video['credits'] = _get_credits(show_info)
-        list_item = set_show_artwork(show_info, list_item)
-        list_item = _add_season_info(show_info, list_item)
-        list_item = _set_cast(show_info, list_item)
+        list_item = set_show_artwork(show_info, list_item, policy)
+        list_item = _add_season_info(show_info, list_item, policy)
+        list_item = _set_cast(show_info, list_item, policy)
     else:
         image = show_info.get('image') or {}
-        image_url = _extract_artwork_url(image)
+        image_url = _extract_artwork_url(image, policy.image_sizes[POSTER])
         if image_url:
             list_item.addAvailableArtwork(image_url, 'poster')
     list_item.setInfo('video', video)
@@ -298,7 +483,7 @@ def add_episode_info(list_item: ListItem,
         if episode_info['runtime'] is not None:
             video['duration'] = episode_info['runtime'] * 60
         image = episode_info.get('image') or {}
-        image_url = _extract_artwork_url(image)
+        image_url = _extract_artwork_url(image, get_artwork_policy().image_sizes[EPISODE_THUMB])
         if image_url:
             list_item.addAvailableArtwork(image_url, 'thumb')
         list_item.setUniqueIDs({'tvmaze': str(episode_info['id'])}, 'tvmaze')
@@ -308,20 +493,24 @@ def add_episode_info(list_item: ListItem,
 
 def parse_url_nfo_contents(nfo: str) -> Optional[UrlParseResult]:
     """Extract show ID from NFO file contents"""
-    for regexp in SHOW_ID_REGEXPS:
-        show_id_match = re.search(regexp, nfo, re.I)
-        if show_id_match is not None:
-            provider = show_id_match.group(1)
-            show_id = show_id_match.group(2)
-            logging.debug('Matched show ID %s by regexp "%s"', show_id, regexp)
-            return UrlParseResult(provider, show_id)
-    logging.debug('Unable to find show ID in an NFO file')
-    return None
+    url_parse_result = nfo_parser.find_url_id(nfo)
+    if url_parse_result is None:
+        logging.debug('Unable to find show ID in an NFO file')
+    return url_parse_result
 
 
 def parse_url_nfo(nfo: str) -> Optional[InfoType]:
+    return get_show_info_by_url_id(parse_url_nfo_contents(nfo))
+
+
+def get_show_info_by_url_id(url_parse_result: Optional[UrlParseResult]) -> Optional[InfoType]:
+    """
+    Get show info by a show ID extracted from a URL
+
+    :param url_parse_result: the result of :func:`nfo_parser.find_url_id`
+    :return: show info (may contain only "id" field) or None
+    """
     show_info = None
-    url_parse_result = parse_url_nfo_contents(nfo)
     if url_parse_result is not None:
         if url_parse_result.provider == 'tvmaze':
             show_info = {'id': int(url_parse_result.show_id)}
@@ -334,27 +523,7 @@ def parse_url_nfo(nfo: str) -> Optional[InfoType]:
 
 
 def parse_xml_nfo_contents(nfo: str) -> XmlParseResult:
-    root = Etree.fromstring(nfo)
-    title = ''
-    year = ''
-    uniqueids = {}
-    title_tag = root.find('title')
-    if title_tag is not None:
-        title = title_tag.text
-    year_tag = root.find('year')
-    if year_tag is not None:
-        year = year_tag.text
-    if not year:
-        premiered_tag = root.find('premiered')
-        if premiered_tag is not None:
-            year = premiered_tag.text[:4]
-    for uniqueid_tag in root.findall('uniqueid'):
-        provider = uniqueid_tag.attrib.get('type')
-        if provider is not None:
-            if provider == 'tvdb':
-                provider = 'thetvdb'
-            uniqueids[provider] = uniqueid_tag.text
-    return XmlParseResult(title, year, uniqueids)
+    return nfo_parser.parse_xml_nfo_contents(nfo)
 
 
 def parse_tvshow_xml_nfo(nfo: str) -> Optional[InfoType]:
@@ -362,16 +531,10 @@ def parse_tvshow_xml_nfo(nfo: str) -> Optional[InfoType]:
     xml_parse_result = parse_xml_nfo_contents(nfo)
     if 'tvmaze' in xml_parse_result.uniqueids:
         show_info = {'id': int(xml_parse_result.uniqueids['tvmaze'])}
-    elif 'imdb' in xml_parse_result.uniqueids:
-        show_info = tvmaze_api.load_show_info_by_external_id(
-            'imdb',
-            xml_parse_result.uniqueids['imdb']
-        )
-    elif 'thetvdb' in xml_parse_result.uniqueids:
-        show_info = tvmaze_api.load_show_info_by_external_id(
-            'thetvdb',
-            xml_parse_result.uniqueids['thetvdb']
-        )
+    else:
+        show_id = resolve_external_ids(xml_parse_result.uniqueids)
+        if show_id is not None:
+            show_info = {'id': int(show_id)}
     if show_info is None and xml_parse_result.title:
         search_results = search_show(xml_parse_result.title, xml_parse_result.year)
         if search_results and len(search_results) == 1:
@@ -412,6 +575,58 @@ def search_show(title: str, year: str) -> Sequence[InfoType]:
     return search_results
 
 
+def _resolve_external_id(provider: str, external_id: str,
+                         action_deadline: Optional[float], lane: str) -> Optional[InfoType]:
+    deadline.set_deadline(action_deadline)
+    request_scheduler.set_lane(lane)
+    return tvmaze_api.load_show_info_by_external_id(provider, external_id)
+
+
+def resolve_external_ids(external_ids: Dict[str, str]) -> Optional[str]:
+    """
+    Resolve TVmaze show ID by external IDs
+
+    External IDs are looked up in the local crosswalk first. If none of them
+    is known, all candidates are resolved on TVmaze concurrently
+    and the first successful result is used.
+
+    :param external_ids: external IDs by provider ('tvdb', 'thetvdb' or 'imdb')
+    :return: TVmaze show ID or None
+    """
+    candidates: List[Tuple[str, str]] = []
+    for provider in SUPPORTED_EXTERNAL_IDS:
+        external_id = external_ids.get(provider)
+        if provider == 'tvdb':
+            provider = 'thetvdb'
+        if external_id and (provider, external_id) not in candidates:
+            candidates.append((provider, external_id))
+    for provider, external_id in candidates:
+        show_id = cache.load_show_id_by_external_id(provider, external_id)
+        if show_id is not None:
+            return str(show_id)
+    if not candidates:
+        return None
+    if deadline.expired():
+        logging.warning('Unable to resolve external IDs %s within the time limit',
+                        external_ids)
+        return None
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        futures = [
+            executor.submit(_resolve_external_id, provider, external_id,
+                            deadline.get_deadline(), request_scheduler.get_lane())
+            for provider, external_id in candidates
+        ]
+        for future in as_completed(futures):
+            show_info = future.result()
+            if show_info:
+                return str(show_info['id'])
+    finally:
+        # Do not wait for slower lookups: their results are recorded in the crosswalk
+        executor.shutdown(wait=False)
+    return None
+
+
 def parse_json_episogeguide(episodeguide: str) -> Optional[str]:
     try:
         uniqueids = json.loads(episodeguide)
@@ -419,18 +634,7 @@ def parse_json_episogeguide(episodeguide: str) -> Optional[str]:
         return None
     show_id = uniqueids.get('tvmaze')
     if show_id is None:
-        for external_id_type in SUPPORTED_EXTERNAL_IDS:
-            external_id = uniqueids.get(external_id_type)
-            if external_id is not None:
-                if external_id == 'tvdb':
-                    external_id = 'thetvdb'
-                show_info = tvmaze_api.load_show_info_by_external_id(
-                    external_id_type,
-                    external_id
-                )
-                if show_info:
-                    show_id = str(show_info['id'])
-                    break
+        show_id = resolve_external_ids(uniqueids)
     return show_id
 
 
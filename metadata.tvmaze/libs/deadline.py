@@ -0,0 +1,99 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Per-action latency budgets
+
+Kodi library scanner waits for each scraper call, so every router action
+gets a deadline. Network requests made while handling the action
+use the remaining time as their timeout, and optional enrichment
+is skipped when the remaining time is not enough.
+
+The deadline is thread-local: background threads are not bound
+by the deadline of the action that has started them. Worker threads
+that do a part of the action itself inherit the deadline explicitly
+with :func:`get_deadline` and :func:`set_deadline`.
+"""
+
+import threading
+import time
+from typing import Optional
+
+# Time budgets for router actions in seconds
+ACTION_BUDGETS = {
+    'find': 15.0,
+    'nfourl': 15.0,
+    'getdetails': 20.0,
+    'getartwork': 10.0,
+    'getepisodelist': 20.0,
+    'getepisodedetails': 10.0,
+}
+DEFAULT_BUDGET = 20.0
+
+_local = threading.local()
+
+
+def start(action: str) -> None:
+    """
+    Set the deadline for the current thread according to the action budget
+
+    :param action: router action
+    """
+    budget = ACTION_BUDGETS.get(action.lower(), DEFAULT_BUDGET)
+    _local.deadline = time.monotonic() + budget
+
+
+def clear() -> None:
+    _local.deadline = None
+
+
+def get_deadline() -> Optional[float]:
+    """
+    Get the deadline of the current thread
+
+    :return: :func:`time.monotonic` timestamp or None if no deadline is set
+    """
+    return getattr(_local, 'deadline', None)
+
+
+def set_deadline(deadline: Optional[float]) -> None:
+    _local.deadline = deadline
+
+
+def remaining() -> Optional[float]:
+    """
+    Get the time left until the deadline
+
+    :return: remaining time in seconds (may be negative) or None if no deadline is set
+    """
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    time_left = remaining()
+    return time_left is not None and time_left <= 0
+
+
+def has_time_for(seconds: float) -> bool:
+    """
+    Check if there is enough time left for an operation
+
+    :param seconds: expected operation duration
+    """
+    time_left = remaining()
+    return time_left is None or time_left >= seconds
@@ -0,0 +1,340 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compact columnar storage of processed episode lists
+
+Episode lists of daily shows and soaps have thousands of episodes,
+so instead of a dict per episode a show's episodes are kept in parallel
+integer arrays, and string fields are indexes in a table of interned strings.
+Summaries and image URLs, which are only needed for a single episode
+in getepisodedetails calls, are stored separately in zlib-compressed blocks
+of :data:`DETAILS_BLOCK_SIZE` episodes, and a block is decompressed
+only when an episode from it is requested.
+
+Only the fields used by the scraper are kept. A store is serialized
+to a compact binary form (:meth:`EpisodeStore.to_bytes`) or its base64
+text for cache tiers that store text. Lookup indexes by TVmaze episode ID
+and by season and episode number are built on first lookup.
+
+Episodes are resolved by the IDs from their URLs without the exact
+``{id}_{season}_{number}`` match, so an episode is found after the episode order
+has changed, specials have been renumbered or a placeholder episode
+has been replaced on TVmaze.
+
+The module depends only on the standard library.
+"""
+
+import base64
+import json
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+InfoType = Dict[str, Any]  # pylint: disable=invalid-name
+
+MAGIC = b'TVES'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHI')
+LENGTH = struct.Struct('<I')
+# A missing integer value or a missing string
+NONE = -1
+INT_COLUMNS = ('ids', 'seasons', 'numbers', 'original_seasons', 'runtimes')
+STRING_COLUMNS = ('names', 'types', 'airdates')
+STRING_SEPARATOR = '\0'
+# Episodes per compressed block of summaries and images
+DETAILS_BLOCK_SIZE = 64
+
+
+def _to_int(value: Union[int, str, None]) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NONE
+
+
+def _from_int(value: int) -> Optional[int]:
+    return None if value == NONE else value
+
+
+def _to_little_endian(column: array) -> bytes:
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_little_endian(data: memoryview) -> array:
+    column = array('i')
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def _compress_details(details: List[Tuple[Optional[str], ...]]) -> bytes:
+    return zlib.compress(json.dumps(details, separators=(',', ':')).encode('utf-8'))
+
+
+class _Reader:
+    """Sequential reader of the binary form"""
+
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+        self._offset = 0
+
+    def read(self, size: int) -> memoryview:
+        if self._offset + size > len(self._view):
+            raise ValueError('Invalid episode store: truncated data')
+        chunk = self._view[self._offset:self._offset + size]
+        self._offset += size
+        return chunk
+
+    def read_length(self) -> int:
+        return LENGTH.unpack(self.read(LENGTH.size))[0]
+
+    def read_column(self, count: int) -> array:
+        return _from_little_endian(self.read(count * 4))
+
+    def read_rest(self) -> bytes:
+        return bytes(self.read(len(self._view) - self._offset))
+
+
+class EpisodeStore:
+    """
+    Episodes of a show in columnar form
+
+    Episodes are returned as dicts with TVmaze episode fields
+    that are created on access.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, columns: Dict[str, array], strings: List[str],
+                 details_offsets: array, details: bytes):
+        self.ids = columns['ids']
+        self.seasons = columns['seasons']
+        self.numbers = columns['numbers']
+        self.original_seasons = columns['original_seasons']
+        self.runtimes = columns['runtimes']
+        self.names = columns['names']
+        self.types = columns['types']
+        self.airdates = columns['airdates']
+        self._strings = strings
+        self._details_offsets = details_offsets
+        self._details = details
+        # The last decompressed block of details: (block number, details)
+        self._details_block: Tuple[int, List[List[Optional[str]]]] = (NONE, [])
+        self._by_id: Optional[Dict[int, List[int]]] = None
+        self._by_number: Optional[Dict[Tuple[int, int], int]] = None
+
+    @classmethod
+    def from_episodes(cls, episodes: Iterable[InfoType]) -> 'EpisodeStore':
+        """
+        Create a store from processed TVmaze episodes
+
+        :param episodes: episodes in the order of the episode list
+        """
+        columns = {name: array('i') for name in INT_COLUMNS + STRING_COLUMNS}
+        string_indexes: Dict[str, int] = {}
+        details_offsets = array('i', [0])
+        details = bytearray()
+        block: List[Tuple[Optional[str], ...]] = []
+
+        def intern(value: Optional[str]) -> int:
+            if not value:
+                return NONE
+            value = value.replace(STRING_SEPARATOR, ' ')
+            return string_indexes.setdefault(value, len(string_indexes))
+
+        for episode in episodes:
+            image = episode.get('image') or {}
+            columns['ids'].append(episode['id'])
+            columns['seasons'].append(episode['season'])
+            columns['numbers'].append(_to_int(episode['number']))
+            columns['original_seasons'].append(_to_int(episode.get('original_season')))
+            columns['runtimes'].append(_to_int(episode.get('runtime')))
+            columns['names'].append(intern(episode.get('name')))
+            columns['types'].append(intern(episode.get('type')))
+            columns['airdates'].append(intern(episode.get('airdate')))
+            block.append((episode.get('summary') or None,
+                          image.get('medium'), image.get('original')))
+            if len(block) == DETAILS_BLOCK_SIZE:
+                details += _compress_details(block)
+                details_offsets.append(len(details))
+                block = []
+        if block:
+            details += _compress_details(block)
+            details_offsets.append(len(details))
+        return cls(columns, list(string_indexes), details_offsets, bytes(details))
+
+    def to_bytes(self) -> bytes:
+        """Serialize the store to the binary form"""
+        strings = STRING_SEPARATOR.join(self._strings).encode('utf-8')
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, len(self))]
+        parts.extend(_to_little_endian(getattr(self, name))
+                     for name in INT_COLUMNS + STRING_COLUMNS)
+        parts.extend((LENGTH.pack(len(self._strings)), LENGTH.pack(len(strings)), strings,
+                      _to_little_endian(self._details_offsets), self._details))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'EpisodeStore':
+        """
+        Deserialize a store from the binary form
+
+        :raises ValueError: if the data is not a serialized store
+        """
+        reader = _Reader(data)
+        try:
+            magic, version, count = HEADER.unpack(reader.read(HEADER.size))
+            if magic != MAGIC or version > FORMAT_VERSION:
+                raise ValueError('Unsupported episode store format')
+            columns = {name: reader.read_column(count) for name in INT_COLUMNS + STRING_COLUMNS}
+            strings_count = reader.read_length()
+            strings_data = reader.read(reader.read_length())
+            strings = str(strings_data, 'utf-8').split(STRING_SEPARATOR) if strings_count else []
+            blocks_count = -(-count // DETAILS_BLOCK_SIZE)
+            details_offsets = reader.read_column(blocks_count + 1)
+            details = reader.read_rest()
+        except (struct.error, UnicodeDecodeError) as exc:
+            raise ValueError(f'Invalid episode store: {exc}') from exc
+        if len(strings) != strings_count or details_offsets[-1] != len(details):
+            raise ValueError('Invalid episode store: inconsistent data')
+        return cls(columns, strings, details_offsets, details)
+
+    def to_text(self) -> str:
+        """Serialize the store to base64 text for text-based cache tiers"""
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    @classmethod
+    def from_text(cls, text: str) -> 'EpisodeStore':
+        """
+        Deserialize a store from base64 text
+
+        :raises ValueError: if the text is not a serialized store
+        """
+        return cls.from_bytes(base64.b64decode(text))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[InfoType]:
+        """Iterate brief episode info for episode lists"""
+        strings = self._strings
+        for episode_id, season, number, name, airdate in zip(
+                self.ids, self.seasons, self.numbers, self.names, self.airdates):
+            yield {
+                'id': episode_id,
+                'name': strings[name] if name != NONE else '',
+                'season': season,
+                'number': _from_int(number),
+                'airdate': strings[airdate] if airdate != NONE else None,
+            }
+
+    def _get_string(self, index: int) -> Optional[str]:
+        return self._strings[index] if index != NONE else None
+
+    def _get_details(self, position: int) -> List[Optional[str]]:
+        """Get the summary and image URLs of an episode from its compressed block"""
+        block_number, block = self._details_block
+        if block_number != position // DETAILS_BLOCK_SIZE:
+            block_number = position // DETAILS_BLOCK_SIZE
+            start, end = (self._details_offsets[block_number],
+                          self._details_offsets[block_number + 1])
+            block = json.loads(zlib.decompress(self._details[start:end]))
+            self._details_block = (block_number, block)
+        return block[position % DETAILS_BLOCK_SIZE]
+
+    def get_episode(self, position: int) -> InfoType:
+        """
+        Get full episode info
+
+        :param position: episode position in the episode list
+        """
+        summary, image_medium, image_original = self._get_details(position)
+        episode = {
+            'id': self.ids[position],
+            'name': self._get_string(self.names[position]) or '',
+            'season': self.seasons[position],
+            'number': _from_int(self.numbers[position]),
+            'type': self._get_string(self.types[position]),
+            'airdate': self._get_string(self.airdates[position]),
+            'runtime': _from_int(self.runtimes[position]),
+            'summary': summary,
+            'image': None,
+        }
+        if image_medium or image_original:
+            episode['image'] = {'medium': image_medium, 'original': image_original}
+        original_season = self.original_seasons[position]
+        if original_season != NONE:
+            episode['original_season'] = original_season
+        return episode
+
+    def iter_episodes(self) -> Iterator[InfoType]:
+        """Iterate full episode info"""
+        for position in range(len(self)):
+            yield self.get_episode(position)
+
+    def _build_indexes(self) -> None:
+        by_id: Dict[int, List[int]] = {}
+        by_number: Dict[Tuple[int, int], int] = {}
+        for position, (episode_id, season, number) in enumerate(
+                zip(self.ids, self.seasons, self.numbers)):
+            by_id.setdefault(episode_id, []).append(position)
+            if number != NONE:
+                by_number.setdefault((season, number), position)
+        self._by_id, self._by_number = by_id, by_number
+
+    def find_position(self, episode_id: Union[int, str], season: Union[int, str],
+                      number: Union[int, str, None]) -> Optional[int]:
+        """
+        Find an episode by the IDs from its URL
+
+        The episode is looked up by its TVmaze ID preferring the same position,
+        and then by its position in the season.
+
+        :param episode_id: TVmaze episode ID
+        :param season: season number
+        :param number: episode number
+        :return: episode position or None if the episode is not in the store
+        """
+        if self._by_id is None:
+            self._build_indexes()
+        episode_id, season, number = _to_int(episode_id), _to_int(season), _to_int(number)
+        positions = self._by_id.get(episode_id)
+        if positions:
+            # In some orders the same episode occurs more than once
+            same_season = None
+            for position in positions:
+                if self.seasons[position] == season:
+                    if self.numbers[position] == number:
+                        return position
+                    if same_season is None:
+                        same_season = position
+            return same_season if same_season is not None else positions[0]
+        # TVmaze replaces placeholder episodes with new ones that have different IDs
+        return self._by_number.get((season, number))
+
+    def find_episode(self, episode_id: Union[int, str], season: Union[int, str],
+                     number: Union[int, str, None]) -> Optional[InfoType]:
+        """
+        Find full episode info by the IDs from the episode URL
+
+        See :meth:`find_position`.
+        """
+        position = self.find_position(episode_id, season, number)
+        return self.get_episode(position) if position is not None else None
@@ -14,20 +14,59 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Exception logger with extended diagnostic info"""
 
+import hashlib
 import inspect
+import json
+import reprlib
 import sys
+import time
+import traceback
 from contextlib import contextmanager
 from platform import uname
 from pprint import pformat
 from typing import Any, Dict, Callable, Generator, Iterable, Optional
 
 import xbmc
+import xbmcgui
+
+# Limits for local variable values in diagnostic info
+MAX_REPR_LEVEL = 3
+MAX_REPR_ITEMS = 10
+MAX_REPR_STRING = 200
+MAX_VAR_LENGTH = 1000
+# Identical exceptions are reported in full at most once per this period
+REPEATED_REPORT_PERIOD = 10 * 60  # seconds
+# Report timestamps are shared between addon processes via a Home window property
+REPORTS_PROPERTY = '__exception_logger_reports__'
+REPORTS_RETENTION_PERIOD = 24 * 60 * 60  # seconds
+
+_repr = reprlib.Repr()
+_repr.maxlevel = MAX_REPR_LEVEL
+_repr.maxtuple = _repr.maxlist = _repr.maxarray = MAX_REPR_ITEMS
+_repr.maxdict = _repr.maxset = _repr.maxfrozenset = _repr.maxdeque = MAX_REPR_ITEMS
+_repr.maxstring = _repr.maxother = MAX_REPR_STRING
 
 
 def _log_error(message: str) -> None:
     xbmc.log(message, level=xbmc.LOGERROR)
 
 
+def _format_value(value: Any) -> str:
+    """
+    Get a size-capped and depth-limited representation of a value
+
+    Large containers like full show info or episode maps are truncated,
+    so logging them is fast and does not flood the log.
+    """
+    try:
+        text = _repr.repr(value)
+    except Exception as exc:  # pylint: disable=broad-except
+        text = f'<unable to represent {type(value).__name__}: {exc!r}>'
+    if len(text) > MAX_VAR_LENGTH:
+        text = f'{text[:MAX_VAR_LENGTH]}... ({len(text)} characters)'
+    return text
+
+
 def _format_vars(variables: Dict[str, Any]) -> str:
     """
     Format variables dictionary
@@ -40,7 +79,7 @@ def _format_vars(variables: Dict[str, Any]) -> str:
     var_list.sort(key=lambda i: i[0])
     lines = []
     for var, val in var_list:
-        lines.append(f'{var} = {pformat(val)}')
+        lines.append(f'{var} = {_format_value(val)}')
     return '\n'.join(lines)
 
 
@@ -155,8 +194,68 @@ def format_exception(exc_obj: Optional[Exception] = None) -> str:
     return message
 
 
+COMPACT_EXCEPTION_TEMPLATE = """
+Exception type    : {exc_type}
+Exception message : {exc}
+Kodi version      : {kodi_version}
+sys.argv          : {sys_argv}
+{traceback}"""
+
+
+def format_compact_exception(exc_obj: Exception) -> str:
+    """
+    Returns a standard Python traceback without local variables and code context
+
+    :param exc_obj: exception object
+    """
+    return COMPACT_EXCEPTION_TEMPLATE.format(
+        exc_type=exc_obj.__class__.__name__,
+        exc=exc_obj,
+        kodi_version=xbmc.getInfoLabel('System.BuildVersion'),
+        sys_argv=sys.argv,
+        traceback=''.join(traceback.format_exception(type(exc_obj), exc_obj,
+                                                     exc_obj.__traceback__))
+    )
+
+
+def _get_fingerprint(exc_obj: Exception) -> str:
+    """Identify an exception by its type and the code locations in its traceback"""
+    locations = [exc_obj.__class__.__qualname__]
+    for frame, lineno in traceback.walk_tb(exc_obj.__traceback__):
+        locations.append(f'{frame.f_code.co_filename}:{lineno}')
+    return hashlib.md5('|'.join(locations).encode('utf-8')).hexdigest()
+
+
+def _register_report(fingerprint: str) -> Optional[int]:
+    """
+    Check if a full report for an exception is due and record it
+
+    :param fingerprint: exception fingerprint
+    :return: the number of reports for this exception suppressed since
+        the last full report or None if the current report is to be suppressed
+    """
+    window = xbmcgui.Window(10000)
+    try:
+        reports = json.loads(window.getProperty(REPORTS_PROPERTY) or '{}')
+    except ValueError:
+        reports = {}
+    now = time.time()
+    reported_at, suppressed = reports.get(fingerprint, (0.0, 0))
+    if now - reported_at < REPEATED_REPORT_PERIOD:
+        reports[fingerprint] = [reported_at, suppressed + 1]
+        result = None
+    else:
+        reports[fingerprint] = [now, 0]
+        result = suppressed
+    reports = {key: value for key, value in reports.items()
+               if now - value[0] < REPORTS_RETENTION_PERIOD}
+    window.setProperty(REPORTS_PROPERTY, json.dumps(reports))
+    return result
+
+
 @contextmanager
-def catch_exception(logger_func: Callable[[str], None] = _log_error) -> Generator[None, None, None]:
+def catch_exception(logger_func: Callable[[str], None] = _log_error,
+                    compact: bool = False) -> Generator[None, None, None]:
     """
     Diagnostic helper context manager
 
@@ -175,6 +274,11 @@ def catch_exception(logger_func: Callable[[str], None] = _log_error) -> Generato
 
     After logging the diagnostic info the exception is re-raised.
 
+    Values of local variables are truncated. Repeated identical exceptions
+    (with the same type and traceback) are logged in full at most once per
+    :data:`REPEATED_REPORT_PERIOD` across all addon processes,
+    other occurrences are logged as a single line.
+
     Example::
 
         with catch_exception():
@@ -183,11 +287,21 @@ def catch_exception(logger_func: Callable[[str], None] = _log_error) -> Generato
 
     :param logger_func: logger function that accepts a single argument
         that is a log message.
+    :param compact: log a standard traceback without code context
+        and local variables.
     """
     try:
         yield
     except Exception as exc:
-        message = format_exception(exc)
+        suppressed = _register_report(_get_fingerprint(exc))
+        if suppressed is None:
+            logger_func(f'Repeated unhandled exception {exc.__class__.__name__}: {exc} '
+                        f'(the full report has been logged less than '
+                        f'{REPEATED_REPORT_PERIOD} seconds ago)')
+            raise
+        message = format_compact_exception(exc) if compact else format_exception(exc)
+        if suppressed:
+            message += f'\n{suppressed} repeated reports of this exception have been suppressed\n'
         # pylint: disable=line-too-long
         logger_func('\n*********************************** Unhandled exception detected ***********************************\n'
                     + message)
@@ -0,0 +1,105 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""File helpers for state shared between scraper processes"""
+
+import os
+import tempfile
+import time
+from typing import Optional
+
+
+class FileLock:
+    """
+    Inter-process lock based on exclusive creation of a lock file
+
+    It works on all platforms supported by Kodi. A lock file that is older
+    than ``stale_after`` seconds is considered abandoned by a crashed process
+    and is removed.
+
+    Example::
+
+        with FileLock('/path/to/file.lock'):
+            # Read-modify-write a shared file
+
+    :param path: lock file path
+    :param timeout: max time to wait for the lock
+    :param stale_after: lock file age after which the lock is considered stale
+    :raises TimeoutError: if the lock cannot be acquired within the timeout
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0, stale_after: float = 30.0):
+        self._path = path
+        self._timeout = timeout
+        self._stale_after = stale_after
+        self._fd: Optional[int] = None
+
+    def _remove_stale_lock(self) -> None:
+        try:
+            if time.time() - os.path.getmtime(self._path) > self._stale_after:
+                os.remove(self._path)
+        except OSError:
+            pass
+
+    def acquire(self) -> None:
+        deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                self._fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                return
+            except FileExistsError:
+                self._remove_stale_lock()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Unable to acquire lock {self._path}')
+            time.sleep(0.01)
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+
+def write_file_atomic(path: str, contents: str) -> None:
+    """
+    Write a text file so that concurrent readers never see partial contents
+
+    :param path: file path
+    :param contents: file contents
+    """
+    # A unique temp file, so concurrent writers in different threads
+    # of the same process do not share it
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.',
+                                     dir=os.path.dirname(path))
+    try:
+        with open(fd, 'w', encoding='utf-8') as fo:
+            fo.write(contents)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -20,6 +20,8 @@ from typing import Dict, Union, Optional
 
 import simple_requests as requests
 
+from . import request_policy
+
 IMDB_TITLE_URL = 'https://www.imdb.com/title/{}/'
 
 HEADERS = (
@@ -31,7 +33,11 @@ HEADERS = (
 
 def get_imdb_rating(imdb_id: str) -> Optional[Dict[str, Union[int, float]]]:
     url = IMDB_TITLE_URL.format(imdb_id)
-    response = requests.get(url, headers=dict(HEADERS))
+    try:
+        response = request_policy.get(url, headers=dict(HEADERS))
+    except requests.RequestException as exc:
+        logging.debug('Unable to get IMDB rating for ID %s: %s', imdb_id, exc)
+        return None
     if response.ok:
         ld_json_match = re.search(r'<script type="application/ld\+json">([^<]+?)</script>',
                                   response.text)
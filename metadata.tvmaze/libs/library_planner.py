@@ -0,0 +1,298 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Cache warm-up for TV shows in Kodi library
+
+TV shows are read from Kodi video database (``MyVideos*.db``) that is opened
+read-only. The planner resolves their TVmaze IDs locally where possible
+and builds a refresh plan in the order of priority:
+
+1. Cache entries that could not be refreshed in background
+   (see :func:`cache_service.add_to_revalidation_queue`).
+2. Shows that are not cached or whose TVmaze ID is not known yet.
+3. Expired shows that are still running or in development.
+4. Other expired shows.
+
+Within the same priority, entries that have been expired longer go first.
+The plan is executed concurrently with :class:`tvmaze_async.AsyncClient`
+in the background lane of :mod:`request_scheduler`, so warm-up requests
+use the spare request rate but do not delay library scans and interactive calls,
+within a time budget. Entries that are not refreshed in time
+are left for the next warm-up.
+"""
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib import parse as urllib_parse
+
+import xbmcvfs
+
+from . import cache_service as cache, data_service, deadline, tvmaze_api
+from .cache_service import CACHE_DIR
+from .tvmaze_async import AsyncClient
+from .utils import get_episode_order
+
+SHOW_INFO = 'show_info'
+EPISODES_MAP = 'episodes_map'
+PRIORITY_QUEUED = 0
+PRIORITY_MISSING = 1
+PRIORITY_RUNNING = 2
+PRIORITY_ENDED = 3
+ENDED_STATUSES = ('Ended',)
+VIDEO_DATABASE_PATTERN = 'MyVideos*.db'
+EPISODEGUIDE_URL_RE = re.compile(r'tvmaze\.com/shows/(\d+)')
+DATABASE_TIMEOUT = 5.0  # seconds
+WARMUP_TIME_BUDGET = 10 * 60  # seconds
+WARMUP_CONCURRENCY = 4
+WARMUP_INTERVAL = 6 * 60 * 60  # seconds
+WARMUP_MARKER_FILE = os.path.join(CACHE_DIR, 'warmup.marker')
+
+
+class LibraryShow(NamedTuple):
+    title: str
+    status: str
+    # Unique IDs by provider: 'tvmaze', 'imdb', 'tvdb', etc.
+    unique_ids: Dict[str, str]
+
+
+class PlanItem(NamedTuple):
+    priority: int
+    # Seconds since the cache entry expired, for ordering within the same priority
+    overdue: float
+    show_id: Optional[str]
+    title: str
+    # Cache types to refresh: SHOW_INFO and/or EPISODES_MAP
+    cache_types: Tuple[str, ...]
+    # External IDs to resolve TVmaze ID if it is not known
+    external_ids: Dict[str, str]
+
+
+def find_video_database() -> Optional[str]:
+    """
+    Find the video database of the current Kodi version
+
+    :return: database path or None if the database is not found
+    """
+    database_dir = xbmcvfs.translatePath('special://database')
+    if isinstance(database_dir, bytes):
+        database_dir = database_dir.decode('utf-8')
+    paths = glob.glob(os.path.join(database_dir, VIDEO_DATABASE_PATTERN))
+    if not paths:
+        return None
+
+    def get_version(path: str) -> int:
+        version = re.sub(r'\D', '', os.path.basename(path))
+        return int(version) if version else 0
+
+    return max(paths, key=get_version)
+
+
+def _parse_episodeguide(episodeguide: str) -> Dict[str, str]:
+    """Extract unique IDs from a JSON or a legacy URL episodeguide"""
+    try:
+        unique_ids = json.loads(episodeguide)
+    except ValueError:
+        unique_ids = None
+    if isinstance(unique_ids, dict):
+        return {str(key): str(value) for key, value in unique_ids.items() if value}
+    match = EPISODEGUIDE_URL_RE.search(episodeguide)
+    if match is not None:
+        return {'tvmaze': match.group(1)}
+    return {}
+
+
+def read_library_shows(database_path: str) -> List[LibraryShow]:
+    """
+    Read TV shows and their unique IDs from Kodi video database
+
+    :param database_path: path to ``MyVideos*.db``
+    :return: the list of library shows
+    """
+    uri = f'file:{urllib_parse.quote(database_path)}?mode=ro'
+    try:
+        connection = sqlite3.connect(uri, uri=True, timeout=DATABASE_TIMEOUT)
+    except sqlite3.Error as exc:
+        logging.warning('Unable to open video database %s: %s', database_path, exc)
+        return []
+    try:
+        unique_ids: Dict[int, Dict[str, str]] = {}
+        for show_db_id, provider, value in connection.execute(
+                "SELECT media_id, type, value FROM uniqueid WHERE media_type = 'tvshow'"):
+            if provider and value:
+                unique_ids.setdefault(show_db_id, {})[provider.lower()] = value
+        shows = []
+        # c00 - title, c02 - status, c10 - episodeguide
+        for show_db_id, title, status, episodeguide in connection.execute(
+                'SELECT idShow, c00, c02, c10 FROM tvshow'):
+            show_ids = _parse_episodeguide(episodeguide or '')
+            show_ids.update(unique_ids.get(show_db_id, {}))
+            shows.append(LibraryShow(title or '', status or '', show_ids))
+        return shows
+    except sqlite3.Error as exc:
+        logging.warning('Unable to read TV shows from video database %s: %s',
+                        database_path, exc)
+        return []
+    finally:
+        connection.close()
+
+
+def _resolve_show_id_locally(unique_ids: Dict[str, str]) -> Optional[str]:
+    show_id = unique_ids.get('tvmaze')
+    if show_id:
+        return show_id
+    for provider in ('imdb', 'tvdb', 'thetvdb'):
+        external_id = unique_ids.get(provider)
+        if external_id:
+            tvmaze_id = cache.load_show_id_by_external_id(provider, external_id)
+            if tvmaze_id is not None:
+                return str(tvmaze_id)
+    return None
+
+
+def _plan_show(show: LibraryShow, show_id: Optional[str], episode_order: str,
+               now: float) -> Optional[PlanItem]:
+    """Check cache state of a library show and get a plan item if the show needs a refresh"""
+    if show_id is None:
+        return PlanItem(PRIORITY_MISSING, 0.0, None, show.title, (SHOW_INFO, EPISODES_MAP),
+                        show.unique_ids)
+    # Planning reads are not counted in cache metrics, and episodes maps
+    # are not decoded and not put into the memory cache
+    show_info_state = cache.get_show_info_state(show_id)
+    if show_info_state is None:
+        return PlanItem(PRIORITY_MISSING, 0.0, show_id, show.title, (SHOW_INFO, EPISODES_MAP), {})
+    cache_types = []
+    if show_info_state.is_stale:
+        cache_types.append(SHOW_INFO)
+    if not cache.has_fresh_episodes_map(show_id, episode_order):
+        cache_types.append(EPISODES_MAP)
+    if not cache_types:
+        return None
+    status = show_info_state.status or show.status
+    priority = PRIORITY_ENDED if status in ENDED_STATUSES else PRIORITY_RUNNING
+    overdue = max(now - show_info_state.expires_at, 0.0)
+    return PlanItem(priority, overdue, show_id, show.title, tuple(cache_types), {})
+
+
+def build_plan(shows: List[LibraryShow],
+               queued_entries: List[List[str]],
+               episode_order: str) -> List[PlanItem]:
+    """
+    Build a prioritized cache refresh plan for library shows
+
+    :param shows: library shows
+    :param queued_entries: ``[cache_type, show_id]`` pairs from the revalidation queue
+    :param episode_order: episode order to warm up episode maps for
+    :return: plan items in the order of execution
+    """
+    now = time.time()
+    queued: Dict[str, List[str]] = {}
+    for cache_type, show_id in queued_entries:
+        queued.setdefault(show_id, []).append(cache_type)
+    plan = [PlanItem(PRIORITY_QUEUED, 0.0, show_id, '', tuple(cache_types), {})
+            for show_id, cache_types in queued.items()]
+    for show in shows:
+        show_id = _resolve_show_id_locally(show.unique_ids)
+        if show_id is not None and show_id in queued:
+            continue
+        plan_item = _plan_show(show, show_id, episode_order, now)
+        if plan_item is not None:
+            plan.append(plan_item)
+    plan.sort(key=lambda item: (item.priority, -item.overdue))
+    return plan
+
+
+def _execute_item(item: PlanItem, episode_order: str,
+                  should_stop: Callable[[], bool]) -> Optional[bool]:
+    """
+    Refresh cache entries of a plan item
+
+    :return: True if all entries have been refreshed or None if the warm-up is stopped
+    """
+    if should_stop() or deadline.expired():
+        if item.priority == PRIORITY_QUEUED:
+            # Keep failed background refreshes for the next warm-up
+            for cache_type in item.cache_types:
+                cache.add_to_revalidation_queue(cache_type, item.show_id)
+        return None
+    show_id = item.show_id
+    if show_id is None:
+        show_id = data_service.resolve_external_ids(item.external_ids)
+        if show_id is None:
+            logging.debug('Unable to resolve TVmaze ID for "%s" by %s',
+                          item.title, item.external_ids)
+            return True
+    is_refreshed = True
+    if SHOW_INFO in item.cache_types:
+        is_refreshed = tvmaze_api.refresh_show_info(show_id)
+    if EPISODES_MAP in item.cache_types:
+        is_refreshed = data_service.refresh_episodes_map(show_id, episode_order) and is_refreshed
+    return is_refreshed
+
+
+async def _execute_plan(plan: List[PlanItem], episode_order: str,
+                        should_stop: Callable[[], bool]) -> List[Optional[bool]]:
+    async with AsyncClient(WARMUP_CONCURRENCY) as client:
+        return await client.map(_execute_item,
+                                ((item, episode_order, should_stop) for item in plan))
+
+
+def is_warmup_due() -> bool:
+    try:
+        return time.time() - os.path.getmtime(WARMUP_MARKER_FILE) > WARMUP_INTERVAL
+    except OSError:
+        return True
+
+
+def warm_up_library(should_stop: Callable[[], bool] = lambda: False,
+                    time_budget: float = WARMUP_TIME_BUDGET) -> int:
+    """
+    Refresh cached data of library shows in the order of priority
+
+    Cache entries that failed to refresh are added to the revalidation queue
+    for the next warm-up by the refresh functions.
+
+    :param should_stop: function that returns True if the warm-up must be stopped
+    :param time_budget: max warm-up time in seconds
+    :return: the number of refreshed plan items
+    """
+    try:
+        with open(WARMUP_MARKER_FILE, 'w', encoding='utf-8'):
+            pass
+    except OSError as exc:
+        logging.warning('Unable to save cache warm-up time: %s', exc)
+    database_path = find_video_database()
+    if database_path is None:
+        logging.debug('Kodi video database is not found')
+        return 0
+    episode_order = get_episode_order({})
+    plan = build_plan(read_library_shows(database_path), cache.pop_revalidation_queue(),
+                      episode_order)
+    logging.info('Cache warm-up plan: %s entries', len(plan))
+    deadline.set_deadline(time.monotonic() + time_budget)
+    try:
+        results = asyncio.run(_execute_plan(plan, episode_order, should_stop))
+    finally:
+        deadline.clear()
+    refreshed = results.count(True)
+    logging.info('Cache warm-up refreshed %s of %s entries', refreshed, len(plan))
+    return refreshed
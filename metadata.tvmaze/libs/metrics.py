@@ -0,0 +1,236 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Scraper metrics counters
+
+Counters are accumulated in memory of a scraper process and merged
+into a shared stats file once per addon call, so the overhead of a counter
+update is a dictionary lookup.
+
+The module depends only on the standard library, so collected stats
+can be dumped outside Kodi::
+
+    cd metadata.tvmaze
+    python -m libs.metrics /path/to/kodi/temp/scrapers/metadata.tvmaze/stats.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Union
+
+from .file_utils import FileLock, write_file_atomic
+
+STATS_FILE_NAME = 'stats.json'
+# Upper bounds of latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+BUCKET_LABELS = tuple(f'<={bound}s' if bound != float('inf') else '>10.0s'
+                      for bound in LATENCY_BUCKETS)
+ID_RE = re.compile(r'\d+')
+HOST_RE = re.compile(r'^https?://(?:www\.|api\.)?([^/]+)')
+
+StatsType = Dict[str, Dict[str, Any]]  # pylint: disable=invalid-name
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+_histograms: Dict[str, List[int]] = {}
+
+
+def get_endpoint(url: str) -> str:
+    """
+    Convert a URL to an endpoint name with IDs masked
+
+    Example: ``http://api.tvmaze.com/shows/42/episodes`` -> ``tvmaze.com/shows/{id}/episodes``
+    """
+    endpoint = HOST_RE.sub(r'\1', url)
+    return ID_RE.sub('{id}', endpoint)
+
+
+def increment(group: str, key: Union[str, int], value: int = 1) -> None:
+    with _lock:
+        _counters[group][str(key)] += value
+
+
+def observe_latency(endpoint: str, seconds: float) -> None:
+    with _lock:
+        histogram = _histograms.get(endpoint)
+        if histogram is None:
+            histogram = _histograms[endpoint] = [0] * len(LATENCY_BUCKETS)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+                break
+
+
+def record_response(endpoint: str, status: Union[int, str], size: int, seconds: float) -> None:
+    """
+    Record upstream request stats
+
+    :param endpoint: endpoint name returned by :func:`get_endpoint`
+    :param status: HTTP status code or error type name
+    :param size: received body size in bytes
+    :param seconds: request latency
+    """
+    increment('requests', endpoint)
+    increment('bytes_received', endpoint, size)
+    increment('http_status', status)
+    observe_latency(endpoint, seconds)
+
+
+def instrumented_request(request_func: Callable[..., Any], url: str, **kwargs: Any) -> Any:
+    """
+    Call an HTTP request function and record response stats
+
+    :param request_func: a function with ``requests.get`` signature
+    :param url: request URL
+    :param kwargs: keyword arguments for ``request_func``
+    :return: the response returned by ``request_func``
+    """
+    endpoint = get_endpoint(url)
+    start = time.monotonic()
+    try:
+        response = request_func(url, **kwargs)
+    except Exception as exc:
+        record_response(endpoint, type(exc).__name__, 0, time.monotonic() - start)
+        raise
+    record_response(endpoint, response.status_code, len(response.content),
+                    time.monotonic() - start)
+    return response
+
+
+def record_cache(cache_name: str, event: str) -> None:
+    """
+    Record a cache event
+
+    :param cache_name: cache name, e.g. ``memory`` or ``disk``
+    :param event: ``hit``, ``miss``, ``expired`` or ``eviction``
+    """
+    increment('cache', f'{cache_name}:{event}')
+
+
+def _merge(stats: StatsType, counters: Dict[str, Dict[str, int]],
+           histograms: Dict[str, List[int]]) -> StatsType:
+    for group, values in counters.items():
+        stats_group = stats.setdefault(group, {})
+        for key, value in values.items():
+            stats_group[key] = stats_group.get(key, 0) + value
+    latency = stats.setdefault('latency', {})
+    for endpoint, histogram in histograms.items():
+        stats_histogram = latency.get(endpoint) or [0] * len(histogram)
+        latency[endpoint] = [a + b for a, b in zip(stats_histogram, histogram)]
+    return stats
+
+
+def load_stats(stats_file: str) -> StatsType:
+    try:
+        with open(stats_file, 'r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except (IOError, ValueError):
+        return {}
+
+
+def flush(stats_file: str) -> None:
+    """
+    Merge counters accumulated by this process into the shared stats file
+
+    Errors are logged and ignored because stats must never break scraping.
+
+    :param stats_file: path to the stats file
+    """
+    with _lock:
+        if not _counters and not _histograms:
+            return
+        counters = {group: dict(values) for group, values in _counters.items()}
+        histograms = dict(_histograms)
+        _counters.clear()
+        _histograms.clear()
+    try:
+        with FileLock(stats_file + '.lock', timeout=1.0):
+            stats = _merge(load_stats(stats_file), counters, histograms)
+            stats.setdefault('since', time.time())
+            stats['updated'] = time.time()
+            write_file_atomic(stats_file, json.dumps(stats))
+    except (OSError, TimeoutError) as exc:
+        logging.debug('Unable to save scraper stats: %s', exc)
+
+
+def reset(stats_file: str) -> None:
+    with FileLock(stats_file + '.lock', timeout=1.0):
+        if os.path.exists(stats_file):
+            os.remove(stats_file)
+
+
+def _format_ratio(numerator: int, denominator: int) -> str:
+    if not denominator:
+        return 'n/a'
+    return f'{numerator / denominator:.1%}'
+
+
+def format_stats(stats: StatsType) -> str:
+    """Format collected stats as a human-readable report"""
+    if not stats:
+        return 'No scraper stats collected'
+    lines = [
+        f'Collected since: {time.ctime(stats.get("since", 0))}, '
+        f'updated: {time.ctime(stats.get("updated", 0))}',
+        'Requests by endpoint:',
+    ]
+    requests = stats.get('requests', {})
+    bytes_received = stats.get('bytes_received', {})
+    for endpoint, count in sorted(requests.items(), key=lambda item: -item[1]):
+        lines.append(f'    {endpoint}: {count} requests, {bytes_received.get(endpoint, 0)} bytes')
+    lines.append('HTTP statuses: ' + ', '.join(
+        f'{status}: {count}' for status, count in sorted(stats.get('http_status', {}).items())))
+    lines.append('Latency histograms:')
+    for endpoint, histogram in sorted(stats.get('latency', {}).items()):
+        buckets = ', '.join(f'{label}: {count}'
+                            for label, count in zip(BUCKET_LABELS, histogram) if count)
+        lines.append(f'    {endpoint}: {buckets}')
+    lines.append('Caches:')
+    cache = stats.get('cache', {})
+    cache_names = sorted({key.split(':', 1)[0] for key in cache})
+    for cache_name in cache_names:
+        hits = cache.get(f'{cache_name}:hit', 0)
+        lookups = hits + cache.get(f'{cache_name}:miss', 0) + cache.get(f'{cache_name}:expired', 0)
+        events = ', '.join(f'{key.split(":", 1)[1]}: {value}'
+                           for key, value in sorted(cache.items())
+                           if key.startswith(cache_name + ':'))
+        lines.append(f'    {cache_name}: hit ratio {_format_ratio(hits, lookups)} ({events})')
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Dump TVmaze scraper stats')
+    parser.add_argument('stats_file', help=f'path to {STATS_FILE_NAME} in the scraper cache dir')
+    parser.add_argument('--json', action='store_true', help='dump raw JSON')
+    parser.add_argument('--reset', action='store_true', help='reset stats after dumping')
+    args = parser.parse_args()
+    stats = load_stats(args.stats_file)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(format_stats(stats))
+    if args.reset:
+        reset(args.stats_file)
+
+
+if __name__ == '__main__':
+    main()
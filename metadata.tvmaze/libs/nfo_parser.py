@@ -0,0 +1,150 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Fast NFO file scanner
+
+An NFO is classified with plain substring checks, and show IDs are extracted
+from URLs with precompiled patterns that are searched in the order
+of priority. XML NFOs are parsed incrementally:
+only top-level tags used by the scraper are read, and parsing stops
+as soon as a TVmaze ID is found, so large episode NFOs
+with ``fileinfo/streamdetails`` sections are usually not parsed in full.
+Episode NFOs without a TVmaze ID are not parsed at all.
+"""
+
+import logging
+import re
+from typing import Dict, Iterator, NamedTuple, Optional
+try:
+    from xml.etree import cElementTree as Etree
+except ImportError:
+    from xml.etree import ElementTree as Etree
+
+EPISODE_NFO = 'episode'
+TVSHOW_NFO = 'tvshow'
+URL_NFO = 'url'
+
+# Show URL patterns by provider in the order of priority.
+# Each pattern is searched separately because matches of a combined pattern
+# do not overlap, so a lower-priority URL could hide a later one.
+SHOW_URL_REGEXPS = (
+    ('tvmaze', re.compile(r'tvmaze\.com/shows/(\d+)/[\w\-]', re.I)),
+    ('thetvdb', re.compile(r'thetvdb\.com/.*?series/(\d+)', re.I)),
+    ('thetvdb', re.compile(r'thetvdb\.com[\w=&\?/]+id=(\d+)', re.I)),
+    ('imdb', re.compile(r'imdb\.com/[\w/\-]+/(tt\d+)', re.I)),
+)
+XML_CHUNK_SIZE = 16384
+
+
+class UrlParseResult(NamedTuple):
+    provider: str
+    show_id: str
+
+
+class XmlParseResult(NamedTuple):
+    title: str
+    year: str
+    uniqueids: Dict[str, str]
+
+
+class NfoScanResult(NamedTuple):
+    kind: str
+    url_id: Optional[UrlParseResult]
+    # False if the NFO definitely has no TVmaze ID
+    may_have_tvmaze_id: bool
+
+
+def find_url_id(nfo: str) -> Optional[UrlParseResult]:
+    """
+    Extract a show ID from show page URLs in NFO contents
+
+    :param nfo: NFO file contents
+    :return: the show ID from the URL with the highest priority or None
+    """
+    for provider, regexp in SHOW_URL_REGEXPS:
+        match = regexp.search(nfo)
+        if match is not None:
+            logging.debug('Matched show ID %s from %s URL', match.group(1), provider)
+            return UrlParseResult(provider, match.group(1))
+    return None
+
+
+def scan_nfo(nfo: str) -> NfoScanResult:
+    """
+    Classify NFO contents and extract a show ID from URLs
+
+    Episode NFOs are not scanned for URLs because episodes
+    cannot be resolved by show URLs.
+
+    :param nfo: NFO file contents
+    :return: scan result
+    """
+    if '<episodedetails>' in nfo:
+        return NfoScanResult(EPISODE_NFO, None, 'tvmaze' in nfo)
+    kind = TVSHOW_NFO if '<tvshow>' in nfo else URL_NFO
+    return NfoScanResult(kind, find_url_id(nfo), 'tvmaze' in nfo)
+
+
+def _iter_top_level_elements(nfo: str) -> Iterator[Etree.Element]:
+    """
+    Parse XML incrementally and yield complete children of the root element
+
+    Yielded elements are cleared after processing to free memory
+    occupied by large sections like ``fileinfo``.
+    """
+    parser = Etree.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    try:
+        for offset in range(0, len(nfo), XML_CHUNK_SIZE):
+            parser.feed(nfo[offset:offset + XML_CHUNK_SIZE])
+            for event, element in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    yield element
+                    element.clear()
+        parser.close()
+    except Etree.ParseError as exc:
+        logging.debug('NFO file is not valid XML: %s', exc)
+
+
+def parse_xml_nfo_contents(nfo: str) -> XmlParseResult:
+    """
+    Extract title, year and unique IDs from an XML NFO
+
+    The NFO is parsed incrementally and parsing stops when a TVmaze ID
+    is found because it overrides all other info. Invalid XML after
+    the needed tags (e.g. several ``episodedetails`` root tags) is ignored.
+
+    :param nfo: NFO file contents
+    :return: parse result
+    """
+    tags = {'title': '', 'year': '', 'premiered': ''}
+    uniqueids: Dict[str, str] = {}
+    for element in _iter_top_level_elements(nfo):
+        if element.tag in tags:
+            tags[element.tag] = element.text or ''
+        elif element.tag == 'uniqueid':
+            provider = element.attrib.get('type')
+            if provider == 'tvdb':
+                provider = 'thetvdb'
+            if provider is not None:
+                uniqueids[provider] = element.text or ''
+                if provider == 'tvmaze':
+                    break
+    return XmlParseResult(tags['title'], tags['year'] or tags['premiered'][:4], uniqueids)
@@ -0,0 +1,184 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Opt-in CPU and memory profiling of scraper calls
+
+Profiling is enabled with "Profiling" setting or with
+:data:`PROFILING_MODE_ENV` environment variable (``cpu``, ``memory``
+or ``all``) that overrides the setting. Only every Nth scraper call is profiled,
+where N is set with "Profile every Nth call" setting
+or :data:`PROFILING_SAMPLE_RATE_ENV` environment variable.
+
+Results are saved to :data:`PROFILES_DIR`, file names include the action
+and the show ID:
+
+* ``*.prof`` - :mod:`cProfile` stats that can be viewed with :mod:`pstats`
+  or tools like snakeviz.
+* ``*.memory.txt`` - top memory allocations from :mod:`tracemalloc`.
+
+Only the thread that handles the call is profiled by :mod:`cProfile`.
+"""
+
+import cProfile
+import logging
+import os
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Generator, Optional, Tuple
+from urllib import parse as urllib_parse
+
+import xbmcgui
+
+from .cache_service import CACHE_DIR
+from .utils import ADDON, ADDON_ID
+
+PROFILING_MODE_ENV = 'TVMAZE_SCRAPER_PROFILE'
+PROFILING_SAMPLE_RATE_ENV = 'TVMAZE_SCRAPER_PROFILE_EVERY'
+# Profiling modes by "profiling_mode" setting value
+PROFILING_MODES = ('off', 'cpu', 'memory', 'all')
+DEFAULT_SAMPLE_RATE = 10
+PROFILES_DIR = os.path.join(CACHE_DIR, 'profiles')
+# Older profiles are deleted
+MAX_PROFILE_FILES = 100
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 30
+CALL_COUNTER_PROPERTY = f'__{ADDON_ID}_profiled_calls__'
+
+
+def _get_profiling_settings() -> Tuple[str, int]:
+    """
+    :return: profiling mode and sample rate
+    """
+    mode = os.environ.get(PROFILING_MODE_ENV, '').lower()
+    if mode not in PROFILING_MODES:
+        setting_value = ADDON.getSettingInt('profiling_mode')
+        mode = 'off'
+        if 0 <= setting_value < len(PROFILING_MODES):
+            mode = PROFILING_MODES[setting_value]
+    try:
+        sample_rate = int(os.environ[PROFILING_SAMPLE_RATE_ENV])
+    except (KeyError, ValueError):
+        sample_rate = ADDON.getSettingInt('profiling_sample_rate') or DEFAULT_SAMPLE_RATE
+    return mode, max(sample_rate, 1)
+
+
+def _is_sampled(sample_rate: int) -> bool:
+    """Count scraper calls across processes and check if the current call is profiled"""
+    window = xbmcgui.Window(10000)
+    try:
+        call_count = int(window.getProperty(CALL_COUNTER_PROPERTY) or 0) + 1
+    except ValueError:
+        call_count = 1
+    window.setProperty(CALL_COUNTER_PROPERTY, str(call_count))
+    return call_count % sample_rate == 0
+
+
+def _get_show_id(params: Dict[str, str]) -> str:
+    """Extract a show ID from call params for profile file names"""
+    value = params.get('id') or params.get('url') or ''
+    episode_params = dict(urllib_parse.parse_qsl(urllib_parse.unquote(value)))
+    if 'show_id' in episode_params:
+        return episode_params['show_id']
+    match = re.search(r'"tvmaze"\s*:\s*"?(\d+)', value)
+    if match is not None:
+        return match.group(1)
+    if value.isdigit():
+        return value
+    return re.sub(r'\W+', '_', params.get('title') or 'unknown')[:40]
+
+
+def _get_profile_path(params: Dict[str, str], extension: str) -> str:
+    action = re.sub(r'\W+', '_', params.get('action', 'unknown').lower())
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    file_name = f'{timestamp}_{os.getpid()}_{action}_{_get_show_id(params)}{extension}'
+    return os.path.join(PROFILES_DIR, file_name)
+
+
+def _remove_old_profiles() -> None:
+    with os.scandir(PROFILES_DIR) as dir_entries:
+        profiles = sorted((entry for entry in dir_entries if entry.is_file()),
+                          key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:-MAX_PROFILE_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _save_memory_snapshot(snapshot: tracemalloc.Snapshot, peak: int, path: str) -> None:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    statistics = snapshot.statistics('lineno')
+    total = sum(stat.size for stat in statistics)
+    lines = [f'Allocated: {total / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB',
+             f'Top {TOP_ALLOCATIONS} allocations by line:']
+    lines.extend(str(stat) for stat in statistics[:TOP_ALLOCATIONS])
+    with open(path, 'w', encoding='utf-8') as fo:
+        fo.write('\n'.join(lines) + '\n')
+
+
+@contextmanager
+def profile_call(paramstring: str) -> Generator[None, None, None]:
+    """
+    Profile a scraper call if profiling is enabled and the call is sampled
+
+    :param paramstring: url-encoded query string of the call
+    """
+    mode, sample_rate = _get_profiling_settings()
+    if mode == 'off' or not _is_sampled(sample_rate):
+        yield
+        return
+    params = dict(urllib_parse.parse_qsl(paramstring))
+    profiler: Optional[cProfile.Profile] = None
+    trace_memory = mode in ('memory', 'all') and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if mode in ('cpu', 'all'):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as exc:
+            # Another profiler is active, e.g. a debugger
+            logging.warning('Unable to start CPU profiling: %s', exc)
+            profiler = None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        snapshot = None
+        peak = 0
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        try:
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            if profiler is not None:
+                profile_path = _get_profile_path(params, '.prof')
+                profiler.dump_stats(profile_path)
+                logging.info('CPU profile saved to %s', profile_path)
+            if snapshot is not None:
+                snapshot_path = _get_profile_path(params, '.memory.txt')
+                _save_memory_snapshot(snapshot, peak, snapshot_path)
+                logging.info('Memory allocation snapshot saved to %s', snapshot_path)
+            _remove_old_profiles()
+        except OSError as exc:
+            logging.warning('Unable to save profiling results: %s', exc)
@@ -0,0 +1,227 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Timeouts, retries and circuit breaker for upstream HTTP requests"""
+
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+from urllib import parse as urllib_parse
+
+import simple_requests as requests
+
+from . import deadline, metrics, request_scheduler
+from .cache_service import CACHE_DIR
+from .file_utils import FileLock, write_file_atomic
+
+REQUEST_TIMEOUT = 10.0  # seconds
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 8.0  # seconds
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60.0  # seconds
+BREAKER_STATE_FILE = os.path.join(CACHE_DIR, 'circuit_breakers.json')
+MIN_REQUEST_TIMEOUT = 1.0  # seconds
+
+
+class DeadlineExceededError(requests.RequestException):  # pylint: disable=too-few-public-methods
+    """Raised when the current action has no time left for a request"""
+
+
+class CircuitOpenError(requests.ConnectionError):  # pylint: disable=too-few-public-methods
+    """Raised when requests to a host are rejected by an open circuit breaker"""
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker shared between scraper processes
+
+    After :data:`BREAKER_FAILURE_THRESHOLD` consecutive failures the circuit
+    for a host opens and all requests to it fail fast.
+    After :data:`BREAKER_RESET_TIMEOUT` one process is allowed to make
+    a trial request. A successful trial closes the circuit,
+    a failed one keeps it open for another timeout period.
+
+    :param state_file: path to a JSON file with breaker states
+    """
+
+    def __init__(self, state_file: str):
+        self._state_file = state_file
+        self._lock_file = state_file + '.lock'
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._state_file, 'r', encoding='utf-8') as fo:
+                return json.load(fo)
+        except (IOError, ValueError):
+            return {}
+
+    def _update_host_state(self, host: str, failed: bool) -> Dict[str, Any]:
+        with FileLock(self._lock_file, timeout=1.0):
+            state = self._load_state()
+            host_state = state.setdefault(host, {'failures': 0, 'opened_at': None})
+            if failed:
+                host_state['failures'] += 1
+                if host_state['failures'] >= BREAKER_FAILURE_THRESHOLD:
+                    if host_state['opened_at'] is None:
+                        logging.warning('Too many failed requests to %s. '
+                                        'Pausing requests for %s seconds',
+                                        host, BREAKER_RESET_TIMEOUT)
+                        metrics.increment('circuit_breaker', f'{host}:opened')
+                    host_state['opened_at'] = time.time()
+            else:
+                del state[host]
+            write_file_atomic(self._state_file, json.dumps(state))
+        return host_state
+
+    def allow_request(self, host: str) -> bool:
+        host_state = self._load_state().get(host)
+        if host_state is None or host_state['opened_at'] is None:
+            return True
+        if time.time() - host_state['opened_at'] < BREAKER_RESET_TIMEOUT:
+            return False
+        try:
+            with FileLock(self._lock_file, timeout=1.0):
+                state = self._load_state()
+                host_state = state.get(host)
+                if (host_state is not None and host_state['opened_at'] is not None
+                        and time.time() - host_state['opened_at'] < BREAKER_RESET_TIMEOUT):
+                    # Another process has already taken the trial request
+                    return False
+                if host_state is not None:
+                    # Re-arm the timer so that only this process makes a trial request
+                    host_state['opened_at'] = time.time()
+                    write_file_atomic(self._state_file, json.dumps(state))
+        except (OSError, TimeoutError) as exc:
+            logging.debug('Unable to update circuit breaker state: %s', exc)
+        return True
+
+    def record_success(self, host: str) -> None:
+        if host not in self._load_state():
+            return
+        try:
+            self._update_host_state(host, failed=False)
+        except (OSError, TimeoutError) as exc:
+            logging.debug('Unable to update circuit breaker state: %s', exc)
+
+    def record_failure(self, host: str) -> None:
+        try:
+            self._update_host_state(host, failed=True)
+        except (OSError, TimeoutError) as exc:
+            logging.debug('Unable to update circuit breaker state: %s', exc)
+
+
+CIRCUIT_BREAKER = CircuitBreaker(BREAKER_STATE_FILE)
+
+
+def _get_backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def _get_retry_after(response: requests.Response) -> float:
+    try:
+        return min(BACKOFF_CAP, float(response.headers.get('Retry-After') or 0))
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def _wait_for_turn(url: str, host: str) -> None:
+    if not CIRCUIT_BREAKER.allow_request(host):
+        metrics.increment('circuit_breaker', f'{host}:rejected')
+        raise CircuitOpenError(f'Requests to {host} are paused after repeated failures')
+    if not request_scheduler.acquire(url):
+        raise DeadlineExceededError(f'Request to {url} cannot be scheduled in time')
+
+
+def get(url: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = REQUEST_TIMEOUT) -> requests.Response:
+    """
+    Make an idempotent GET request with a timeout, retries and a circuit breaker
+
+    Network errors and HTTP statuses from :data:`RETRY_STATUSES` are retried
+    up to :data:`MAX_ATTEMPTS` times with jittered exponential backoff.
+    HTTP 429 respects ``Retry-After`` header and does not count as a host failure.
+    The timeout and retries are limited by the deadline of the current action
+    (see :mod:`deadline`). An attempt that times out because its timeout
+    has been shortened by the deadline does not count as a host failure either.
+    Each attempt waits for its turn within the host rate limit
+    (see :mod:`request_scheduler`).
+
+    :param url: request URL
+    :param params: URL query params
+    :param headers: request headers
+    :param timeout: timeout for a single attempt in seconds
+    :return: the last received response that may have an error status
+    :raises CircuitOpenError: if the circuit breaker for the host is open
+    :raises DeadlineExceededError: if the deadline of the current action has passed,
+        an attempt has timed out at the deadline or the request cannot be scheduled
+        within the rate limit in time
+    :raises requests.ConnectionError: if all attempts failed with network errors
+    """
+    host = urllib_parse.urlparse(url).netloc
+    response = None
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        _wait_for_turn(url, host)
+        time_left = deadline.remaining()
+        if time_left is not None and time_left < MIN_REQUEST_TIMEOUT:
+            metrics.increment('deadline_exceeded', metrics.get_endpoint(url))
+            raise DeadlineExceededError(f'No time left for request to {url}')
+        attempt_timeout = timeout if time_left is None else min(timeout, time_left)
+        started_at = time.monotonic()
+        try:
+            response = metrics.instrumented_request(requests.get, url, params=params,
+                                                    headers=headers, timeout=attempt_timeout)
+        except OSError as exc:
+            # simple_requests exceptions are subclasses of IOError
+            logging.debug('Request to %s failed (attempt %s): %s', url, attempt, exc)
+            if (attempt_timeout < timeout
+                    and time.monotonic() - started_at >= attempt_timeout):
+                # The attempt has timed out because of the action deadline,
+                # so it tells nothing about the host health
+                metrics.increment('deadline_exceeded', metrics.get_endpoint(url))
+                raise DeadlineExceededError(
+                    f'Request to {url} timed out at the action deadline') from exc
+            CIRCUIT_BREAKER.record_failure(host)
+            if attempt == MAX_ATTEMPTS:
+                if isinstance(exc, requests.RequestException):
+                    raise
+                raise requests.ConnectionError(f'Request to {url} failed: {exc}') from exc
+            delay = _get_backoff_delay(attempt)
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                CIRCUIT_BREAKER.record_success(host)
+                return response
+            logging.debug('Request to %s returned status %s (attempt %s)',
+                          url, response.status_code, attempt)
+            if response.status_code != 429:
+                CIRCUIT_BREAKER.record_failure(host)
+            if attempt == MAX_ATTEMPTS:
+                break
+            delay = max(_get_backoff_delay(attempt), _get_retry_after(response))
+        if not deadline.has_time_for(delay + MIN_REQUEST_TIMEOUT):
+            logging.debug('Not retrying request to %s: the action deadline is near', url)
+            if response is None:
+                raise DeadlineExceededError(f'No time left to retry request to {url}')
+            break
+        metrics.increment('retries', metrics.get_endpoint(url))
+        time.sleep(delay)
+    return response
@@ -0,0 +1,161 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Priority scheduling of upstream requests within a shared rate limit
+
+Each host has a token bucket shared between scraper processes.
+Requests are assigned to priority lanes:
+
+* :data:`INTERACTIVE` - actions that resolve a single show
+  (``find``, ``nfourl``, ``getdetails``, ``getartwork``).
+* :data:`SCAN` - bulk per-episode actions of a library scan.
+* :data:`BACKGROUND` - work not bound to an action, e.g. stale cache refresh
+  in background threads. This is the default for threads without a lane.
+
+A lower-priority lane may take a token only if it leaves a reserve
+of tokens in the bucket for higher-priority lanes, so interactive calls
+are not delayed by a large library refresh. A request that has waited
+for :data:`STARVATION_TIMEOUT` ignores the reserve, so lower-priority work
+keeps moving when the bucket is constantly drained.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib import parse as urllib_parse
+
+from . import deadline, metrics
+from .cache_service import CACHE_DIR
+from .file_utils import FileLock, write_file_atomic
+
+INTERACTIVE = 'interactive'
+SCAN = 'scan'
+BACKGROUND = 'background'
+ACTION_LANES = {
+    'find': INTERACTIVE,
+    'nfourl': INTERACTIVE,
+    'getdetails': INTERACTIVE,
+    'getartwork': INTERACTIVE,
+    'getepisodelist': SCAN,
+    'getepisodedetails': SCAN,
+    'warmup': BACKGROUND,
+}
+# Share of bucket capacity that a lane leaves for higher-priority lanes
+LANE_RESERVES = {
+    INTERACTIVE: 0.0,
+    SCAN: 0.2,
+    BACKGROUND: 0.5,
+}
+# (requests per second, bucket capacity) by host.
+# TVmaze allows at least 20 calls per 10 seconds per IP.
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    'api.tvmaze.com': (2.0, 20.0),
+    'www.imdb.com': (2.0, 10.0),
+}
+STARVATION_TIMEOUT = 15.0  # seconds
+# Background requests give up after this wait and are retried later
+MAX_BACKGROUND_WAIT = 60.0  # seconds
+MAX_SLEEP = 1.0  # seconds
+RATE_LIMITS_STATE_FILE = os.path.join(CACHE_DIR, 'rate_limits.json')
+
+_local = threading.local()
+
+
+def set_lane(lane: Optional[str]) -> None:
+    """
+    Set the priority lane for requests made by the current thread
+
+    :param lane: lane name or None to reset to :data:`BACKGROUND`
+    """
+    _local.lane = lane
+
+
+def get_lane() -> str:
+    return getattr(_local, 'lane', None) or BACKGROUND
+
+
+def set_lane_for_action(action: str) -> None:
+    set_lane(ACTION_LANES.get(action.lower(), INTERACTIVE))
+
+
+def _load_state() -> Dict[str, Dict[str, float]]:
+    try:
+        with open(RATE_LIMITS_STATE_FILE, 'r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except (IOError, ValueError):
+        return {}
+
+
+def _take_token(host: str, rate: float, capacity: float, reserve: float) -> float:
+    """
+    Take a token from the host bucket if more than ``reserve`` tokens are available
+
+    :return: 0 if the token has been taken, otherwise the estimated wait time in seconds
+    """
+    with FileLock(RATE_LIMITS_STATE_FILE + '.lock', timeout=1.0):
+        state = _load_state()
+        now = time.time()
+        bucket = state.get(host) or {'tokens': capacity, 'updated': now}
+        elapsed = max(now - bucket['updated'], 0.0)
+        tokens = min(capacity, bucket['tokens'] + elapsed * rate)
+        wait = 0.0
+        if tokens - 1 >= reserve:
+            tokens -= 1
+        else:
+            wait = (reserve + 1 - tokens) / rate
+        state[host] = {'tokens': tokens, 'updated': now}
+        write_file_atomic(RATE_LIMITS_STATE_FILE, json.dumps(state))
+    return wait
+
+
+def acquire(url: str) -> bool:
+    """
+    Wait for the turn of the current thread's lane to make a request
+
+    :param url: request URL
+    :return: False if the request cannot be made within the action deadline
+        or :data:`MAX_BACKGROUND_WAIT` for background requests
+    """
+    host = urllib_parse.urlparse(url).netloc
+    rate_limit = RATE_LIMITS.get(host)
+    if rate_limit is None:
+        return True
+    rate, capacity = rate_limit
+    lane = get_lane()
+    start = time.monotonic()
+    has_waited = False
+    while True:
+        waited = time.monotonic() - start
+        reserve = LANE_RESERVES[lane] * capacity if waited < STARVATION_TIMEOUT else 0.0
+        try:
+            wait = _take_token(host, rate, capacity, reserve)
+        except (OSError, TimeoutError) as exc:
+            logging.debug('Unable to update rate limit state: %s', exc)
+            return True
+        if not wait:
+            if has_waited:
+                metrics.increment('rate_limit_waits', lane)
+                metrics.increment('rate_limit_wait_ms', lane, int(waited * 1000))
+            return True
+        if ((lane == BACKGROUND and waited + wait > MAX_BACKGROUND_WAIT)
+                or not deadline.has_time_for(wait)):
+            metrics.increment('rate_limit_rejected', lane)
+            return False
+        time.sleep(min(wait, MAX_SLEEP))
+        has_waited = True
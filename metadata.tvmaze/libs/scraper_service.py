@@ -0,0 +1,203 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Long-lived scraper service
+
+The service is started by Kodi and handles scraper calls forwarded
+by short-lived plugin processes (see :mod:`service_client`) in threads
+of a single process. Imported modules, the in-process memory cache,
+the external ID crosswalk and other per-process state stay warm between calls.
+
+ListItems and ``xbmcplugin`` calls cannot be passed between processes,
+so in the service they are replaced with recorders and the recorded calls
+are sent back to the plugin process to be replayed.
+"""
+
+import functools
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+import xbmcplugin
+
+from . import actions, library_planner, utils
+from .exception_logger import catch_exception
+from .service_client import SOCKET_PATH, LISTITEM_KEY, is_supported
+
+SETTINGS_CHECK_INTERVAL = 5  # seconds
+RECORDED_PLUGIN_FUNCTIONS = ('addDirectoryItem', 'addDirectoryItems',
+                             'setResolvedUrl', 'endOfDirectory')
+
+_recorder = threading.local()
+
+
+class RecordingListItem:  # pylint: disable=too-few-public-methods
+    """ListItem stand-in that records method calls to be replayed by the plugin process"""
+
+    def __init__(self, *args, **kwargs):
+        self.spec: Dict[str, Any] = {'args': list(args), 'kwargs': kwargs, 'calls': []}
+
+    def __getattr__(self, name: str):
+        def record(*args, **kwargs):
+            self.spec['calls'].append([name, list(args), kwargs])
+        return record
+
+
+def _record_plugin_call(function: str, _handle: int, *args: Any, **kwargs: Any) -> None:
+    # The plugin handle is replaced with the handle of the plugin process on replay
+    _recorder.calls.append([function, list(args), kwargs])
+
+
+def _encode_list_item(obj: Any) -> Dict[str, Any]:
+    if isinstance(obj, RecordingListItem):
+        return {LISTITEM_KEY: obj.spec}
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def install_recorders() -> None:
+    """Replace ListItem and xbmcplugin functions with recorders in this process"""
+    xbmcgui.ListItem = RecordingListItem
+    for function in RECORDED_PLUGIN_FUNCTIONS:
+        setattr(xbmcplugin, function, functools.partial(_record_plugin_call, function))
+
+
+class CallHandler(socketserver.StreamRequestHandler):
+    """Handles a single scraper call forwarded by a plugin process"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError as exc:
+            logging.warning('Invalid scraper service request: %s', exc)
+            return
+        _recorder.calls = []
+        error = None
+        try:
+            with catch_exception(logging.error,
+                                 compact=utils.ADDON.getSettingBool('compact_exception_reports')):
+                actions.handle_call(request['paramstring'])
+        except Exception as exc:  # pylint: disable=broad-except
+            error = f'{exc.__class__.__name__}: {exc}'
+        calls: List[List[Any]] = _recorder.calls
+        _recorder.calls = []
+        response = json.dumps({'calls': calls, 'error': error}, default=_encode_list_item)
+        self.wfile.write(response.encode('utf-8') + b'\n')
+        self.wfile.flush()
+        # The plugin process has got the result, so housekeeping does not delay it
+        actions.finish_call()
+
+
+class ScraperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _refresh_addon_settings() -> None:
+    """
+    Replace Addon instance in scraper modules
+
+    An Addon instance in a long-lived process does not see settings
+    changed after it has been created.
+    """
+    old_addon = utils.ADDON
+    new_addon = xbmcaddon.Addon()
+    for name, module in list(sys.modules.items()):
+        if name.startswith(__package__) and getattr(module, 'ADDON', None) is old_addon:
+            module.ADDON = new_addon
+
+
+class ServiceMonitor(xbmc.Monitor):
+
+    def onSettingsChanged(self):  # pylint: disable=invalid-name
+        _refresh_addon_settings()
+
+
+def _start_server() -> ScraperServer:
+    try:
+        os.remove(SOCKET_PATH)
+    except OSError:
+        pass
+    server = ScraperServer(SOCKET_PATH, CallHandler)
+    threading.Thread(target=server.serve_forever, name='tvmaze-service', daemon=True).start()
+    logging.info('Scraper service is listening on %s', SOCKET_PATH)
+    return server
+
+
+def _stop_server(server: ScraperServer) -> None:
+    # The socket file is removed first, so new calls are handled in-process
+    try:
+        os.remove(SOCKET_PATH)
+    except OSError:
+        pass
+    server.shutdown()
+    server.server_close()
+    logging.info('Scraper service is stopped')
+
+
+def _warm_up_library(monitor: xbmc.Monitor) -> None:
+    try:
+        library_planner.warm_up_library(monitor.abortRequested)
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Cache warm-up failed')
+
+
+def _maybe_start_warmup(monitor: xbmc.Monitor,
+                        warmup_thread: Optional[threading.Thread]) -> Optional[threading.Thread]:
+    """Start cache warm-up for library shows if it is enabled and due"""
+    if warmup_thread is not None and warmup_thread.is_alive():
+        return warmup_thread
+    if (not utils.ADDON.getSettingBool('library_warmup')
+            or not library_planner.is_warmup_due()
+            or xbmc.getCondVisibility('Library.IsScanningVideo')):
+        return None
+    # Not a tracked background task, so that scraper calls do not wait for it
+    warmup_thread = threading.Thread(target=_warm_up_library, args=(monitor,),
+                                     name='tvmaze-warmup', daemon=True)
+    warmup_thread.start()
+    return warmup_thread
+
+
+def run() -> None:
+    """Run the scraper service until Kodi exits"""
+    is_server_supported = is_supported()
+    if is_server_supported:
+        install_recorders()
+    else:
+        logging.info('Unix sockets are not supported on this platform. '
+                     'Scraper calls are handled in-process')
+    monitor = ServiceMonitor()
+    server: Optional[ScraperServer] = None
+    warmup_thread: Optional[threading.Thread] = None
+    try:
+        while True:
+            enabled = is_server_supported and utils.ADDON.getSettingBool('scraper_service')
+            if enabled and server is None:
+                server = _start_server()
+            elif not enabled and server is not None:
+                _stop_server(server)
+                server = None
+            warmup_thread = _maybe_start_warmup(monitor, warmup_thread)
+            if monitor.waitForAbort(SETTINGS_CHECK_INTERVAL):
+                break
+    finally:
+        if server is not None:
+            _stop_server(server)
@@ -0,0 +1,124 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Client for the scraper service
+
+A scraper call is forwarded to the scraper service (see :mod:`scraper_service`)
+over a Unix socket. The service returns ``xbmcplugin`` calls and ListItems
+recorded while handling the call, and they are replayed in the plugin process.
+
+The protocol is one JSON line per request and response:
+
+* request: ``{"paramstring": "..."}``
+* response: ``{"calls": [[function, args, kwargs], ...], "error": null}``,
+  ListItems in arguments are encoded as ``{"__listitem__": {"args": [...],
+  "kwargs": {...}, "calls": [[method, args, kwargs], ...]}}``.
+
+This module imports only lightweight modules, so forwarding a call
+does not require importing the rest of the scraper.
+"""
+
+import json
+import logging
+import os
+import socket
+import sys
+from typing import Any, Dict, List
+
+import xbmcgui
+import xbmcplugin
+import xbmcvfs
+
+from . import deadline
+from .utils import ADDON_ID
+
+
+def _get_socket_path() -> str:
+    # The socket is in the cache directory of cache_service that is not imported here
+    temp_dir = xbmcvfs.translatePath('special://temp')
+    if isinstance(temp_dir, bytes):
+        temp_dir = temp_dir.decode('utf-8')
+    return os.path.join(temp_dir, 'scrapers', ADDON_ID, 'service.sock')
+
+
+SOCKET_PATH = _get_socket_path()
+LISTITEM_KEY = '__listitem__'
+CONNECT_TIMEOUT = 1.0  # seconds
+# The service may take as long as the longest action budget
+RESPONSE_TIMEOUT = max(deadline.ACTION_BUDGETS.values()) + 10.0  # seconds
+RECEIVE_BUFFER_SIZE = 65536
+
+
+def is_supported() -> bool:
+    """Check if Unix sockets are available on this platform"""
+    return hasattr(socket, 'AF_UNIX')
+
+
+def _decode_list_item(obj: Dict[str, Any]) -> Any:
+    spec = obj.get(LISTITEM_KEY)
+    if spec is None:
+        return obj
+    list_item = xbmcgui.ListItem(*spec['args'], **spec['kwargs'])
+    for method, args, kwargs in spec['calls']:
+        getattr(list_item, method)(*args, **kwargs)
+    return list_item
+
+
+def _replay_calls(calls: List[List[Any]]) -> None:
+    handle = int(sys.argv[1])
+    for function, args, kwargs in calls:
+        if function == 'addDirectoryItems':
+            args[0] = [tuple(item) for item in args[0]]
+        getattr(xbmcplugin, function)(handle, *args, **kwargs)
+
+
+def _receive_line(sock: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = sock.recv(RECEIVE_BUFFER_SIZE)
+        if not chunk:
+            raise ConnectionError('The scraper service closed the connection')
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            return b''.join(chunks)
+
+
+def forward_call(paramstring: str) -> bool:
+    """
+    Forward a scraper call to the scraper service
+
+    :param paramstring: url-encoded query string
+    :return: True if the call has been handled by the service, False if the service
+        is not available and the call needs to be handled in-process
+    :raises RuntimeError: if the service has failed to handle the call
+    """
+    if not is_supported() or not os.path.exists(SOCKET_PATH):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            sock.settimeout(RESPONSE_TIMEOUT)
+            sock.sendall(json.dumps({'paramstring': paramstring}).encode('utf-8') + b'\n')
+            response_json = _receive_line(sock)
+        response = json.loads(response_json, object_hook=_decode_list_item)
+    except (OSError, ValueError) as exc:
+        logging.debug('Scraper service is not available: %s', exc)
+        return False
+    _replay_calls(response['calls'])
+    if response['error'] is not None:
+        raise RuntimeError(f'Scraper service failed to handle the call: {response["error"]}')
+    return True
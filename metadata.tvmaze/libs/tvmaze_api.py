@@ -21,8 +21,9 @@ from typing import Text, Optional, Union, List, Dict, Any
 
 import simple_requests as requests
 
-from . import cache_service as cache
+from . import cache_service as cache, deadline, request_policy
 from .imdb_rating import get_imdb_rating
+from .utils import ADDON, run_in_background
 
 InfoType = Dict[str, Any]  # pylint: disable=invalid-name
 
@@ -31,9 +32,13 @@ SEARCH_BY_EXTERNAL_ID_URL = 'http://api.tvmaze.com/lookup/shows'
 SHOW_INFO_URL = 'http://api.tvmaze.com/shows/{}'
 EPISODE_LIST_URL = 'http://api.tvmaze.com/shows/{}/episodes'
 EPISODE_INFO_URL = 'http://api.tvmaze.com/episodes/{}'
+SEASON_EPISODES_URL = 'http://api.tvmaze.com/seasons/{}/episodes'
 ALTERNATE_LISTS_URL = 'http://api.tvmaze.com/shows/{}/alternatelists'
 ALTERNATE_EPISODES_URL = 'http://api.tvmaze.com/alternatelists/{}/alternateepisodes'
 
+# Do not start fetching an optional IMDB rating if less time is left for the current action
+IMDB_RATING_TIME_RESERVE = 5.0  # seconds
+
 HEADERS = (
     ('User-Agent', 'Kodi scraper for tvmaze.com by Roman V.M.'),
     ('Accept', 'application/json'),
@@ -48,10 +53,10 @@ def _load_info(url: str,
     :param url: API endpoint URL
     :param params: URL query params
     :return: API response
-    :raises requests.exceptions.HTTPError: if any error happens
+    :raises requests.RequestException: if any error happens
     """
     logging.debug('Calling URL "%s" with params %s', url, params)
-    response = requests.get(url, params=params, headers=dict(HEADERS))
+    response = request_policy.get(url, params=params, headers=dict(HEADERS))
     if not response.ok:
         response.raise_for_status()
     json_response = response.json()
@@ -67,55 +72,135 @@ def search_show(title: str) -> List[InfoType]:
     :return: a list with found TV shows
     """
     try:
-        return _load_info(SEARCH_URL, {'q': title})
-    except requests.HTTPError as exc:
+        search_results = _load_info(SEARCH_URL, {'q': title})
+    except requests.RequestException as exc:
         logging.error('TVmaze returned an error: %s', exc)
         return []
+    cache.cache_external_ids(res['show'] for res in search_results)
+    return search_results
 
 
 def load_show_info(show_id: str) -> Optional[InfoType]:
     """
     Get full info for a single show
 
+    If cached show info is expired and "stale_while_revalidate" setting
+    is enabled, the stale show info is returned immediately and refreshed
+    in background. Stale show info is also returned if TVmaze is unreachable.
+
     :param show_id: TVmaze show ID
     :return: show info or None
     """
-    show_info = cache.load_show_info_from_cache(show_id)
-    if show_info is None:
-        show_info_url = SHOW_INFO_URL.format(show_id)
-        params = {'embed[]': ['cast', 'seasons', 'images', 'crew']}
-        try:
-            show_info = _load_info(show_info_url, params)
-        except requests.HTTPError as exc:
-            logging.error('TVmaze returned an error: %s', exc)
-            return None
-        if isinstance(show_info['_embedded']['images'], list):
-            show_info['_embedded']['images'].sort(key=lambda img: img['main'],
-                                                  reverse=True)
-        external_ids = show_info.get('externals') or {}
-        imdb_id = external_ids.get('imdb')
-        if imdb_id is not None:
-            show_info['imdb_rating'] = get_imdb_rating(imdb_id)
-        else:
-            show_info['imdb_rating'] = None
-        cache.cache_show_info(show_info)
+    cached_show_info = cache.load_cached_show_info(show_id)
+    if cached_show_info is not None and not cached_show_info.is_stale:
+        show_info = cached_show_info.value
+        if 'imdb_rating' not in show_info and deadline.has_time_for(IMDB_RATING_TIME_RESERVE):
+            # IMDB rating was skipped previously because the action had no time for it
+            _add_imdb_rating(show_info)
+            cache.cache_show_info(show_info)
+        return show_info
+    if cached_show_info is not None and ADDON.getSettingBool('stale_while_revalidate'):
+        if cache.claim_revalidation(f'show_info_{show_id}'):
+            run_in_background(_revalidate_show_info, show_id)
+        return cached_show_info.value
+    show_info = _fetch_show_info(show_id)
+    if show_info is None and cached_show_info is not None:
+        logging.warning('Unable to refresh show info for show %s. Using stale info.', show_id)
+        return cached_show_info.value
     return show_info
 
 
+def _fetch_show_info(show_id: str) -> Optional[InfoType]:
+    """Load show info from TVmaze and save it to cache"""
+    show_info_url = SHOW_INFO_URL.format(show_id)
+    # "nextepisode" is used to pick cache TTLs for running shows
+    params = {'embed[]': ['cast', 'seasons', 'images', 'crew', 'nextepisode']}
+    try:
+        show_info = _load_info(show_info_url, params)
+    except requests.RequestException as exc:
+        logging.error('TVmaze returned an error: %s', exc)
+        return None
+    if isinstance(show_info['_embedded']['images'], list):
+        show_info['_embedded']['images'].sort(key=lambda img: img['main'],
+                                              reverse=True)
+    _add_imdb_rating(show_info)
+    cache.cache_show_info(show_info)
+    cache.cache_external_ids([show_info])
+    return show_info
+
+
+def _revalidate_show_info(show_id: str) -> bool:
+    try:
+        if _fetch_show_info(show_id) is None:
+            cache.add_to_revalidation_queue('show_info', show_id)
+            return False
+        return True
+    finally:
+        cache.release_revalidation(f'show_info_{show_id}')
+
+
+def refresh_show_info(show_id: str) -> bool:
+    """
+    Refresh cached show info from TVmaze unless another process is refreshing it
+
+    :param show_id: TVmaze show ID
+    :return: True if show info has been refreshed
+    """
+    return cache.claim_revalidation(f'show_info_{show_id}') and _revalidate_show_info(show_id)
+
+
+def _add_imdb_rating(show_info: InfoType) -> None:
+    """
+    Add IMDB rating to show info
+
+    IMDB rating is optional, so if the current action is running out of time,
+    a stale rating from cache is used. If there is no cached rating either,
+    "imdb_rating" key is not set, so that the rating is fetched next time.
+    """
+    external_ids = show_info.get('externals') or {}
+    imdb_id = external_ids.get('imdb')
+    if imdb_id is None:
+        show_info['imdb_rating'] = None
+        return
+    imdb_rating = None
+    is_skipped = not deadline.has_time_for(IMDB_RATING_TIME_RESERVE)
+    if is_skipped:
+        logging.debug('Not enough time to fetch IMDB rating for %s', imdb_id)
+    else:
+        imdb_rating = get_imdb_rating(imdb_id)
+        if imdb_rating is not None:
+            cache.cache_imdb_rating(imdb_id, imdb_rating)
+    if imdb_rating is None:
+        imdb_rating = cache.load_imdb_rating_from_cache(imdb_id)
+    if imdb_rating is None and is_skipped:
+        show_info.pop('imdb_rating', None)
+    else:
+        show_info['imdb_rating'] = imdb_rating
+
+
 def load_show_info_by_external_id(provider: str, show_id: str) -> Optional[InfoType]:
     """
     Load show info by external ID (TheTVDB or IMDB)
 
+    Known external IDs are resolved locally from the crosswalk
+    (see :func:`cache_service.cache_external_ids`) without a network request.
+
     :param provider: 'imdb' or 'thetvdb'
     :param show_id: show ID in the respective provider
-    :return: show info or None
+    :return: show info (only with "id" field if resolved locally) or None
     """
+    tvmaze_id = cache.load_show_id_by_external_id(provider, show_id)
+    if tvmaze_id is not None:
+        return {'id': tvmaze_id}
     query = {provider: show_id}
     try:
-        return _load_info(SEARCH_BY_EXTERNAL_ID_URL, query)
-    except requests.HTTPError as exc:
+        show_info = _load_info(SEARCH_BY_EXTERNAL_ID_URL, query)
+    except requests.RequestException as exc:
         logging.error('TVmaze returned an error: %s', exc)
         return None
+    if show_info:
+        cache.cache_external_ids([show_info])
+    return show_info
 
 
 def _get_alternate_episode_list_id(show_id: str, episode_order: str) -> Optional[int]:
@@ -123,7 +208,7 @@ def _get_alternate_episode_list_id(show_id: str, episode_order: str) -> Optional
     url = ALTERNATE_LISTS_URL.format(show_id)
     try:
         alternate_lists = _load_info(url)
-    except requests.HTTPError as exc:
+    except requests.RequestException as exc:
         logging.error('TVmaze returned an error: %s', exc)
     else:
         for episode_list in alternate_lists:
@@ -140,7 +225,7 @@ def load_alternate_episode_list(show_id: str, episode_order: str) -> Optional[Li
         url = ALTERNATE_EPISODES_URL.format(alternate_order_id)
         try:
             raw_alternate_episodes = _load_info(url, {'embed': 'episodes'})
-        except requests.HTTPError as exc:
+        except requests.RequestException as exc:
             logging.error('TVmaze returned an error: %s', exc)
         else:
             alternate_episodes = []
@@ -163,15 +248,30 @@ def load_episode_list(show_id: str, episode_order: str) -> Optional[List[InfoTyp
         episode_list_url = EPISODE_LIST_URL.format(show_id)
         try:
             episode_list = _load_info(episode_list_url, {'specials': '1'})
-        except requests.HTTPError as exc:
+        except requests.RequestException as exc:
             logging.error('TVmaze returned an error: %s', exc)
     return episode_list
 
 
+def load_season_episodes(season_id: Union[str, int]) -> Optional[List[InfoType]]:
+    """
+    Load episodes of a single season including specials
+
+    :param season_id: TVmaze season ID
+    :return: the list of season episodes or None
+    """
+    url = SEASON_EPISODES_URL.format(season_id)
+    try:
+        return _load_info(url, {'specials': '1'})
+    except requests.RequestException as exc:
+        logging.error('TVmaze returned an error: %s', exc)
+        return None
+
+
 def load_episode_info(episode_id: Union[str, int]) -> Optional[InfoType]:
     url = EPISODE_INFO_URL.format(episode_id)
     try:
         return _load_info(url)
-    except requests.HTTPError as exc:
+    except requests.RequestException as exc:
         logging.error('TVmaze returned an error: %s', exc)
         return None
@@ -0,0 +1,152 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Asyncio client for bulk TVmaze requests
+
+Bulk methods run the synchronous functions of :mod:`tvmaze_api` and
+:mod:`data_service` in a bounded pool of worker threads, so they share
+caching, post-processing and the rate limiting of :mod:`request_scheduler`
+with single calls. Kodi Python has no asynchronous HTTP client,
+so network I/O itself stays blocking in the worker threads.
+
+Worker threads inherit the deadline and the request lane of the thread
+that awaits a call. Example::
+
+    async def load_library(show_ids):
+        async with AsyncClient(max_concurrency=4) as client:
+            return await client.load_show_infos(show_ids)
+
+    show_infos = asyncio.run(load_library(['1', '2', '3']))
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from . import data_service, deadline, request_scheduler, tvmaze_api
+from .episode_store import EpisodeStore
+from .tvmaze_api import InfoType
+
+DEFAULT_CONCURRENCY = 4
+
+ResultType = TypeVar('ResultType')
+
+
+def _call_in_context(func: Callable[..., ResultType], action_deadline: Optional[float],
+                     lane: str, *args: Any) -> ResultType:
+    deadline.set_deadline(action_deadline)
+    request_scheduler.set_lane(lane)
+    try:
+        return func(*args)
+    finally:
+        deadline.clear()
+        request_scheduler.set_lane(None)
+
+
+class AsyncClient:
+    """
+    Asyncio client with bulk methods
+
+    :param max_concurrency: max number of calls that run at the same time
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_CONCURRENCY):
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='tvmaze-async')
+
+    async def __aenter__(self) -> 'AsyncClient':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def call(self, func: Callable[..., ResultType], *args: Any) -> ResultType:
+        """
+        Run a synchronous function in a worker thread
+
+        :param func: function that makes TVmaze requests
+        :param args: function arguments
+        :return: function result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, _call_in_context, func,
+            deadline.get_deadline(), request_scheduler.get_lane(), *args)
+
+    async def map(self, func: Callable[..., ResultType],
+                  args_list: Iterable[Sequence[Any]]) -> List[ResultType]:
+        """
+        Run a synchronous function for each set of arguments
+
+        Calls are started in the order of ``args_list``.
+
+        :param func: function that makes TVmaze requests
+        :param args_list: positional arguments for each call
+        :return: results in the order of ``args_list``
+        """
+        return list(await asyncio.gather(*(self.call(func, *args) for args in args_list)))
+
+    async def load_show_infos(self, show_ids: Sequence[str]) -> Dict[str, Optional[InfoType]]:
+        """
+        Load show infos like :func:`tvmaze_api.load_show_info`
+
+        :param show_ids: TVmaze show IDs
+        :return: show infos by show ID
+        """
+        show_infos = await self.map(tvmaze_api.load_show_info,
+                                    ((show_id,) for show_id in show_ids))
+        return dict(zip(show_ids, show_infos))
+
+    async def load_episode_lists(self, show_ids: Sequence[str],
+                                 episode_order: str) -> Dict[str, Optional[List[InfoType]]]:
+        """
+        Load raw episode lists like :func:`tvmaze_api.load_episode_list`
+
+        :param show_ids: TVmaze show IDs
+        :param episode_order: episode order
+        :return: episode lists by show ID
+        """
+        episode_lists = await self.map(tvmaze_api.load_episode_list,
+                                       ((show_id, episode_order) for show_id in show_ids))
+        return dict(zip(show_ids, episode_lists))
+
+    async def load_episodes_maps(self, show_ids: Sequence[str],
+                                 episode_order: str) -> Dict[str, EpisodeStore]:
+        """
+        Get processed and cached episodes maps like :func:`data_service.get_episodes_map`
+
+        :param show_ids: TVmaze show IDs
+        :param episode_order: episode order
+        :return: episodes maps by show ID
+        """
+        episodes_maps = await self.map(data_service.get_episodes_map,
+                                       ((show_id, episode_order) for show_id in show_ids))
+        return dict(zip(show_ids, episodes_maps))
+
+    async def load_shows_by_external_ids(
+            self, external_ids: Sequence[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Optional[InfoType]]:
+        """
+        Look up shows like :func:`tvmaze_api.load_show_info_by_external_id`
+
+        :param external_ids: ``(provider, external ID)`` pairs
+        :return: show infos by ``(provider, external ID)`` pair
+        """
+        show_infos = await self.map(tvmaze_api.load_show_info_by_external_id, external_ids)
+        return dict(zip(external_ids, show_infos))
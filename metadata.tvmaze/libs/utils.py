@@ -15,7 +15,8 @@
 
 """Misc utils"""
 import logging
-from typing import Text, Any, Dict
+import threading
+from typing import Text, Any, Dict, Callable, List
 
 import xbmc
 from xbmcaddon import Addon
@@ -26,6 +27,10 @@ VERSION = ADDON.getAddonInfo('version')
 
 LOG_FORMAT = '[{addon_id} v.{addon_version}] {filename}:{lineno} - {message}'
 
+# Background tasks are tracked per addon call: in the scraper service
+# each call is handled in its own thread
+_local = threading.local()
+
 EPISODE_ORDER_MAP = {
     0: 'default',
     1: 'dvd_release',
@@ -82,3 +87,39 @@ def get_episode_order(path_settings: Dict[Text, Any]) -> str:
         episode_order_enum = ADDON.getSettingInt('episode_order')
     episode_order = EPISODE_ORDER_MAP.get(episode_order_enum, 'default')
     return episode_order
+
+
+def run_in_background(func: Callable[..., Any], *args: Any, **kwargs: Any) -> threading.Thread:
+    """
+    Run a function in a background thread
+
+    Exceptions in the function are logged and suppressed. The task belongs
+    to the current addon call, and tasks that it starts belong to the same call.
+    """
+    background_tasks = _get_background_tasks()
+
+    def _task():
+        _local.background_tasks = background_tasks
+        try:
+            func(*args, **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Background task %s failed', func.__name__)
+
+    thread = threading.Thread(target=_task, name=f'tvmaze-{func.__name__}')
+    background_tasks.append(thread)
+    thread.start()
+    return thread
+
+
+def _get_background_tasks() -> List[threading.Thread]:
+    background_tasks = getattr(_local, 'background_tasks', None)
+    if background_tasks is None:
+        background_tasks = _local.background_tasks = []
+    return background_tasks
+
+
+def wait_for_background_tasks() -> None:
+    """Wait until background tasks started by the current addon call are finished"""
+    background_tasks = _get_background_tasks()
+    while background_tasks:
+        background_tasks.pop().join()
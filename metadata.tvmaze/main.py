@@ -16,11 +16,16 @@
 import logging
 import sys
 
-from libs.actions import router
 from libs.exception_logger import catch_exception
-from libs.utils import initialize_logging
+from libs.service_client import forward_call
+from libs.utils import initialize_logging, ADDON
 
 if __name__ == '__main__':
     initialize_logging()
-    with catch_exception(logger_func=logging.error):
-        router(sys.argv[2][1:])
+    with catch_exception(logger_func=logging.error,
+                         compact=ADDON.getSettingBool('compact_exception_reports')):
+        paramstring = sys.argv[2][1:]
+        if not forward_call(paramstring):
+            # The scraper service is not running, so the call is handled in-process
+            from libs.actions import router  # pylint: disable=import-outside-toplevel
+            router(paramstring)
@@ -0,0 +1,105 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmark getepisodelist directory emission for a large show
+
+It compares the former per-episode implementation (URL encoding and
+``addDirectoryItem`` call for each episode) with the current one that uses
+pre-computed episode URLs and batched ``addDirectoryItems`` calls.
+Kodistubs functions do nothing, so the cost of crossing the Python/C++
+boundary inside Kodi is emulated with ``--call-overhead-us`` busy wait
+per ``xbmcplugin`` call. Example::
+
+    python tools/benchmark_episode_list.py --episodes 5000
+"""
+import argparse
+import tempfile
+import time
+import timeit
+from urllib import parse as urllib_parse
+
+from scan_simulator import StandInData, setup_kodi_environment
+
+SHOW_ID = '1'
+
+
+def _busy_wait(microseconds: float) -> None:
+    end = time.perf_counter() + microseconds / 1000000
+    while time.perf_counter() < end:
+        pass
+
+
+def main() -> None:
+    # pylint: disable=import-outside-toplevel,import-error
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--episodes', type=int, default=5000, help='episodes in the show')
+    parser.add_argument('--repeat', type=int, default=5, help='benchmark repetitions')
+    parser.add_argument('--call-overhead-us', type=float, default=20.0,
+                        help='emulated cost of a single xbmcplugin call in microseconds')
+    args = parser.parse_args()
+    setup_kodi_environment('http://127.0.0.1:1', tempfile.mkdtemp(prefix='tvmaze-bench-'), {})
+    import xbmcgui
+    import xbmcplugin
+    from libs import actions, data_service
+
+    add_directory_item = xbmcplugin.addDirectoryItem
+    add_directory_items = xbmcplugin.addDirectoryItems
+
+    def emulated_add_directory_item(*a, **kw):
+        _busy_wait(args.call_overhead_us)
+        return add_directory_item(*a, **kw)
+
+    def emulated_add_directory_items(*a, **kw):
+        _busy_wait(args.call_overhead_us)
+        return add_directory_items(*a, **kw)
+
+    xbmcplugin.addDirectoryItem = emulated_add_directory_item
+    xbmcplugin.addDirectoryItems = emulated_add_directory_items
+
+    episode_list = StandInData(args.episodes).episodes(int(SHOW_ID))
+    episodes_map = data_service._process_episode_list(  # pylint: disable=protected-access
+        episode_list)
+    data_service.get_episodes_map = lambda show_id, episode_order: episodes_map
+
+    def legacy_get_episode_list():
+        for episode in episodes_map:
+            list_item = xbmcgui.ListItem(episode['name'], offscreen=True)
+            data_service.add_episode_info(list_item, episode, full_info=False)
+            encoded_ids = urllib_parse.urlencode({
+                'show_id': SHOW_ID,
+                'episode_id': str(episode['id']),
+                'season': str(episode['season']),
+                'episode': str(episode['number']),
+            })
+            url = urllib_parse.quote(encoded_ids)
+            xbmcplugin.addDirectoryItem(actions.HANDLE, url=url, listitem=list_item,
+                                        isFolder=True)
+
+    def batched_get_episode_list():
+        actions.get_episode_list(SHOW_ID, 'default')
+
+    print(f'Episodes: {len(episodes_map)}, emulated xbmcplugin call overhead: '
+          f'{args.call_overhead_us}us')
+    results = {}
+    for name, func in (('per-item', legacy_get_episode_list),
+                       ('batched', batched_get_episode_list)):
+        results[name] = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f'{name:<10} {results[name] * 1000:>10.1f} ms')
+    print(f'Speedup: {results["per-item"] / results["batched"]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
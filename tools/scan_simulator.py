@@ -0,0 +1,641 @@
+# Copyright (C) 2019, Roman Miroshnychenko aka Roman V.M. <roman1972@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+End-to-end library scan simulator
+
+It starts a local HTTP server that stands in for TVmaze API and IMDb
+and replays recorded responses (or built-in minimal payloads) for a synthetic
+library of TV shows. Then it drives ``actions.router`` through the same
+call sequence that Kodi uses during a library scan::
+
+    find -> getdetails -> getartwork -> getepisodelist -> N x getepisodedetails
+
+in a configurable number of worker processes and prints a report
+with upstream requests per show, cache hit ratios, per-action latency
+percentiles and total scan time.
+
+Requires Kodistubs and script.module.simple-requests (``simple_requests``)
+to be importable. Example::
+
+    python tools/scan_simulator.py --shows 2000 --workers 4 --latency 0.05 --throttle-rate 0.01
+
+Recorded responses can be provided with ``--recordings`` option that points
+to a directory with any of the following files captured from real services:
+``show.json`` (``/shows/{id}?embed[]=cast&embed[]=seasons&embed[]=images&embed[]=crew``),
+``episodes.json`` (``/shows/{id}/episodes?specials=1``), ``episode.json``
+and ``imdb.html``. Their IDs and names are rewritten for each synthetic show.
+"""
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional, Tuple
+from urllib import parse as urllib_parse
+from xml.etree import ElementTree
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'metadata.tvmaze')
+ADDON_ID = 'metadata.tvmaze'
+KV_PATH = '/kv/'
+ACTIONS = ('find', 'getdetails', 'getartwork', 'getepisodelist', 'getepisodedetails')
+SPECIALS_EVERY = 10  # Every 10th episode is a special without a number
+
+DEFAULT_SHOW = {
+    'id': 0,
+    'url': '',
+    'name': '',
+    'type': 'Scripted',
+    'language': 'English',
+    'genres': ['Drama'],
+    'status': 'Ended',
+    'runtime': 60,
+    'premiered': '2010-01-01',
+    'rating': {'average': 7.5},
+    'network': {'id': 1, 'name': 'Network', 'country': {'name': 'United States'}},
+    'webChannel': None,
+    'externals': {'tvrage': None, 'thetvdb': 0, 'imdb': ''},
+    'image': {'medium': 'http://img.local/medium.jpg',
+              'original': 'http://img.local/original.jpg'},
+    'summary': '<p>A synthetic <b>show</b> for library scan simulation.</p>',
+    'updated': 1600000000,
+    '_embedded': {
+        'cast': [],
+        'crew': [],
+        'seasons': [],
+        'images': [],
+    },
+}
+DEFAULT_EPISODE = {
+    'id': 0,
+    'name': '',
+    'season': 1,
+    'number': 1,
+    'type': 'regular',
+    'airdate': '2010-01-01',
+    'runtime': 60,
+    'image': None,
+    'summary': '<p>A synthetic episode.</p>',
+}
+DEFAULT_IMDB_PAGE = ('<html><head><script type="application/ld+json">'
+                     '{"aggregateRating": {"ratingValue": 7.9, "ratingCount": 12345}}'
+                     '</script></head><body></body></html>')
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class StandInData:
+    """Synthetic payloads built from recorded or default templates"""
+
+    def __init__(self, episodes_per_show: int, recordings: Optional[str] = None):
+        self.episodes_per_show = episodes_per_show
+        self.show_template = DEFAULT_SHOW
+        self.episode_template = DEFAULT_EPISODE
+        self.episodes_template = None
+        self.imdb_page = DEFAULT_IMDB_PAGE
+        if recordings:
+            self._load_recordings(recordings)
+
+    def _load_recordings(self, recordings: str) -> None:
+        def _read(file_name):
+            path = os.path.join(recordings, file_name)
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r', encoding='utf-8') as fo:
+                return fo.read()
+
+        show_json = _read('show.json')
+        if show_json:
+            self.show_template = json.loads(show_json)
+        episode_json = _read('episode.json')
+        if episode_json:
+            self.episode_template = json.loads(episode_json)
+        episodes_json = _read('episodes.json')
+        if episodes_json:
+            self.episodes_template = json.loads(episodes_json)
+        self.imdb_page = _read('imdb.html') or self.imdb_page
+
+    def show(self, show_id: int, embedded: bool = True) -> Dict[str, Any]:
+        show = copy.deepcopy(self.show_template)
+        show['id'] = show_id
+        show['name'] = f'Synthetic Show {show_id}'
+        show['url'] = f'https://www.tvmaze.com/shows/{show_id}/synthetic-show-{show_id}'
+        show['externals'] = dict(show.get('externals') or {},
+                                 thetvdb=100000 + show_id, imdb=f'tt{9000000 + show_id}')
+        if embedded:
+            seasons = sorted({ep['season'] for ep in self.episodes(show_id)
+                              if ep['season']})
+            show.setdefault('_embedded', {})['seasons'] = [
+                {'id': show_id * 100 + number, 'number': number, 'name': '', 'image': None}
+                for number in seasons
+            ]
+        else:
+            show.pop('_embedded', None)
+        return show
+
+    def episodes(self, show_id: int) -> List[Dict[str, Any]]:
+        if self.episodes_template:
+            episodes = copy.deepcopy(self.episodes_template)
+            for index, episode in enumerate(episodes, 1):
+                episode['id'] = show_id * 100000 + index
+            return episodes
+        episodes = []
+        number = 0
+        for index in range(1, self.episodes_per_show + 1):
+            episode = copy.deepcopy(self.episode_template)
+            episode['id'] = show_id * 100000 + index
+            episode['name'] = f'Episode {index}'
+            episode['season'] = 1 + (index - 1) // 20
+            if index % SPECIALS_EVERY == 0:
+                episode['number'] = None
+                episode['type'] = 'insignificant_special'
+            else:
+                number += 1
+                episode['number'] = number
+            episodes.append(episode)
+        return episodes
+
+    def episode(self, episode_id: int) -> Dict[str, Any]:
+        show_id, index = divmod(episode_id, 100000)
+        for episode in self.episodes(show_id):
+            if episode['id'] == episode_id:
+                return episode
+        episode = copy.deepcopy(self.episode_template)
+        episode['id'] = episode_id
+        episode['name'] = f'Episode {index}'
+        return episode
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler for TVmaze/IMDb stand-in server"""
+    server: 'StandInServer'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _send(self, status: int, body: str, content_type: str = 'application/json',
+              headers: Tuple[Tuple[str, str], ...] = ()) -> None:
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        parsed = urllib_parse.urlparse(self.path)
+        if parsed.path.startswith(KV_PATH):
+            value = self.server.kv_store.get(parsed.path)
+            if value is None:
+                self._send(404, 'null')
+            else:
+                self._send(200, value)
+            return
+        query = dict(urllib_parse.parse_qsl(parsed.query))
+        endpoint = re.sub(r'\d+', '{id}', parsed.path)
+        server = self.server
+        server.count(endpoint)
+        if server.latency:
+            time.sleep(random.uniform(0.5, 1.5) * server.latency)
+        dice = random.random()
+        if dice < server.throttle_rate:
+            server.count_status(429)
+            self._send(429, '{"name": "Too Many Requests", "status": 429}',
+                       headers=(('Retry-After', '1'),))
+            return
+        if dice < server.throttle_rate + server.error_rate:
+            server.count_status(503)
+            self._send(503, '{"name": "Service Unavailable", "status": 503}')
+            return
+        status, body, content_type = self._route(parsed.path, query)
+        server.count_status(status)
+        self._send(status, body, content_type)
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        parsed = urllib_parse.urlparse(self.path)
+        if not parsed.path.startswith(KV_PATH):
+            self._send(405, '{"name": "Method Not Allowed", "status": 405}')
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.kv_store[parsed.path] = body.decode('utf-8')
+        self._send(204, '')
+
+    def _route(self, path: str, query: Dict[str, str]) -> Tuple[int, str, str]:
+        # pylint: disable=too-many-return-statements
+        data = self.server.data
+        match = re.fullmatch(r'/title/tt(\d+)/?', path)
+        if match is not None:
+            return 200, data.imdb_page, 'text/html'
+        if path == '/search/shows':
+            match = re.search(r'(\d+)', query.get('q', ''))
+            if match is None:
+                return 200, '[]', 'application/json'
+            show = data.show(int(match.group(1)), embedded=False)
+            return 200, json.dumps([{'score': 1.0, 'show': show}]), 'application/json'
+        if path == '/lookup/shows':
+            external_id = query.get('imdb') or query.get('thetvdb') or ''
+            match = re.search(r'(\d+)', external_id)
+            if match is None:
+                return 404, 'null', 'application/json'
+            show_id = int(match.group(1)) % 100000
+            return 200, json.dumps(data.show(show_id, embedded=False)), 'application/json'
+        match = re.fullmatch(r'/shows/(\d+)', path)
+        if match is not None:
+            return 200, json.dumps(data.show(int(match.group(1)))), 'application/json'
+        match = re.fullmatch(r'/shows/(\d+)/episodes', path)
+        if match is not None:
+            return 200, json.dumps(data.episodes(int(match.group(1)))), 'application/json'
+        match = re.fullmatch(r'/seasons/(\d+)/episodes', path)
+        if match is not None:
+            show_id, season_number = divmod(int(match.group(1)), 100)
+            episodes = [episode for episode in data.episodes(show_id)
+                        if episode['season'] == season_number]
+            return 200, json.dumps(episodes), 'application/json'
+        match = re.fullmatch(r'/shows/(\d+)/alternatelists', path)
+        if match is not None:
+            return 200, '[]', 'application/json'
+        match = re.fullmatch(r'/episodes/(\d+)', path)
+        if match is not None:
+            return 200, json.dumps(data.episode(int(match.group(1)))), 'application/json'
+        return 404, '{"name": "Not Found", "status": 404}', 'application/json'
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local stand-in for TVmaze API and IMDb
+
+    It also serves a key-value store for the shared cache at :data:`KV_PATH`.
+    Key-value requests are not counted as upstream requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, data: StandInData, latency: float, error_rate: float,
+                 throttle_rate: float):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.kv_store: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def count_status(self, status: int) -> None:
+        with self._lock:
+            self.statuses[status] += 1
+
+
+class _WorkerState:
+    """Kodi environment emulation for a worker process"""
+    plugin_items: List[Tuple[str, Any]] = []
+    resolved: Optional[Any] = None
+    cache_lookups = Counter()
+
+
+def _load_default_settings() -> Dict[str, str]:
+    """Read addon setting defaults from settings.xml"""
+    tree = ElementTree.parse(os.path.join(ADDON_DIR, 'resources', 'settings.xml'))
+    return {setting.get('id'): setting.findtext('default') or ''
+            for setting in tree.iter('setting')}
+
+
+def setup_kodi_environment(base_url: str, temp_dir: str, settings: Dict[str, str],
+                           rate_limit: float = 0.0, separate_cache: bool = False) -> None:
+    """
+    Prepare Kodistubs environment and point the addon to the stand-in server
+
+    With ``separate_cache`` the worker emulates a separate Kodi instance
+    with its own local cache directory.
+    """
+    if separate_cache:
+        temp_dir = os.path.join(temp_dir, f'box-{os.getpid()}')
+    # pylint: disable=import-outside-toplevel,import-error
+    import xbmcaddon
+    import xbmcgui
+    import xbmcplugin
+    import xbmcvfs
+
+    window_properties = {}
+
+    class RecordingListItem(xbmcgui.ListItem):
+        def __init__(self, label='', *args, **kwargs):  # pylint: disable=keyword-arg-before-vararg
+            super().__init__(label, *args, **kwargs)
+            self.label = label
+            self.info = {}
+            self.unique_ids = {}
+
+        def setInfo(self, type, infoLabels):  # pylint: disable=redefined-builtin
+            self.info.update(infoLabels)
+
+        def setUniqueIDs(self, values, defaultrating=''):
+            self.unique_ids.update(values)
+
+    def add_directory_item(handle, url, listitem, isFolder=False, totalItems=0):
+        _WorkerState.plugin_items.append((url, listitem))
+        return True
+
+    def add_directory_items(handle, items, totalItems=0):
+        for url, listitem, _ in items:
+            _WorkerState.plugin_items.append((url, listitem))
+        return True
+
+    def set_resolved_url(handle, succeeded, listitem):
+        _WorkerState.resolved = listitem if succeeded else None
+
+    xbmcgui.ListItem = RecordingListItem
+    xbmcgui.Window.getProperty = lambda self, key: window_properties.get(key, '')
+    xbmcgui.Window.setProperty = lambda self, key, value: window_properties.__setitem__(key,
+                                                                                        value)
+    xbmcplugin.addDirectoryItem = add_directory_item
+    xbmcplugin.addDirectoryItems = add_directory_items
+    xbmcplugin.setResolvedUrl = set_resolved_url
+    xbmcvfs.translatePath = lambda path: path.replace(
+        'special://temp', temp_dir).replace('special://database', os.path.join(temp_dir, 'database'))
+    xbmcvfs.exists = os.path.exists
+    xbmcvfs.mkdir = lambda path: os.makedirs(path, exist_ok=True) or True
+    xbmcaddon.Addon.getAddonInfo = lambda self, info: {'id': ADDON_ID,
+                                                       'version': 'sim'}.get(info, '')
+    addon_settings = dict(_load_default_settings(), **settings)
+    xbmcaddon.Addon.getSetting = lambda self, setting_id: addon_settings.get(setting_id, '')
+    xbmcaddon.Addon.getSettingBool = lambda self, setting_id: addon_settings.get(
+        setting_id, '').lower() == 'true'
+    xbmcaddon.Addon.getSettingInt = lambda self, setting_id: int(addon_settings.get(setting_id)
+                                                                 or 0)
+    os.makedirs(os.path.join(temp_dir, 'scrapers'), exist_ok=True)
+    logging.disable(logging.CRITICAL)
+    sys.argv = [f'plugin://{ADDON_ID}/', '1', '']
+    sys.path.insert(0, ADDON_DIR)
+
+    from libs import cache_service, imdb_rating, request_scheduler, tvmaze_api
+
+    for name in dir(tvmaze_api):
+        value = getattr(tvmaze_api, name)
+        if name.endswith('_URL') and isinstance(value, str):
+            setattr(tvmaze_api, name, value.replace('http://api.tvmaze.com', base_url))
+    imdb_rating.IMDB_TITLE_URL = base_url + '/title/{}/'
+    if rate_limit:
+        # The same burst-to-rate ratio as TVmaze limit of 20 calls per 10 seconds
+        request_scheduler.RATE_LIMITS[urllib_parse.urlparse(base_url).netloc] = (
+            rate_limit, rate_limit * 10)
+
+    def counting(cache_type, func):
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            # Stale entries returned by load_cached_* functions count as misses
+            is_hit = result is not None and not getattr(result, 'is_stale', False)
+            _WorkerState.cache_lookups[(cache_type, is_hit)] += 1
+            return result
+        return wrapper
+
+    cache_service.load_cached_show_info = counting(
+        'show_info', cache_service.load_cached_show_info)
+    cache_service.load_cached_episodes_map = counting(
+        'episodes_map', cache_service.load_cached_episodes_map)
+    cache_service.load_show_id_by_external_id = counting(
+        'external_ids', cache_service.load_show_id_by_external_id)
+
+
+def _call_router(action: str, params: Dict[str, str],
+                 latencies: Dict[str, List[float]], failures: Counter) -> None:
+    from libs.actions import router  # pylint: disable=import-outside-toplevel,import-error
+    _WorkerState.plugin_items = []
+    _WorkerState.resolved = None
+    query = urllib_parse.urlencode(dict(params, action=action))
+    start = time.perf_counter()
+    try:
+        router(query)
+    except Exception:  # pylint: disable=broad-except
+        failures[action] += 1
+    latencies[action].append(time.perf_counter() - start)
+
+
+def _create_video_database(database_path: str, show_ids: List[int],
+                           legacy_episodeguides: bool = False) -> None:
+    """Create a fixture of Kodi video database with the synthetic library"""
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
+    connection = sqlite3.connect(database_path)
+    try:
+        connection.execute('CREATE TABLE tvshow (idShow INTEGER PRIMARY KEY, '
+                           'c00 TEXT, c02 TEXT, c10 TEXT)')
+        connection.execute('CREATE TABLE uniqueid (uniqueid_id INTEGER PRIMARY KEY, '
+                           'media_id INTEGER, media_type TEXT, value TEXT, type TEXT)')
+        for show_id in show_ids:
+            unique_ids = {'tvdb': str(100000 + show_id), 'imdb': f'tt{9000000 + show_id}'}
+            if not legacy_episodeguides:
+                unique_ids['tvmaze'] = str(show_id)
+            connection.execute('INSERT INTO tvshow VALUES (?, ?, ?, ?)',
+                               (show_id, f'Synthetic Show {show_id}', 'Ended',
+                                json.dumps(unique_ids)))
+            connection.executemany(
+                "INSERT INTO uniqueid (media_id, media_type, value, type) "
+                "VALUES (?, 'tvshow', ?, ?)",
+                [(show_id, value, provider) for provider, value in unique_ids.items()])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _warm_up_library() -> int:
+    from libs import library_planner  # pylint: disable=import-outside-toplevel,import-error
+    return library_planner.warm_up_library()
+
+
+def _scan_shows(show_ids: List[int], legacy_episodeguides: bool = False) -> Dict[str, Any]:
+    """Scan a slice of the synthetic library like Kodi library scanner does"""
+    latencies = defaultdict(list)
+    failures = Counter()
+    episodes_scanned = 0
+    for show_id in show_ids:
+        _call_router('find', {'title': f'Synthetic Show {show_id}'}, latencies, failures)
+        if not _WorkerState.plugin_items:
+            continue
+        url = _WorkerState.plugin_items[0][0]
+        _call_router('getdetails', {'url': url}, latencies, failures)
+        details = _WorkerState.resolved
+        if details is None:
+            continue
+        _call_router('getartwork', {'id': details.unique_ids.get('tvmaze', url)},
+                     latencies, failures)
+        episodeguide = details.info['episodeguide']
+        if legacy_episodeguides:
+            # Libraries scraped by other scrapers have no TVmaze ID in episodeguide
+            episodeguide = json.dumps({'tvdb': details.unique_ids.get('tvdb'),
+                                       'imdb': details.unique_ids.get('imdb')})
+        _call_router('getepisodelist', {'url': episodeguide}, latencies, failures)
+        episode_urls = [item[0] for item in _WorkerState.plugin_items]
+        for episode_url in episode_urls:
+            _call_router('getepisodedetails', {'url': episode_url}, latencies, failures)
+        episodes_scanned += len(episode_urls)
+    return {
+        'latencies': dict(latencies),
+        'failures': dict(failures),
+        'cache_lookups': {f'{cache_type}:{"hit" if hit else "miss"}': count
+                          for (cache_type, hit), count in _WorkerState.cache_lookups.items()},
+        'episodes': episodes_scanned,
+    }
+
+
+def _print_report(args: argparse.Namespace, server: StandInServer,
+                  results: List[Dict[str, Any]], scan_time: float) -> None:
+    latencies = defaultdict(list)
+    failures = Counter()
+    cache_lookups = Counter()
+    episodes = 0
+    for result in results:
+        for action, values in result['latencies'].items():
+            latencies[action].extend(values)
+        failures.update(result['failures'])
+        cache_lookups.update(result['cache_lookups'])
+        episodes += result['episodes']
+    total_requests = sum(server.requests.values())
+    print(f'Shows: {args.shows}, episodes: {episodes}, workers: {args.workers}')
+    print(f'Total scan time: {scan_time:.2f}s')
+    print(f'Upstream requests: {total_requests} ({total_requests / args.shows:.2f} per show)')
+    for endpoint, count in server.requests.most_common():
+        print(f'    {endpoint:<40} {count:>8} ({count / args.shows:.2f} per show)')
+    print('Upstream statuses: ' + ', '.join(f'{status}: {count}'
+                                            for status, count in sorted(server.statuses.items())))
+    print('Cache hit ratios:')
+    for cache_type in ('show_info', 'episodes_map', 'external_ids'):
+        hits = cache_lookups[f'{cache_type}:hit']
+        lookups = hits + cache_lookups[f'{cache_type}:miss']
+        ratio = hits / lookups if lookups else 0.0
+        print(f'    {cache_type:<15} {ratio:>7.1%} ({hits}/{lookups})')
+    print(f'{"Action":<20}{"calls":>8}{"failed":>8}{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}')
+    for action in ACTIONS:
+        values = latencies.get(action, [])
+        print(f'{action:<20}{len(values):>8}{failures[action]:>8}'
+              f'{_percentile(values, 50) * 1000:>10.1f}'
+              f'{_percentile(values, 95) * 1000:>10.1f}'
+              f'{_percentile(values, 99) * 1000:>10.1f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--shows', type=int, default=1000, help='synthetic library size')
+    parser.add_argument('--episodes', type=int, default=20, help='episodes per show')
+    parser.add_argument('--workers', type=int, default=4, help='parallel scanner processes')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='mean upstream response latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of upstream responses that are HTTP 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='share of upstream responses that are HTTP 429')
+    parser.add_argument('--recordings', help='directory with recorded upstream responses')
+    parser.add_argument('--seed', type=int, default=None, help='random seed')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='shared upstream rate limit in requests per second (0 - no limit)')
+    parser.add_argument('--legacy-episodeguides', action='store_true',
+                        help='pass episodeguides with only TheTVDB and IMDB IDs')
+    parser.add_argument('--boxes', type=int, default=0,
+                        help='emulate this number of Kodi instances with separate local caches '
+                             'that scan the whole library (overrides --workers)')
+    parser.add_argument('--shared-cache', choices=('directory', 'http'),
+                        help='shared cache tier for all workers')
+    parser.add_argument('--import-snapshot', metavar='PATH',
+                        help='import a cache snapshot before the scan (not with --boxes)')
+    parser.add_argument('--export-snapshot', metavar='PATH',
+                        help='export the cache to a snapshot after the scan (not with --boxes)')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='warm up the cache for a fixture Kodi video database before the scan')
+    parser.add_argument('--setting', action='append', default=[], metavar='ID=VALUE',
+                        help='addon setting, e.g. prefetch_episodes=true (can be repeated)')
+    args = parser.parse_args()
+    settings = dict(setting.split('=', 1) for setting in args.setting)
+    random.seed(args.seed)
+    data = StandInData(args.episodes, args.recordings)
+    server = StandInServer(data, args.latency, args.error_rate, args.throttle_rate)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    temp_dir = tempfile.mkdtemp(prefix='tvmaze-scan-')
+    if args.shared_cache == 'directory':
+        settings.update(shared_cache='1', shared_cache_path=os.path.join(temp_dir, 'shared'))
+    elif args.shared_cache == 'http':
+        settings.update(shared_cache='2', shared_cache_url=server.base_url + KV_PATH)
+    show_ids = list(range(1, args.shows + 1))
+    if args.boxes:
+        args.workers = args.boxes
+        # Each instance starts the scan from a different show
+        chunks = [(show_ids[i * args.shows // args.boxes:]
+                   + show_ids[:i * args.shows // args.boxes], args.legacy_episodeguides)
+                  for i in range(args.boxes)]
+    else:
+        chunks = [(show_ids[i::args.workers], args.legacy_episodeguides)
+                  for i in range(args.workers)]
+    cache_dir = os.path.join(temp_dir, 'scrapers', ADDON_ID)
+    sys.path.insert(0, ADDON_DIR)
+    from libs import cache_snapshot  # pylint: disable=import-outside-toplevel,import-error
+    if args.import_snapshot:
+        os.makedirs(cache_dir)
+        print(f'Imported snapshot: {cache_snapshot.import_snapshot(args.import_snapshot, cache_dir)}')
+    if args.warm_up:
+        _create_video_database(os.path.join(temp_dir, 'database', 'MyVideos131.db'), show_ids,
+                               args.legacy_episodeguides)
+        start = time.perf_counter()
+        with multiprocessing.Pool(1, setup_kodi_environment,
+                                  (server.base_url, temp_dir, settings, args.rate_limit)) as pool:
+            refreshed = pool.apply(_warm_up_library)
+        warmup_requests = sum(server.requests.values())
+        print(f'Warm-up: {refreshed} shows refreshed in {time.perf_counter() - start:.2f}s, '
+              f'{warmup_requests} upstream requests')
+        # The report covers only the scan
+        server.requests.clear()
+    try:
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.workers, setup_kodi_environment,
+                                  (server.base_url, temp_dir, settings, args.rate_limit,
+                                   bool(args.boxes))) as pool:
+            results = pool.starmap(_scan_shows, chunks)
+        scan_time = time.perf_counter() - start
+        if args.export_snapshot:
+            print('Exported snapshot: '
+                  f'{cache_snapshot.export_snapshot(cache_dir, args.export_snapshot)}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    _print_report(args, server, results, scan_time)
+
+
+if __name__ == '__main__':
+    main()